@@ -1,16 +1,2406 @@
 # Copyright (c) 2019 Ultimaker B.V.
 # Cura is released under the terms of the LGPLv3 or higher.
 
-from ..Script import Script
+import argparse
+import array
+import bisect
+import collections
+import concurrent.futures
+import contextlib
+import copy
+import cProfile
+import glob
+import gzip
+import hashlib
+import io
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from typing import Any, Callable, Deque, Dict, IO, Iterable, Iterator, List, Optional, Pattern, Tuple, Union
 
-from UM.Application import Application #To get the current printer's settings.
-from UM.Logger import Logger
+try:
+    import numpy
+except ImportError: #NumPy is optional. Without it, MoveArrays are searched with loops.
+    numpy = None
 
-from typing import List, Tuple
+try:
+    import heatshrink2
+except ImportError: #Optional too. Without it, heatshrink compressed binary G-code is decompressed in Python, which is slower.
+    heatshrink2 = None
+
+try:
+    from ..Script import Script
+
+    from UM.Application import Application #To get the current printer's settings.
+    from UM.Logger import Logger
+except ImportError: #Not loaded by Cura's post processing plugin, e.g. run from the command line. Use stand-ins.
+    ##  Stand-in for the post processing plugin's Script base class.
+    #
+    #   Setting values start at the defaults from getSettingDataString() and
+    #   can be changed with setSettingValues().
+    class Script: # type: ignore
+        def __init__(self) -> None:
+            self._settings = {} # type: Dict[str, Any]
+            self._setting_types = {} # type: Dict[str, str]
+            for key, setting in json.loads(self.getSettingDataString())["settings"].items():
+                self._setting_types[key] = setting["type"]
+                self._settings[key] = setting.get("default_value")
+            for key, (setting_type, default_value) in _COMMAND_LINE_SETTINGS.items():
+                self._setting_types[key] = setting_type
+                self._settings[key] = default_value
+
+        def getSettingDataString(self) -> str:
+            raise NotImplementedError()
+
+        def getSettingValueByKey(self, key: str) -> Any:
+            return self._settings.get(key)
+
+        ##  Changes setting values. Strings are converted to the type of the
+        #   setting, so values can come straight from the command line.
+        def setSettingValues(self, values: Dict[str, Any]) -> None:
+            for key, value in values.items():
+                if key not in self._setting_types:
+                    raise KeyError("Unknown setting: {key}".format(key = key))
+                setting_type = self._setting_types[key]
+                if isinstance(value, str) and setting_type == "float":
+                    value = float(value)
+                elif isinstance(value, str) and setting_type == "int":
+                    value = int(value)
+                elif isinstance(value, str) and setting_type == "bool":
+                    value = value.lower() in ("1", "true", "yes", "y")
+                self._settings[key] = value
+
+        ##  Same as Script.getValue in Cura.
+        def getValue(self, line: str, key: str, default = None) -> Any:
+            if not key in line or (";" in line and line.find(key) > line.find(";")):
+                return default
+            sub_part = line[line.find(key) + 1:]
+            m = re.search("^-?[0-9]+\\.?[0-9]*", sub_part)
+            if m is None:
+                return default
+            try:
+                return int(m.group(0))
+            except ValueError: #Not an integer.
+                try:
+                    return float(m.group(0))
+                except ValueError: #Not a number at all.
+                    return default
+
+        ##  Same as Script.putValue in Cura.
+        def putValue(self, line: str = "", **kwargs) -> str:
+            #Strip the comment.
+            comment = ""
+            if ";" in line:
+                comment = line[line.find(";"):]
+                line = line[:line.find(";")] #Strip the comment.
+
+            #Parse the original g-code line.
+            for part in line.split(" "):
+                if part == "":
+                    continue
+                parameter = part[0]
+                if parameter in kwargs:
+                    continue #Skip this one. The user-provided parameter overwrites the one in the line.
+                value = part[1:]
+                kwargs[parameter] = value
+
+            #Write the new g-code line.
+            result = ""
+            priority_parameters = ["G", "M", "T", "S", "F", "X", "Y", "Z", "E"] #First some parameters that get priority. In order of priority!
+            for priority_key in priority_parameters:
+                if priority_key in kwargs:
+                    if result != "":
+                        result += " "
+                    result += priority_key + str(kwargs[priority_key])
+                    del kwargs[priority_key]
+            for key, value in kwargs.items():
+                if result != "":
+                    result += " "
+                result += key + str(value)
+
+            #Put the comment back in.
+            if comment != "":
+                if result != "":
+                    result += " "
+                result += ";" + comment
+
+            return result
+
+    ##  Stand-in for the printer's global container stack.
+    class _GlobalStack:
+        def __init__(self) -> None:
+            self.values = {
+                "machine_firmware_retract": False,
+                "machine_nozzle_temp_enabled": True,
+                "layer_height_0": 0.3,
+                "machine_acceleration": 4000,
+                "machine_width": 235,
+                "machine_depth": 235,
+                "machine_center_is_zero": False
+            } # type: Dict[str, Any]
+
+        def getProperty(self, key: str, property_name: str) -> Any:
+            return self.values.get(key)
+
+    ##  Stand-in for Cura's application, only giving access to the printer
+    #   settings that this script reads.
+    class Application: # type: ignore
+        _instance = None # type: Optional[Application]
+
+        def __init__(self) -> None:
+            self._global_stack = _GlobalStack()
+
+        @classmethod
+        def getInstance(cls) -> "Application":
+            if cls._instance is None:
+                cls._instance = cls()
+            return cls._instance
+
+        def getGlobalContainerStack(self) -> _GlobalStack:
+            return self._global_stack
+
+    ##  Stand-in for Uranium's logger that writes to stderr.
+    class Logger: # type: ignore
+        @classmethod
+        def log(cls, log_type: str, message: str, *args: Any) -> None:
+            sys.stderr.write("{log_type}: {message}\n".format(log_type = log_type.upper(), message = message % args if args else message))
+
+##  Matches a parameter letter and, if one follows directly, its number.
+#   The number part is the same pattern Script.getValue uses.
+_PARAMETER_REGEX = re.compile(r"([A-Z])(-?[0-9]+\.?[0-9]*)?")
+
+##  One G-code line, tokenized once.
+#
+#   Only the part of the line before the first ";" is parsed. Every letter
+#   keeps the value of its first occurrence, or None if no number follows it,
+#   so that params.get(key) gives the same result as Script.getValue(line, key).
+class GCodeLine:
+    __slots__ = ("command", "params")
+
+    def __init__(self, command: Optional[str], params: Dict[str, Union[int, float, None]]) -> None:
+        self.command = command #Command letter and number, e.g. "G1". None for comments and empty lines.
+        self.params = params
+
+_EMPTY_LINE = GCodeLine(None, {})
+
+##  Converts a matched number the same way Script.getValue does.
+def _toNumber(number: str) -> Union[int, float, None]:
+    if not number:
+        return None
+    try:
+        return int(number)
+    except ValueError: #Not an integer.
+        return float(number)
+
+##  Parses a line of G-code into its command and parameters in a single pass.
+def parseGCodeLine(line: str) -> GCodeLine:
+    if not line or line[0] == ";": #Fast path for empty and comment-only lines.
+        return _EMPTY_LINE
+    comment_start = line.find(";")
+    if comment_start >= 0:
+        line = line[:comment_start]
+    params = {} # type: Dict[str, Union[int, float, None]]
+    for key, number in _PARAMETER_REGEX.findall(line):
+        if key not in params:
+            params[key] = _toNumber(number)
+    command = None
+    if params:
+        letter = line.lstrip()[:1]
+        if letter in params and params[letter] is not None:
+            command = letter + str(params[letter])
+    return GCodeLine(command, params)
+
+##  Reads a setting holding one or more pause points.
+#
+#   The value may be a single number, a list of numbers or a comma-separated
+#   string. Returns the values sorted and without duplicates. Values that are
+#   not a (finite) number are logged as an error and left out, so that a
+#   typo doesn't abort the slice.
+def parsePausePoints(value, cast: type) -> List[Union[int, float]]:
+    if isinstance(value, str):
+        value = [part for part in value.split(",") if part.strip()]
+    elif not isinstance(value, (list, tuple)):
+        value = [value]
+    points = set()
+    for part in value:
+        try:
+            point = cast(part)
+        except (TypeError, ValueError):
+            Logger.log("e", "Ignoring pause point %r: it is not a number.", str(part).strip())
+            continue
+        if not math.isfinite(point):
+            Logger.log("e", "Ignoring pause point %r: it is not a finite number.", str(part).strip())
+            continue
+        points.add(point)
+    return sorted(points)
+
+##  Machine state at a point where a pause can be inserted.
+class PauseState:
+    __slots__ = ("index", "layer", "z", "height", "extrusion_f", "tool", "temperatures", "is_griffin", "negative_layers")
+
+    def __init__(self, index: int, layer: int, z: float, height: float, extrusion_f: float, tool: int, temperatures: Dict[int, float], is_griffin: bool, negative_layers: int) -> None:
+        self.index = index #Index of the layer in the G-code data.
+        self.layer = layer
+        self.z = z
+        self.height = height
+        self.extrusion_f = extrusion_f
+        self.tool = tool
+        self.temperatures = temperatures
+        self.is_griffin = is_griffin
+        self.negative_layers = negative_layers
+
+##  Matches the first G of a line, if a number follows it and it is not in a
+#   comment.
+_G_REGEX = re.compile(r"^[^;\nG]*G(-?[0-9]+\.?[0-9]*)", re.MULTILINE)
+_LINE_REGEXES = {} # type: Dict[str, Pattern[str]]
+
+##  Gets a regular expression that matches the lines that have the given
+#   letter before any comment.
+def _linesWithRegex(key: str) -> Pattern[str]:
+    regex = _LINE_REGEXES.get(key)
+    if regex is None:
+        regex = re.compile(r"^[^;\n{key}]*{key}[^\n]*".format(key = key), re.MULTILINE)
+        _LINE_REGEXES[key] = regex
+    return regex
+
+##  Finds the last line between start and end that has a number for the given
+#   letter, searching backwards so that only the end of the text is parsed.
+#   \param start: Position of the start of a line.
+#   \param accept: Optional further condition on the parameters of the line.
+#   \return The start and the parameters of the line, or -1 and None if there
+#   is no such line, and the number of lines parsed to find it.
+def _lastParams(text: str, key: str, start: int, end: int, accept: Optional[Callable[[Dict[str, Union[int, float, None]]], bool]] = None) -> Tuple[int, Optional[Dict[str, Union[int, float, None]]], int]:
+    position = end
+    parsed = 0
+    while True:
+        position = text.rfind(key, start, position)
+        if position < 0:
+            return -1, None, parsed
+        line_start = text.rfind("\n", start, position) + 1 or start
+        line_end = text.find("\n", position, end)
+        params = parseGCodeLine(text[line_start:line_end if line_end >= 0 else end]).params
+        parsed += 1
+        if params.get(key) is not None and (accept is None or accept(params)):
+            return line_start, params, parsed
+        position = line_start
+
+##  Finds the lines between start and end that start with T or have an M,
+#   the only lines that can change the tool or a target temperature. M is
+#   rare enough in G-code, also in comments, to search for every occurrence.
+#   \return The start and end of every such line, in order.
+def _toolAndMLines(text: str, start: int, end: int) -> List[Tuple[int, int]]:
+    lines = {} # type: Dict[int, int]
+    position = text.find("M", start, end)
+    while position >= 0:
+        line_start = text.rfind("\n", start, position) + 1 or start
+        line_end = text.find("\n", position, end)
+        if line_end < 0:
+            line_end = end
+        lines[line_start] = line_end
+        position = text.find("M", line_end, end)
+    line_start = start if text.startswith("T", start, end) else None # type: Optional[int]
+    position = start
+    while True:
+        if line_start is not None:
+            position = text.find("\n", line_start, end)
+            if position < 0:
+                position = end
+            lines[line_start] = position
+        line_start = text.find("\nT", position, end) + 1
+        if line_start <= 0:
+            break
+    return sorted(lines.items())
+
+##  Gets the end of the line at the given position, after its new line.
+def _lineEnd(text: str, position: int) -> int:
+    line_end = text.find("\n", position)
+    return len(text) if line_end < 0 else line_end + 1
+
+##  What reading a range of G-code does to a _ScanState, whatever the state
+#   was before. The effects of ranges can be found independently, e.g. in
+#   other processes, and then applied to the state in order.
+class _ScanEffects:
+    __slots__ = ("is_griffin", "starts_layers", "negative_layers", "tool_events", "extrusion_f", "z", "started_extrusion_f", "started_z", "lines_parsed")
+
+    def __init__(self) -> None:
+        self.is_griffin = False
+        self.starts_layers = False #Whether the range has the ;LAYER:0 comment.
+        self.negative_layers = 0
+        self.tool_events = [] # type: List[Tuple[bool, Optional[int], Optional[float]]] #Per T or M line: whether it sets the tool, its T and the temperature it sets, if any.
+        self.extrusion_f = None # type: Optional[float] #Last extrusion feed rate in the range.
+        self.z = None # type: Optional[float] #Last Z in the range.
+        self.started_extrusion_f = None # type: Optional[float] #Same, but only from the ;LAYER:0 comment on.
+        self.started_z = None # type: Optional[float]
+        self.lines_parsed = 0 #Lines that finding the effects parsed, for the statistics.
+
+##  Reads the lines between start and end, which must be the start of a line
+#   and the end of a line (or of the text).
+#
+#   Only the few lines that can change the state are parsed; the rest are
+#   skipped by searching the text.
+def _scanEffects(text: str, start: int, end: int) -> _ScanEffects:
+    effects = _ScanEffects()
+    effects.is_griffin = text.find(";FLAVOR:Griffin", start, end) >= 0
+
+    # Feed rate and Z only count from the first positive layer on
+    started_at = None # type: Optional[int]
+    position = text.find(";LAYER:", start, end)
+    while position >= 0:
+        line_start = text.rfind("\n", start, position) + 1 or start
+        line_end = text.find("\n", position, end)
+        if line_end < 0:
+            line_end = end
+        line = text[line_start:line_end]
+        # Fist positive layer reached
+        if ";LAYER:0" in line:
+            if started_at is None:
+                started_at = line_start
+        # Count nbr of negative layers (raft)
+        elif ";LAYER:-" in line:
+            effects.negative_layers += 1
+        position = text.find(";LAYER:", line_end, end)
+    effects.starts_layers = started_at is not None
+
+    #Track the latest printing temperature in order to resume at the correct temperature.
+    for line_start, line_end in _toolAndMLines(text, start, end):
+        line = text[line_start:line_end]
+        params = parseGCodeLine(line).params
+        effects.lines_parsed += 1
+        sets_tool = line.startswith("T")
+        m = params.get("M")
+        temperature = None
+        if m is not None and (m == 104 or m == 109):
+            temperature = params.get("S")
+        if sets_tool or temperature is not None:
+            effects.tool_events.append((sets_tool, params.get("T"), temperature))
+
+    # Look for the feed rate of the last extrusion instruction
+    line_start, params, parsed = _lastParams(text, "F", start, end, lambda params: params.get("E") is not None)
+    effects.lines_parsed += parsed
+    if params is not None:
+        effects.extrusion_f = params["F"]
+        if started_at is not None and line_start >= started_at:
+            effects.started_extrusion_f = params["F"]
+
+    # If a Z instruction is in the text, read the last Z
+    line_start, params, parsed = _lastParams(text, "Z", start, end)
+    effects.lines_parsed += parsed
+    if params is not None:
+        effects.z = params["Z"]
+        if started_at is not None and line_start >= started_at:
+            effects.started_z = params["Z"]
+    return effects
+
+##  Tracks the state that execute() needs while reading G-code.
+class _ScanState:
+    __slots__ = ("layers_started", "negative_layers", "is_griffin", "z", "extrusion_f", "tool", "temperatures")
+
+    def __init__(self) -> None:
+        self.layers_started = False
+        self.negative_layers = 0
+        self.is_griffin = False
+        self.z = 0
+        self.extrusion_f = 0
+        self.tool = 0 #Tracks the current extruder for tracking the target temperature.
+        self.temperatures = {} # type: Dict[int, float] #Tracks the current target temperature for each extruder.
+
+    def copy(self) -> "_ScanState":
+        result = _ScanState()
+        result.layers_started = self.layers_started
+        result.negative_layers = self.negative_layers
+        result.is_griffin = self.is_griffin
+        result.z = self.z
+        result.extrusion_f = self.extrusion_f
+        result.tool = self.tool
+        result.temperatures = dict(self.temperatures)
+        return result
+
+    ##  Reads the lines between start and end, which must be the start of a
+    #   line and the end of a line (or of the text).
+    #
+    #   The result is the same as reading every line in turn.
+    def scan(self, text: str, start: int, end: int) -> None:
+        self.apply(_scanEffects(text, start, end))
+
+    ##  Changes the state as reading the range of G-code with the given
+    #   effects would.
+    def apply(self, effects: _ScanEffects) -> None:
+        if effects.is_griffin:
+            self.is_griffin = True
+        self.negative_layers += effects.negative_layers
+        for sets_tool, tool, temperature in effects.tool_events:
+            if sets_tool:
+                self.tool = tool
+            if temperature is not None:
+                self.temperatures[tool if tool is not None else self.tool] = temperature
+
+        if self.layers_started:
+            extrusion_f = effects.extrusion_f
+            z = effects.z
+        elif effects.starts_layers:
+            self.layers_started = True
+            extrusion_f = effects.started_extrusion_f
+            z = effects.started_z
+        else:
+            return
+        if extrusion_f is not None:
+            self.extrusion_f = extrusion_f
+        if z is not None:
+            self.z = z
+
+##  Metadata of one entry of the G-code data, normally one layer.
+class LayerInfo:
+    __slots__ = ("number", "ends_with_newline")
+
+    def __init__(self, layer: str) -> None:
+        self.number = None # type: Optional[int] #Number from the ;LAYER: comment, or None for the start and end code.
+        self.ends_with_newline = layer.endswith("\n")
+
+##  Gets the first X and Y of a layer, or None if it has none.
+#   \return The X and Y and the number of lines parsed to find them.
+def _firstXY(layer: str) -> Tuple[Optional[Tuple[float, float]], int]:
+    parsed = 0
+    for match in _linesWithRegex("X").finditer(layer):
+        params = parseGCodeLine(match.group()).params
+        parsed += 1
+        x = params.get("X")
+        y = params.get("Y")
+        if x is not None and y is not None:
+            return (x, y), parsed
+    return None, parsed
+
+##  Gets the last non-negative E value of a layer, as found by browsing the
+#   layer backwards. If there is none, the E value of the first line, or -1.
+#   \return The E value and the number of lines parsed to find it.
+def _lastE(layer: str) -> Tuple[float, int]:
+    _, params, parsed = _lastParams(layer, "E", 0, len(layer), lambda params: params["E"] >= 0)
+    if params is not None:
+        return params["E"], parsed
+    e = parseGCodeLine(layer[:_lineEnd(layer, 0)].rstrip("\n")).params.get("E")
+    return e if e is not None else -1, parsed + 1
+
+##  Gets the first E value in a layer that differs from the given one.
+#   \return The E value and the number of lines parsed to find it.
+def _firstEDifferentFrom(layer: str, e: float) -> Tuple[float, int]:
+    parsed = 0
+    for match in _linesWithRegex("E").finditer(layer):
+        value = parseGCodeLine(match.group()).params.get("E")
+        parsed += 1
+        if value is not None and value != e:
+            return value, parsed
+    return e, parsed
+
+##  Letters of the columns of MoveArrays.
+_MOVE_COLUMNS = ("G", "X", "Y", "Z", "E", "F")
+_MOVE_NUMBER_WIDTH = 15 #Numbers up to this long (with the sign) are parsed vectorized, longer ones line by line. Their digits must fit exactly in a float.
+if numpy is not None:
+    _MOVE_LETTER_TABLE = numpy.zeros(256, dtype = numpy.uint8) #Column number plus one of every byte that is a column letter.
+    for _column_number, _letter in enumerate(_MOVE_COLUMNS):
+        _MOVE_LETTER_TABLE[ord(_letter)] = _column_number + 1
+    _MOVE_DIGIT_WEIGHTS = numpy.concatenate(([0.0], 10.0 ** numpy.arange(_MOVE_NUMBER_WIDTH - 1, -1, -1))) #Place value of each of the 16 bytes before the end of a number.
+    _POWERS_OF_TEN = 10.0 ** numpy.arange(_MOVE_NUMBER_WIDTH + 1)
+
+##  Gets the remainder of whole numbers below 2^53 divided by powers of ten,
+#   with NumPy. Faster than numpy.fmod, and as exact: the quotient is never
+#   rounded up to the next whole number, since 1 / divisor is more than half
+#   its precision.
+def _remainder(dividend: Any, divisor: Any) -> Any:
+    return dividend - numpy.floor(dividend / divisor) * divisor
+
+##  The lines of one layer as arrays of numbers, one array per letter in
+#   _MOVE_COLUMNS and one row per line.
+#
+#   Every row holds the value of the first occurrence of the letter in the
+#   line, as parseGCodeLine gives it, or NaN if there is none. That takes 48
+#   bytes per line, where the line itself takes a Python string, and makes
+#   questions about a whole layer vectorized operations if NumPy is
+#   installed. Without NumPy, the columns are plain arrays that are searched
+#   with loops.
+#
+#   The values are floats, so the exact value (e.g. 10 rather than 10.0) is
+#   read back from the line that a query finds.
+class MoveArrays:
+    __slots__ = ("rows", "columns", "lines_parsed_singly")
+
+    def __init__(self, layer: str) -> None:
+        self.lines_parsed_singly = 0 #Lines parsed with parseGCodeLine rather than vectorized, for the statistics.
+        if numpy is not None:
+            self.columns, self.lines_parsed_singly = self._parseVectorized(layer) # type: Dict[str, Any], int
+        else:
+            nan = float("nan")
+            self.columns = {key: array.array("d") for key in _MOVE_COLUMNS}
+            for line in layer.split("\n"):
+                params = parseGCodeLine(line).params
+                for key in _MOVE_COLUMNS:
+                    value = params.get(key)
+                    self.columns[key].append(nan if value is None else value)
+            self.lines_parsed_singly = len(self.columns["G"])
+        self.rows = len(self.columns["G"])
+
+    ##  Parses all lines at once on the bytes of the layer. UTF-8 only uses
+    #   bytes above 127 for other characters, so the new lines, semicolons,
+    #   letters and digits are found as they are.
+    #   \return The columns and the number of lines that had to be parsed
+    #   line by line.
+    @staticmethod
+    def _parseVectorized(layer: str) -> Tuple[Dict[str, Any], int]:
+        width = _MOVE_NUMBER_WIDTH
+        text = numpy.frombuffer(layer.encode("utf-8", "surrogatepass") + b"\0" * width, dtype = numpy.uint8) #The zeros end the last number.
+        size = len(text) - width
+        newlines = numpy.flatnonzero(text == ord("\n"))
+        rows = len(newlines) + 1
+        values = numpy.full((len(_MOVE_COLUMNS), rows), numpy.nan)
+        columns = {key: values[key_number] for key_number, key in enumerate(_MOVE_COLUMNS)}
+
+        # Everything from the first semicolon of a line on is a comment
+        semicolons = numpy.flatnonzero(text == ord(";"))
+        semicolon_lines = numpy.searchsorted(newlines, semicolons)
+        first = numpy.concatenate(([True], semicolon_lines[1:] != semicolon_lines[:-1]))[:len(semicolons)]
+        comment_starts = numpy.full(rows, size)
+        comment_starts[semicolon_lines[first]] = semicolons[first]
+
+        # Only the first occurrence of a letter in a line counts. The column
+        # letters are E to G and X to Z.
+        letters = numpy.flatnonzero(((text[:size] - ord("E")) <= 2) | ((text[:size] - ord("X")) <= 2))
+        keys = _MOVE_LETTER_TABLE[text[letters]].astype(numpy.int64) - 1
+        lines = numpy.searchsorted(newlines, letters)
+        in_code = (keys >= 0) & (letters < comment_starts[lines])
+        letters = letters[in_code]
+        lines = lines[in_code]
+        keys = keys[in_code]
+        repeated = numpy.zeros(len(letters), dtype = bool)
+        distance = 1 #The letters of a line are next to each other, so compare each with the ones up to this far before it.
+        while distance < len(letters):
+            same_line = lines[distance:] == lines[:-distance]
+            if not same_line.any():
+                break
+            repeated[distance:] |= same_line & (keys[distance:] == keys[:-distance])
+            distance += 1
+        letters = letters[~repeated]
+        lines = lines[~repeated]
+        keys = keys[~repeated]
+
+        # The number is -?[0-9]+\.?[0-9]* right after the letter
+        not_digits = numpy.flatnonzero((text - ord("0")) > 9) #Includes the zeros at the end.
+        digits_start = letters + 1 + (text[letters + 1] == ord("-"))
+        integer_end = not_digits[numpy.searchsorted(not_digits, digits_start)]
+        has_number = integer_end > digits_start
+        has_point = text[integer_end] == ord(".")
+        ends = numpy.where(has_point, not_digits[numpy.searchsorted(not_digits, integer_end + 1)], integer_end)
+        lengths = ends - digits_start
+        too_long = has_number & (ends - letters - 1 > width) #With the minus sign.
+        parsed = has_number & ~too_long
+        ends = ends[parsed]
+        lengths = lengths[parsed]
+        has_point = has_point[parsed]
+        fraction_digits = numpy.where(has_point, ends - integer_end[parsed] - 1, 0)
+
+        # The 16 bytes before the end of every number are read as two
+        # 8-byte words, and their digits are added up with their place values
+        # as if the point were a zero. Everything before the number is
+        # removed by the remainder of a division by a power of ten. The
+        # integers stay below 2^53, so this is exact, and dividing by a power
+        # of ten rounds the same way as float() does.
+        padded = numpy.concatenate((numpy.zeros(16, dtype = numpy.uint8), text))
+        words = numpy.ndarray((len(padded) - 7,), dtype = numpy.uint64, buffer = padded, strides = (1,))
+        window = numpy.empty((len(ends), 2), dtype = numpy.uint64)
+        window[:, 0] = words[ends]
+        window[:, 1] = words[ends + 8]
+        digits = window.view(numpy.uint8) - numpy.uint8(ord("0"))
+        digits *= digits < 10
+        scaled = _remainder(digits.astype(numpy.float64) @ _MOVE_DIGIT_WEIGHTS, _POWERS_OF_TEN[lengths])
+        fraction = _remainder(scaled, _POWERS_OF_TEN[fraction_digits])
+        numbers = numpy.where(has_point, (scaled - fraction) / 10 + fraction, scaled) / _POWERS_OF_TEN[fraction_digits]
+        values[keys[parsed], lines[parsed]] = numpy.where(text[letters[parsed] + 1] == ord("-"), -numbers, numbers)
+
+        # Numbers that don't fit in the window are parsed from their lines
+        if not too_long.any():
+            return columns, 0
+        layer_lines = layer.split("\n")
+        long_lines = numpy.unique(lines[too_long])
+        for line_number in long_lines:
+            params = parseGCodeLine(layer_lines[line_number]).params
+            for key in _MOVE_COLUMNS:
+                value = params.get(key)
+                columns[key][line_number] = numpy.nan if value is None else value
+        return columns, len(long_lines)
+
+    ##  Gets the first row with both an X and a Y, or None.
+    def firstXYRow(self) -> Optional[int]:
+        x = self.columns["X"]
+        y = self.columns["Y"]
+        if numpy is not None:
+            return self._first(~numpy.isnan(x) & ~numpy.isnan(y))
+        for row in range(self.rows):
+            if x[row] == x[row] and y[row] == y[row]: #Not NaN.
+                return row
+        return None
+
+    ##  Gets the last row with an E that is not negative, or None.
+    def lastNonNegativeERow(self) -> Optional[int]:
+        e = self.columns["E"]
+        if numpy is not None:
+            with numpy.errstate(invalid = "ignore"):
+                rows = numpy.flatnonzero(e >= 0)
+            return int(rows[-1]) if len(rows) else None
+        for row in range(self.rows - 1, -1, -1):
+            if e[row] >= 0:
+                return row
+        return None
+
+    ##  Gets the first row with an E that differs from the given one, or
+    #   None.
+    def firstERowDifferentFrom(self, value: float) -> Optional[int]:
+        e = self.columns["E"]
+        if numpy is not None:
+            return self._first(~numpy.isnan(e) & (e != value))
+        for row in range(self.rows):
+            if e[row] == e[row] and e[row] != value:
+                return row
+        return None
+
+    ##  Gets the first G0 or G1, or None.
+    def firstMoveRow(self) -> Optional[int]:
+        g = self.columns["G"]
+        if numpy is not None:
+            return self._first((g == 0) | (g == 1))
+        for row in range(self.rows):
+            if g[row] == 0 or g[row] == 1:
+                return row
+        return None
+
+    ##  Gets a column where every NaN is replaced by the last value before
+    #   it, e.g. to know the position at every line. Rows before the first
+    #   value get the given initial value.
+    def filled(self, key: str, initial: float) -> Any:
+        column = self.columns[key]
+        if numpy is not None:
+            known = ~numpy.isnan(column)
+            last_known = numpy.maximum.accumulate(numpy.where(known, numpy.arange(self.rows), -1))
+            return numpy.where(last_known >= 0, column[numpy.maximum(last_known, 0)], initial)
+        result = array.array("d")
+        value = initial
+        for row_value in column:
+            if row_value == row_value:
+                value = row_value
+            result.append(value)
+        return result
+
+    ##  Gets the last X and the last Y, or None if there is no X or no Y.
+    def lastXY(self) -> Optional[Tuple[float, float]]:
+        last = []
+        for key in ("X", "Y"):
+            column = self.columns[key]
+            if numpy is not None:
+                rows = numpy.flatnonzero(~numpy.isnan(column))
+                if not len(rows):
+                    return None
+                last.append(float(column[rows[-1]]))
+                continue
+            for row in range(self.rows - 1, -1, -1):
+                if column[row] == column[row]:
+                    last.append(column[row])
+                    break
+            else:
+                return None
+        return last[0], last[1]
+
+    ##  Gets the start and end points of every extruding move: a G1 with an E
+    #   and an X or Y.
+    #   \return The X and the Y of the points, as arrays if NumPy is
+    #   installed.
+    def extrusionPoints(self) -> Tuple[Any, Any]:
+        g = self.columns["G"]
+        e = self.columns["E"]
+        x = self.filled("X", float("nan"))
+        y = self.filled("Y", float("nan"))
+        if numpy is not None:
+            rows = numpy.flatnonzero((g == 1) & ~numpy.isnan(e) & ~(numpy.isnan(self.columns["X"]) & numpy.isnan(self.columns["Y"])))
+            rows = numpy.concatenate((rows[rows > 0] - 1, rows)) #Where every move starts and ends.
+            known = ~numpy.isnan(x[rows]) & ~numpy.isnan(y[rows])
+            return x[rows][known], y[rows][known]
+        xs = array.array("d")
+        ys = array.array("d")
+        for row in range(self.rows):
+            if g[row] == 1 and e[row] == e[row] and (self.columns["X"][row] == self.columns["X"][row] or self.columns["Y"][row] == self.columns["Y"][row]):
+                for point_row in (row - 1, row) if row > 0 else (row,):
+                    if x[point_row] == x[point_row] and y[point_row] == y[point_row]:
+                        xs.append(x[point_row])
+                        ys.append(y[point_row])
+        return xs, ys
+
+    @staticmethod
+    def _first(mask: Any) -> Optional[int]:
+        rows = numpy.flatnonzero(mask)
+        return int(rows[0]) if len(rows) else None
+
+##  Gets the length of G-code in bytes of UTF-8.
+def _byteLength(text: str) -> int:
+    if text.isascii():
+        return len(text)
+    return len(text.encode("utf-8", "surrogateescape"))
+
+##  Gets a line of a layer by its number.
+def _lineAt(layer: str, row: int) -> str:
+    return layer.split("\n", row + 1)[row]
+
+##  Gets the corners of the footprint of a layer, counter-clockwise: the
+#   bounding box or the convex hull of where it extrudes. None if it doesn't
+#   extrude.
+def _footprint(move_arrays: MoveArrays, hull: bool) -> Optional[List[Tuple[float, float]]]:
+    xs, ys = move_arrays.extrusionPoints()
+    if not len(xs):
+        return None
+    if not hull:
+        min_x, max_x, min_y, max_y = float(min(xs)), float(max(xs)), float(min(ys)), float(max(ys))
+        return [(min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y)]
+    if numpy is not None:
+        points = numpy.unique(numpy.column_stack((xs, ys)), axis = 0) #Sorted by X, then Y.
+        if len(points) > 8:
+            # Points inside the polygon of the extreme points in eight
+            # directions can't be on the hull (Akl-Toussaint heuristic).
+            x, y = points[:, 0], points[:, 1]
+            extremes = [numpy.argmin(y), numpy.argmax(x - y), numpy.argmax(x), numpy.argmax(x + y), numpy.argmax(y), numpy.argmin(x - y), numpy.argmin(x), numpy.argmin(x + y)]
+            corners = points[list(dict.fromkeys(int(extreme) for extreme in extremes))]
+            if len(corners) >= 3:
+                edges = numpy.roll(corners, -1, axis = 0) - corners
+                crosses = edges[:, 0, None] * (y[None, :] - corners[:, 1, None]) - edges[:, 1, None] * (x[None, :] - corners[:, 0, None])
+                points = points[~(crosses > 1e-9).all(axis = 0)]
+        points = [(float(x), float(y)) for x, y in points]
+    else:
+        points = sorted(set(zip(xs, ys)))
+    return _convexHull(points)
+
+##  Gets the footprint of two footprints together, e.g. of the layers printed
+#   so far and the next layer. Either can be None if it doesn't extrude.
+def _mergeFootprints(first: Optional[List[Tuple[float, float]]], second: Optional[List[Tuple[float, float]]], hull: bool) -> Optional[List[Tuple[float, float]]]:
+    if first is None or second is None:
+        return first if second is None else second
+    if not hull:
+        xs = [x for x, _ in first + second]
+        ys = [y for _, y in first + second]
+        min_x, max_x, min_y, max_y = min(xs), max(xs), min(ys), max(ys)
+        return [(min_x, min_y), (max_x, min_y), (max_x, max_y), (min_x, max_y)]
+    return _convexHull(sorted(set(first + second)))
+
+##  Gets the convex hull of points sorted by X and then Y, counter-clockwise,
+#   with Andrew's monotone chain.
+def _convexHull(points: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+    if len(points) < 3:
+        return list(points)
+
+    def halfHull(ordered: Iterable[Tuple[float, float]]) -> List[Tuple[float, float]]:
+        chain = [] # type: List[Tuple[float, float]]
+        for point in ordered:
+            while len(chain) >= 2 and (chain[-1][0] - chain[-2][0]) * (point[1] - chain[-2][1]) - (chain[-1][1] - chain[-2][1]) * (point[0] - chain[-2][0]) <= 0:
+                chain.pop()
+            chain.append(point)
+        return chain
+
+    lower = halfHull(points)
+    upper = halfHull(reversed(points))
+    return lower[:-1] + upper[:-1]
+
+_PARK_CANDIDATE_EDGES = 16 #Edges of the footprint nearest to the head to try to leave the footprint across.
+
+##  Finds where to park the head during a pause: the point at least the
+#   clearance away from the footprint and on the bed with the shortest travel
+#   from where the head stops, to there and back to where it resumes.
+#
+#   Tries moving straight out across the nearest edges of the footprint and
+#   to its nearest corners, from where the head stops and from where it
+#   resumes. Of points with the same travel, to a micrometre, the one with
+#   the lowest X and then Y is taken, with or without NumPy.
+#   \param footprint: Corners of the footprint, counter-clockwise.
+#   \param start: Where the head stops, if known.
+#   \param end: Where the head resumes.
+#   \param bed: Smallest X and Y and largest X and Y of the bed.
+#   \return The park position, or None if there is no room on the bed.
+def _parkPosition(footprint: List[Tuple[float, float]], start: Optional[Tuple[float, float]], end: Tuple[float, float], bed: Tuple[float, float, float, float], clearance: float) -> Optional[Tuple[float, float]]:
+    # Edges as outward unit normals and their distance from the origin.
+    normals = [] # type: List[Tuple[float, float]]
+    offsets = [] # type: List[float]
+    corners = [] # type: List[Tuple[float, float]]
+    for position, (x, y) in enumerate(footprint):
+        next_x, next_y = footprint[(position + 1) % len(footprint)]
+        length = math.hypot(next_x - x, next_y - y)
+        if length > 0:
+            normals.append(((next_y - y) / length, (x - next_x) / length))
+            offsets.append(normals[-1][0] * x + normals[-1][1] * y)
+            corners.append((x, y))
+    if not normals:
+        normals = [(1.0, 0.0), (0.0, 1.0), (-1.0, 0.0), (0.0, -1.0)] #A single point: its bounding box.
+        x, y = footprint[0]
+        offsets = [x, y, -x, -y]
+        corners = [footprint[0]] * 4
+    count = min(len(normals), _PARK_CANDIDATE_EDGES)
+    points = [point for point in (start, end) if point is not None]
+
+    if numpy is not None:
+        normal_array = numpy.array(normals)
+        offset_array = numpy.array(offsets)
+        corner_array = numpy.array(corners)
+        previous_normals = numpy.roll(normal_array, 1, axis = 0)
+        miters = corner_array + clearance * (previous_normals + normal_array) / numpy.maximum(1 + (previous_normals * normal_array).sum(axis = 1), 1e-9)[:, None] #Corners of the footprint grown by the clearance.
+        candidates = []
+        for point in points:
+            distances = normal_array @ numpy.array(point) - offset_array
+            nearest = numpy.argpartition(-distances, count - 1)[:count]
+            candidates.append(numpy.array(point) + normal_array[nearest] * (clearance - distances[nearest])[:, None])
+            nearest_corners = numpy.argpartition(numpy.hypot(*(miters - numpy.array(point)).T), count - 1)[:count]
+            candidates.append(miters[nearest_corners])
+        candidates = numpy.concatenate(candidates)
+        outside = (candidates @ normal_array.T - offset_array).max(axis = 1) >= clearance - 1e-6
+        on_bed = (candidates[:, 0] >= bed[0]) & (candidates[:, 1] >= bed[1]) & (candidates[:, 0] <= bed[2]) & (candidates[:, 1] <= bed[3])
+        candidates = candidates[outside & on_bed]
+        if not len(candidates):
+            return None
+        travel = numpy.hypot(*(candidates - numpy.array(end)).T)
+        if start is not None:
+            travel += numpy.hypot(*(candidates - numpy.array(start)).T)
+        rounded = numpy.round(candidates, 3)
+        best = candidates[numpy.lexsort((rounded[:, 1], rounded[:, 0], numpy.round(travel, 6)))[0]]
+        return float(best[0]), float(best[1])
+
+    miter_list = []
+    for position, (x, y) in enumerate(corners):
+        previous_normal, normal = normals[position - 1], normals[position]
+        scale = clearance / max(1 + previous_normal[0] * normal[0] + previous_normal[1] * normal[1], 1e-9)
+        miter_list.append((x + scale * (previous_normal[0] + normal[0]), y + scale * (previous_normal[1] + normal[1])))
+    candidate_list = [] # type: List[Tuple[float, float]]
+    for point_x, point_y in points:
+        distances = [normal[0] * point_x + normal[1] * point_y - offset for normal, offset in zip(normals, offsets)]
+        for edge in sorted(range(len(normals)), key = lambda edge: -distances[edge])[:count]:
+            move = clearance - distances[edge]
+            candidate_list.append((point_x + normals[edge][0] * move, point_y + normals[edge][1] * move))
+        candidate_list.extend(sorted(miter_list, key = lambda miter: math.hypot(miter[0] - point_x, miter[1] - point_y))[:count])
+    best_point = None
+    best_key = (float("inf"), 0.0, 0.0)
+    for x, y in candidate_list:
+        if not (bed[0] <= x <= bed[2] and bed[1] <= y <= bed[3]):
+            continue
+        if max(normal[0] * x + normal[1] * y - offset for normal, offset in zip(normals, offsets)) < clearance - 1e-6:
+            continue
+        travel = math.hypot(x - end[0], y - end[1]) + (math.hypot(x - start[0], y - start[1]) if start is not None else 0)
+        key = (round(travel, 6), round(x, 3), round(y, 3))
+        if key < best_key:
+            best_point = (float(x), float(y))
+            best_key = key
+    return best_point
+
+##  Position and feed rate of the print head, carried from one entry of the
+#   G-code data to the next when estimating the print time.
+class _Motion:
+    __slots__ = ("x", "y", "z", "e", "f")
+
+    def __init__(self) -> None:
+        self.x = 0.0
+        self.y = 0.0
+        self.z = 0.0
+        self.e = 0.0
+        self.f = 0.0
+
+    def copy(self) -> "_Motion":
+        motion = _Motion()
+        motion.x, motion.y, motion.z, motion.e, motion.f = self.x, self.y, self.z, self.e, self.f
+        return motion
+
+##  Estimates how long the G0/G1 moves of one entry of the G-code data take.
+#
+#   Every move speeds up and slows down with the given acceleration between
+#   its feed rate and the speeds at its ends, or as far as its length allows.
+#   The speed through a corner is the lower feed rate of the two moves times
+#   the cosine of the angle between them, so that the head keeps its speed
+#   on a straight line and stops at a sharp corner. Every entry starts and
+#   ends standing still. Moves without X, Y or Z are timed by their E
+#   distance. Dwells and relative positioning (G91, M83) are not counted.
+#   \param move_arrays: The moves of the entry.
+#   \param motion: Position and feed rate before the entry, which is changed
+#   to the position and feed rate after it.
+#   \param acceleration: Acceleration in mm/s², or 0 to ignore acceleration.
+#   \return Estimated seconds.
+def _estimateMoveTime(move_arrays: MoveArrays, motion: _Motion, acceleration: float) -> float:
+    if not acceleration or acceleration <= 0:
+        acceleration = math.inf
+    g = move_arrays.columns["G"]
+    x = move_arrays.filled("X", motion.x)
+    y = move_arrays.filled("Y", motion.y)
+    z = move_arrays.filled("Z", motion.z)
+    e = move_arrays.filled("E", motion.e)
+    f = move_arrays.filled("F", motion.f)
+    last = move_arrays.rows - 1
+    start_x, start_y, start_z, start_e = motion.x, motion.y, motion.z, motion.e
+    motion.x, motion.y, motion.z, motion.e, motion.f = float(x[last]), float(y[last]), float(z[last]), float(e[last]), float(f[last])
+
+    if numpy is None:
+        # Every move is timed when the next one is found, since that gives
+        # the speed at its end
+        seconds = 0.0
+        previous_distance = 0.0
+        previous_speed = 0.0
+        previous_entry = 0.0
+        previous_direction = (0.0, 0.0, 0.0)
+        for row in range(move_arrays.rows):
+            if g[row] == 0 or g[row] == 1:
+                dx, dy, dz = x[row] - start_x, y[row] - start_y, z[row] - start_z
+                length = math.sqrt(dx * dx + dy * dy + dz * dz)
+                distance = length if length > 0 else abs(e[row] - start_e)
+                speed = f[row] / 60
+                if distance > 0 and speed > 0:
+                    direction = (dx / length, dy / length, dz / length) if length > 0 else (0.0, 0.0, 0.0)
+                    cosine = sum(a * b for a, b in zip(previous_direction, direction))
+                    junction = min(previous_speed, speed) * max(0.0, min(1.0, cosine))
+                    if previous_distance > 0:
+                        seconds += _trapezoidTime(previous_distance, previous_speed, previous_entry, junction, acceleration)
+                    previous_distance, previous_speed, previous_entry, previous_direction = distance, speed, junction, direction
+            start_x, start_y, start_z, start_e = x[row], y[row], z[row], e[row]
+        if previous_distance > 0:
+            seconds += _trapezoidTime(previous_distance, previous_speed, previous_entry, 0.0, acceleration)
+        return seconds
+
+    rows = numpy.flatnonzero((g == 0) | (g == 1))
+    if len(rows) == 0:
+        return 0.0
+    before = rows - 1
+    has_before = before >= 0
+    before = numpy.maximum(before, 0)
+    dx = x[rows] - numpy.where(has_before, x[before], start_x)
+    dy = y[rows] - numpy.where(has_before, y[before], start_y)
+    dz = z[rows] - numpy.where(has_before, z[before], start_z)
+    de = e[rows] - numpy.where(has_before, e[before], start_e)
+    lengths = numpy.sqrt(dx * dx + dy * dy + dz * dz)
+    distances = numpy.where(lengths > 0, lengths, numpy.abs(de))
+    speeds = f[rows] / 60
+    moving = (distances > 0) & (speeds > 0)
+    if not moving.any():
+        return 0.0
+    lengths = lengths[moving]
+    with numpy.errstate(invalid = "ignore", divide = "ignore"):
+        directions = numpy.where(lengths > 0, numpy.stack((dx[moving], dy[moving], dz[moving])) / lengths, 0.0)
+    distances = distances[moving]
+    speeds = speeds[moving]
+    cosines = numpy.clip((directions[:, :-1] * directions[:, 1:]).sum(axis = 0), 0.0, 1.0)
+    junctions = numpy.minimum(speeds[:-1], speeds[1:]) * cosines
+    entries = numpy.concatenate(([0.0], junctions))
+    exits = numpy.concatenate((junctions, [0.0]))
+    return float(_trapezoidTime(distances, speeds, entries, exits, acceleration).sum())
+
+##  Gets the time from the start of the print in the last ;TIME_ELAPSED:
+#   comment of an entry of the G-code data, or None if it has none.
+def _timeElapsed(layer: str) -> Optional[float]:
+    position = layer.rfind(";TIME_ELAPSED:")
+    while position > 0 and layer[position - 1] != "\n": #Not at the start of a line.
+        position = layer.rfind(";TIME_ELAPSED:", 0, position)
+    if position < 0:
+        return None
+    line_end = layer.find("\n", position)
+    try:
+        elapsed = float(layer[position + len(";TIME_ELAPSED:"):line_end if line_end >= 0 else len(layer)])
+    except ValueError:
+        return None
+    return elapsed if math.isfinite(elapsed) and elapsed >= 0 else None
+
+##  Time of a move that goes from one speed to its cruise speed, cruises and
+#   goes to another speed at the given acceleration, for single moves or, with
+#   NumPy, for arrays of moves. Moves too short to reach the cruise speed
+#   accelerate to the highest speed they can, or change speed evenly if they
+#   can't even reach the exit speed.
+def _trapezoidTime(distance: Any, speed: Any, entry: Any, exit: Any, acceleration: float) -> Any:
+    accelerating = (speed * speed - entry * entry) / (2 * acceleration)
+    decelerating = (speed * speed - exit * exit) / (2 * acceleration)
+    cruising = distance - accelerating - decelerating
+    peak_squared = acceleration * distance + (entry * entry + exit * exit) / 2
+    if numpy is None:
+        if cruising >= 0:
+            return (speed - entry) / acceleration + (speed - exit) / acceleration + cruising / speed
+        peak = math.sqrt(peak_squared)
+        if peak >= max(entry, exit):
+            return (2 * peak - entry - exit) / acceleration
+        return 2 * distance / (entry + exit)
+    with numpy.errstate(invalid = "ignore", divide = "ignore"):
+        peaks = numpy.sqrt(peak_squared)
+        return numpy.where(cruising >= 0, (speed - entry) / acceleration + (speed - exit) / acceleration + cruising / speed,
+            numpy.where(peaks >= numpy.maximum(entry, exit), (2 * peaks - entry - exit) / acceleration, 2 * distance / (entry + exit)))
+
+##  Keeps the last few items of a sequence, addressed by their position in
+#   the whole sequence.
+class _Window:
+    def __init__(self, size: int) -> None:
+        self._items = collections.deque(maxlen = size) # type: Deque[Any]
+        self._end = 0 #Position after the last item.
+
+    def append(self, item: Any) -> None:
+        self._items.append(item)
+        self._end += 1
+
+    def __len__(self) -> int:
+        return self._end
+
+    def __getitem__(self, position: int) -> Any:
+        offset = position - (self._end - len(self._items))
+        if position < 0 or offset < 0 or offset >= len(self._items):
+            raise IndexError("Layer {position} is not in the window of kept layers.".format(position = position))
+        return self._items[offset]
+
+##  What LayerIndex.addLayer() reads from one entry of the G-code data,
+#   before it is applied to the state of the layers before it.
+class _LayerSummary:
+    __slots__ = ("info", "layer_effects", "rest_effects", "started_moves", "unstarted_moves")
+
+    def __init__(self, info: LayerInfo) -> None:
+        self.info = info
+        self.layer_effects = [] # type: List[Tuple[int, _ScanEffects]] #Number of every ;LAYER: comment with the effects of the lines up to and including it.
+        self.rest_effects = None # type: Optional[_ScanEffects] #Effects of the lines after the last ;LAYER: comment.
+        self.started_moves = None # type: Optional[Tuple[bool, _ScanEffects]] #Moves of the entry if the layers have started: whether it has a first move and the effects up to it.
+        self.unstarted_moves = None # type: Optional[Tuple[bool, _ScanEffects]] #Same if the layers haven't started yet.
+
+##  Finds the first G0/G1 of a layer, where the pause height is checked, and
+#   what reading the layer up to and including it does.
+#   \param started: Whether the layers have started before this layer.
+#   \return Whether the layer has such a move and the effects up to it, or of
+#   the whole layer if it hasn't.
+def _summarizeMoves(layer: str, started: bool) -> Tuple[bool, _ScanEffects]:
+    # The pause height is checked on the first G0/G1 of the layer,
+    # from the first positive layer on
+    if started:
+        started_at = 0 # type: Optional[int]
+    else:
+        position = layer.find(";LAYER:0")
+        started_at = layer.rfind("\n", 0, position) + 1 if position >= 0 else None
+    if started_at is not None:
+        for match in _G_REGEX.finditer(layer, started_at):
+            g = _toNumber(match.group(1))
+            if g == 1 or g == 0:
+                return True, _scanEffects(layer, 0, _lineEnd(layer, match.end()))
+    return False, _scanEffects(layer, 0, len(layer))
+
+##  Reads one entry of the G-code data for LayerIndex.addLayer().
+#   \param moves_started: Whether the layers have started before this entry,
+#   or None if that is not known yet, in which case both cases are read (but
+#   the case that they haven't only if the entry has a ;LAYER:0 comment; else
+#   it is read when needed).
+def _summarizeLayer(layer: str, track_layers: bool, moves_started: Optional[bool] = None) -> _LayerSummary:
+    summary = _LayerSummary(LayerInfo(layer))
+    scanned = 0
+    position = layer.find(";LAYER:")
+    while position >= 0:
+        line_end = _lineEnd(layer, position)
+        if position == 0 or layer[position - 1] == "\n":
+            try:
+                number = int(layer[position + len(";LAYER:"):line_end]) # type: Optional[int]
+            except ValueError:
+                number = None
+            if number is not None:
+                if summary.info.number is None:
+                    summary.info.number = number
+                if not track_layers:
+                    break
+                summary.layer_effects.append((number, _scanEffects(layer, scanned, line_end)))
+                scanned = line_end
+        position = layer.find(";LAYER:", line_end)
+    if track_layers:
+        summary.rest_effects = _scanEffects(layer, scanned, len(layer))
+
+    if moves_started is None or moves_started:
+        summary.started_moves = _summarizeMoves(layer, True)
+    if moves_started is False or (moves_started is None and ";LAYER:0" in layer):
+        summary.unstarted_moves = _summarizeMoves(layer, False)
+    return summary
+
+##  Reads a chunk of entries of the G-code data, in a process of a pool.
+def _summarizeLayers(layers: List[str], track_layers: bool) -> List[_LayerSummary]:
+    return [_summarizeLayer(layer, track_layers) for layer in layers]
+
+_SCAN_CHUNK_SIZE = 4 * 1024 * 1024 #Characters of G-code per task of a parallel scan.
+
+##  Settings that only the command line has, with their type and default
+#   value. Reading the layers in several processes starts copies of Cura
+#   itself where processes are spawned (Windows and macOS), so it is not
+#   offered in Cura.
+_COMMAND_LINE_SETTINGS = {
+    "scan_processes": ("int", 1) #Number of processes to read the layers with, see _summarizeInParallel().
+} # type: Dict[str, Tuple[str, Any]]
+
+##  Takes the next entries of the G-code data, up to about _SCAN_CHUNK_SIZE
+#   characters.
+def _takeChunk(layers: Iterator[str]) -> List[str]:
+    chunk = [] # type: List[str]
+    chunk_size = 0
+    for layer in layers:
+        chunk.append(layer)
+        chunk_size += len(layer)
+        if chunk_size >= _SCAN_CHUNK_SIZE:
+            break
+    return chunk
+
+##  Reads the entries of the G-code data in a pool of processes, for
+#   LayerIndex.addLayer().
+#
+#   The entries are sent to the processes in chunks of about
+#   _SCAN_CHUNK_SIZE. Every process reads what each entry does to the state
+#   independently of the entries before it, which is then applied in order by
+#   addLayer(), so the result is the same as reading the entries one by one.
+#   Only a few chunks per process are read ahead, so that streamed G-code
+#   doesn't have to fit in memory.
+#
+#   Starting processes doesn't work everywhere, e.g. where they are spawned
+#   and can't import this script. If the pool can't be started or breaks, the
+#   entries that it didn't read are given without a summary, so that they are
+#   read in this process instead.
+#   \return Generator of every entry with its summary, or None if it was not
+#   read, in order.
+def _summarizeInParallel(layers: Iterable[str], track_layers: bool, processes: int) -> Iterator[Tuple[str, Optional[_LayerSummary]]]:
+    layers = iter(layers)
+    pending = collections.deque() # type: Deque[Tuple[List[str], concurrent.futures.Future]]
+    chunk = [] # type: List[str]
+    try:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers = processes) # type: Optional[concurrent.futures.ProcessPoolExecutor]
+    except Exception as e: #E.g. no support for the semaphores of multiprocessing.
+        Logger.log("w", "Could not read the layers in several processes, reading them in one instead: %s", str(e))
+        executor = None
+    try:
+        while executor is not None:
+            chunk = _takeChunk(layers) #Outside of the try below, so that errors while reading the input are not taken for a broken pool.
+            exhausted = not chunk
+            try:
+                if chunk:
+                    pending.append((chunk, executor.submit(_summarizeLayers, chunk, track_layers)))
+                    chunk = []
+                while pending and (exhausted or len(pending) > processes * 2):
+                    chunk_layers, future = pending[0]
+                    summaries = future.result()
+                    pending.popleft()
+                    yield from zip(chunk_layers, summaries)
+            except Exception as e: #The processes couldn't be started, couldn't load this script or died.
+                Logger.log("w", "Could not read the layers in several processes, reading them in one instead: %s", str(e))
+                executor.shutdown(wait = False)
+                executor = None
+            if exhausted:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    for chunk_layers, _ in pending:
+        for layer in chunk_layers:
+            yield layer, None
+    for layer in chunk:
+        yield layer, None
+    for layer in layers:
+        yield layer, None
+
+##  Converts a pause state to a list for JSON, and back. JSON only has
+#   strings for keys, so the temperatures are a list of pairs.
+def _pauseStateAsList(state: PauseState) -> List[Any]:
+    return [state.index, state.layer, state.z, state.height, state.extrusion_f, state.tool, list(state.temperatures.items()), state.is_griffin, state.negative_layers]
+
+def _pauseStateFromList(values: List[Any]) -> PauseState:
+    index, layer, z, height, extrusion_f, tool, temperatures, is_griffin, negative_layers = values
+    return PauseState(index, layer, z, height, extrusion_f, tool, {extruder: temperature for extruder, temperature in temperatures}, is_griffin, negative_layers)
+
+##  Converts a scan state to a list for JSON, and back.
+def _scanStateAsList(state: _ScanState) -> List[Any]:
+    return [state.layers_started, state.negative_layers, state.is_griffin, state.z, state.extrusion_f, state.tool, list(state.temperatures.items())]
+
+def _scanStateFromList(values: List[Any]) -> _ScanState:
+    state = _ScanState()
+    state.layers_started, state.negative_layers, state.is_griffin, state.z, state.extrusion_f, state.tool, temperatures = values
+    state.temperatures = {extruder: temperature for extruder, temperature in temperatures}
+    return state
+
+##  Index of the G-code data with one LayerInfo per entry of the data.
+#
+#   It is built in one pass and records where pauses can be inserted, so that
+#   finding the layer for a pause height or layer number is a binary search.
+#   Pausing at a height is checked on the first G0/G1 of every layer, pausing
+#   at a layer on its ;LAYER: comment, each with the state known at that point.
+#
+#   The entries of the data are only read as far as the queries need them:
+#   finding the pauses reads up to the last pause, and looking at an entry
+#   reads up to that entry. Like the original script, a pause early in a big
+#   print doesn't read the rest of the print.
+#
+#   Layers can also be added one at a time with addLayer(). If window is
+#   given, only that many of the last layers are kept and no pause states are
+#   stored, so that memory use doesn't grow with the size of the G-code.
+#
+#   The state at the ;LAYER: comments needs every line to be read, while the
+#   state at the first moves only needs the start of every layer, so it is
+#   only tracked if track_layers is True.
+#
+#   If processes is more than 1, the data is read in that many processes; see
+#   _summarizeInParallel(). If progress is given, it is called with 1 after
+#   every entry that is read.
+#
+#   The positions and E values of the layers are only looked up when they are
+#   asked for, since they are only needed for the layers around a pause. The
+#   print time is estimated if estimateTimes() is called, and also only as far
+#   as it is asked for. The footprint of the print so far, to park the head
+#   out of the way of, is found if trackFootprints() is called.
+class LayerIndex:
+    def __init__(self, data: Iterable[str], initial_layer_height: float, window: Optional[int] = None, track_layers: bool = True, processes: int = 1, progress: Optional[Callable[[int], None]] = None) -> None:
+        self.data = list(data) if window is None else _Window(window) # type: Optional[Union[List[str], _Window]] #The entries of the data as they were before any pause was inserted.
+        self.layers = [] if window is None else _Window(window) # type: Union[List[LayerInfo], _Window]
+        self._keep_states = window is None
+        self._move_states = [] # type: List[PauseState]
+        self._move_heights = [] # type: List[float] #Running maximum of the heights in _move_states.
+        self._layer_states = [] # type: List[PauseState]
+        self._layer_numbers = [] # type: List[int] #Running maximum of the layer numbers plus raft layers.
+        self._layer_state_indices = [] # type: List[int]
+        self._move_arrays = {} # type: Dict[int, MoveArrays]
+        self._footprints = [] # type: Union[List[Optional[List[Tuple[float, float]]]], _Window] #Footprint of the entries up to and including every entry read so far, or None before the first that extrudes.
+        self._footprint_hull = None # type: Optional[bool] #Whether the footprints are convex hulls rather than bounding boxes, or None if they are not tracked.
+        self._window = window
+        self._times = [] # type: Union[List[float], _Window] #Estimated seconds from the start until the end of every entry timed so far.
+        self._motion = _Motion() #Position and feed rate after the entries timed so far.
+        self._time_acceleration = None # type: Optional[float] #Acceleration that the times are estimated with, or None if they are not estimated.
+
+        self._initial_layer_height = initial_layer_height
+        self._full = _ScanState() #State after reading every line so far.
+        self._moves = _ScanState() #State after reading every line so far up to the first move of each layer.
+        self._layer_0_z = None # type: Optional[float]
+        self.track_layers = track_layers
+        self._processes = processes
+        self._progress = progress
+        self._summaries = None # type: Optional[Iterator[Tuple[str, Optional[_LayerSummary]]]] #Entries being read by processes, from the first entry not read yet.
+        self.lines_parsed = 0 #Lines whose numbers were read so far, also in other processes, for the statistics.
+        self.parse_calls = 0 #Of those, the lines read with parseGCodeLine rather than vectorized by MoveArrays.
+
+    ##  Adds an entry to the G-code data and reads it.
+    #   \param summary: What was already read from the entry by
+    #   _summarizeLayer(), if anything.
+    #   \return The LayerInfo of the entry, the state at its first move (or
+    #   None) and the states at its ;LAYER: comments (if tracked).
+    def addLayer(self, layer: str, summary: Optional[_LayerSummary] = None) -> Tuple[LayerInfo, Optional[PauseState], List[PauseState]]:
+        self.data.append(layer)
+        return self._readLayer(layer, summary)
+
+    ##  Reads the entries of the data up to and including the given one, if
+    #   they were not read yet. A negative index counts from the end, so then
+    #   every entry is read.
+    def readUpTo(self, index: int) -> None:
+        stop = len(self.data) if index < 0 else index + 1
+        while len(self.layers) < stop and self._readNext():
+            pass
+
+    ##  Reads every entry of the data that was not read yet.
+    def readAll(self) -> None:
+        self.readUpTo(-1)
+
+    ##  Gets an entry of the data as it was before any pause was inserted,
+    #   reading the entries up to it if they were not read yet.
+    def entry(self, index: int) -> str:
+        self.readUpTo(index)
+        return self.data[index]
+
+    ##  Reads the next entry of the data that was not read yet.
+    #   \return Whether there was such an entry.
+    def _readNext(self) -> bool:
+        read = len(self.layers)
+        if read >= len(self.data):
+            return False
+        if self._processes > 1:
+            if self._summaries is None:
+                self._summaries = _summarizeInParallel(self.data[read:], self.track_layers, self._processes)
+            layer, summary = next(self._summaries)
+            self._readLayer(layer, summary)
+        else:
+            self._readLayer(self.data[read], None)
+        if self._progress is not None:
+            self._progress(1)
+        return True
+
+    def _readLayer(self, layer: str, summary: Optional[_LayerSummary]) -> Tuple[LayerInfo, Optional[PauseState], List[PauseState]]:
+        index = len(self.layers)
+        full = self._full
+        moves = self._moves
+        if summary is None:
+            summary = _summarizeLayer(layer, self.track_layers, moves.layers_started)
+        info = summary.info
+
+        layer_states = [] # type: List[PauseState]
+        for number, effects in summary.layer_effects:
+            self._countParsed(effects.lines_parsed)
+            full.apply(effects)
+            if full.layers_started:
+                layer_states.append(self._addLayerState(index, number, full))
+        if summary.rest_effects is not None:
+            self._countParsed(summary.rest_effects.lines_parsed)
+            full.apply(summary.rest_effects)
+
+        move_state = None
+        if moves.layers_started:
+            moves_summary = summary.started_moves
+        else:
+            moves_summary = summary.unstarted_moves
+        if moves_summary is None:
+            moves_summary = _summarizeMoves(layer, moves.layers_started)
+        has_move, effects = moves_summary
+        self._countParsed(effects.lines_parsed)
+        moves.apply(effects)
+        if has_move:
+            if self._layer_0_z is None:
+                self._layer_0_z = moves.z - self._initial_layer_height
+            move_state = self._addMoveState(index, moves.z - self._layer_0_z, moves)
+
+        move_arrays = None
+        if self._footprint_hull is not None and len(self._footprints) == index:
+            move_arrays = self._readMoveArrays(layer)
+            self._addFootprint(move_arrays)
+        if self._time_acceleration is not None and len(self._times) == index:
+            self._addTime(layer, move_arrays)
+        self.layers.append(info)
+        return info, move_state, layer_states
+
+    ##  Gets a copy of this index for other G-code data with the same
+    #   content, e.g. to keep the index in a cache without the data (None).
+    #   The copy shares the pause states and layer infos, which are not
+    #   changed once read, but reads and times the entries that were not read
+    #   yet on its own. Only for an index without a window.
+    def withData(self, data: Optional[List[str]]) -> "LayerIndex":
+        layer_index = copy.copy(self)
+        layer_index.data = data
+        layer_index.layers = list(self.layers)
+        layer_index._move_states = list(self._move_states)
+        layer_index._move_heights = list(self._move_heights)
+        layer_index._layer_states = list(self._layer_states)
+        layer_index._layer_numbers = list(self._layer_numbers)
+        layer_index._layer_state_indices = list(self._layer_state_indices)
+        layer_index._full = self._full.copy()
+        layer_index._moves = self._moves.copy()
+        layer_index._move_arrays = {}
+        layer_index._footprints = list(self._footprints)
+        layer_index._times = list(self._times)
+        layer_index._motion = self._motion.copy()
+        layer_index._summaries = None
+        layer_index._progress = None
+        return layer_index
+
+    ##  Gets what was read from the data as plain lists and numbers, to save
+    #   it as JSON. Only for an index without a window.
+    def asDict(self) -> Dict[str, Any]:
+        return {
+            "initial_layer_height": self._initial_layer_height,
+            "track_layers": self.track_layers,
+            "layers": [[info.number, info.ends_with_newline] for info in self.layers],
+            "move_states": [_pauseStateAsList(state) for state in self._move_states],
+            "layer_states": [_pauseStateAsList(state) for state in self._layer_states],
+            "footprints": list(self._footprints),
+            "footprint_hull": self._footprint_hull,
+            "times": list(self._times),
+            "motion": [self._motion.x, self._motion.y, self._motion.z, self._motion.e, self._motion.f],
+            "time_acceleration": self._time_acceleration,
+            "full": _scanStateAsList(self._full),
+            "moves": _scanStateAsList(self._moves),
+            "layer_0_z": self._layer_0_z
+        }
+
+    ##  Creates an index without data from what asDict() gave.
+    @staticmethod
+    def fromDict(values: Dict[str, Any]) -> "LayerIndex":
+        layer_index = LayerIndex([], values["initial_layer_height"], track_layers = values["track_layers"])
+        layer_index.data = None
+        for number, ends_with_newline in values["layers"]:
+            info = LayerInfo("")
+            info.number = number
+            info.ends_with_newline = ends_with_newline
+            layer_index.layers.append(info)
+        for state in values["move_states"]:
+            pause_state = _pauseStateFromList(state)
+            layer_index._move_states.append(pause_state)
+            layer_index._move_heights.append(max(pause_state.height, layer_index._move_heights[-1]) if layer_index._move_heights else pause_state.height)
+        for state in values["layer_states"]:
+            pause_state = _pauseStateFromList(state)
+            layer_index._layer_states.append(pause_state)
+            key = pause_state.layer + pause_state.negative_layers
+            layer_index._layer_numbers.append(max(key, layer_index._layer_numbers[-1]) if layer_index._layer_numbers else key)
+            layer_index._layer_state_indices.append(pause_state.index)
+        layer_index._footprints = [None if footprint is None else [(x, y) for x, y in footprint] for footprint in values["footprints"]]
+        layer_index._footprint_hull = values["footprint_hull"]
+        layer_index._times = list(values["times"])
+        layer_index._motion.x, layer_index._motion.y, layer_index._motion.z, layer_index._motion.e, layer_index._motion.f = values["motion"]
+        layer_index._time_acceleration = values["time_acceleration"]
+        layer_index._full = _scanStateFromList(values["full"])
+        layer_index._moves = _scanStateFromList(values["moves"])
+        layer_index._layer_0_z = values["layer_0_z"]
+        return layer_index
+
+    def _addMoveState(self, index: int, height: float, state: _ScanState) -> PauseState:
+        pause_state = PauseState(index, 0, state.z, height, state.extrusion_f, state.tool, dict(state.temperatures), state.is_griffin, state.negative_layers)
+        if self._keep_states:
+            self._move_states.append(pause_state)
+            self._move_heights.append(max(height, self._move_heights[-1]) if self._move_heights else height)
+        return pause_state
+
+    def _addLayerState(self, index: int, number: int, state: _ScanState) -> PauseState:
+        pause_state = PauseState(index, number, state.z, 0, state.extrusion_f, state.tool, dict(state.temperatures), state.is_griffin, state.negative_layers)
+        if self._keep_states:
+            self._layer_states.append(pause_state)
+            key = number + state.negative_layers
+            self._layer_numbers.append(max(key, self._layer_numbers[-1]) if self._layer_numbers else key)
+            self._layer_state_indices.append(index)
+        return pause_state
+
+    ##  Finds where to pause for each height.
+    #
+    #   Heights that are reached on the same layer share one pause.
+    #   \param heights: Sorted pause heights.
+    #   \return The state at each pause, in order.
+    def statesAtHeights(self, heights: List[float]) -> List[PauseState]:
+        if heights:
+            self._readUntilReached(self._move_heights, max(heights))
+        return self._findStates(heights, self._move_heights, self._move_states)
+
+    ##  Finds where to pause for each layer number, counting raft layers.
+    #   \param layers: Sorted pause layers.
+    #   \return The state at each pause, in order.
+    def statesAtLayers(self, layers: List[int]) -> List[PauseState]:
+        if layers:
+            self._readUntilReached(self._layer_numbers, max(layers))
+        return self._findStates(layers, self._layer_numbers, self._layer_states)
+
+    ##  Finds the layer at which each height is reached, as if pausing at
+    #   those layers. Heights that are reached on the same layer share one
+    #   pause.
+    def layerStatesAtHeights(self, heights: List[float]) -> List[PauseState]:
+        result = [] # type: List[PauseState]
+        for move_state in self.statesAtHeights(heights):
+            position = bisect.bisect_left(self._layer_state_indices, move_state.index)
+            if position < len(self._layer_states) and self._layer_state_indices[position] == move_state.index:
+                if not result or result[-1] is not self._layer_states[position]:
+                    result.append(self._layer_states[position])
+        return result
+
+    ##  Reads entries until the last of the running maxima in keys reaches
+    #   the point, or every entry is read.
+    def _readUntilReached(self, keys: List[Union[int, float]], point: Union[int, float]) -> None:
+        while (not keys or keys[-1] < point) and self._readNext():
+            pass
+
+    def _findStates(self, points: List[Union[int, float]], keys: List[Union[int, float]], states: List[PauseState]) -> List[PauseState]:
+        result = [] # type: List[PauseState]
+        last_position = -1
+        for point in points:
+            position = bisect.bisect_left(keys, point)
+            if position >= len(keys):
+                break
+            if position > last_position:
+                result.append(states[position])
+                last_position = position
+        return result
+
+    ##  Gets the MoveArrays of a layer.
+    #
+    #   Reading them takes longer than the searches that the queries below do
+    #   on the text, which stop at the first line that they need. Once read
+    #   they are kept, unless only a window of layers is kept, and the
+    #   queries use them instead.
+    def moveArrays(self, index: int) -> MoveArrays:
+        move_arrays = self._move_arrays.get(index)
+        if move_arrays is None:
+            move_arrays = self._readMoveArrays(self.entry(index))
+            if self._keep_states:
+                self._move_arrays[index] = move_arrays
+        return move_arrays
+
+    def _readMoveArrays(self, layer: str) -> MoveArrays:
+        move_arrays = MoveArrays(layer)
+        self.lines_parsed += move_arrays.rows
+        self.parse_calls += move_arrays.lines_parsed_singly
+        return move_arrays
+
+    ##  Counts lines read with parseGCodeLine, for the statistics.
+    def _countParsed(self, lines: int) -> None:
+        self.lines_parsed += lines
+        self.parse_calls += lines
+
+    ##  Starts estimating the print time with the given acceleration (in
+    #   mm/s²), for timeBefore(). Entries added from now on are timed as they
+    #   are added, entries from before when they are asked for. Times that
+    #   were estimated with another acceleration are forgotten.
+    def estimateTimes(self, acceleration: float) -> None:
+        if acceleration == self._time_acceleration:
+            return
+        self._time_acceleration = acceleration
+        self._times = [] if self._window is None else _Window(self._window)
+        self._motion = _Motion()
+
+    ##  Estimates how long printing the entries before the given one takes,
+    #   in seconds.
+    #
+    #   Cura writes its own estimate of the time so far in a ;TIME_ELAPSED:
+    #   comment at the end of every layer. If the entry before has one, that
+    #   is used, so that only the entries around the pause are read.
+    #   Otherwise the entries that were not timed yet are timed now.
+    def timeBefore(self, index: int) -> float:
+        if index > 0:
+            elapsed = _timeElapsed(self.entry(index - 1))
+            if elapsed is not None:
+                return elapsed
+        while len(self._times) < index:
+            timed = len(self._times)
+            self._addTime(self.entry(timed), self._move_arrays.get(timed))
+        return self._times[index - 1] if index > 0 else 0.0
+
+    ##  Times an entry: by its ;TIME_ELAPSED: comment if it has one, or else
+    #   by its moves. The position isn't followed through entries with the
+    #   comment, so that their moves don't have to be read; Cura writes it in
+    #   every layer, so only the start code is timed by its moves.
+    def _addTime(self, layer: str, move_arrays: Optional[MoveArrays]) -> None:
+        elapsed = _timeElapsed(layer)
+        if elapsed is None:
+            seconds = _estimateMoveTime(move_arrays if move_arrays is not None else self._readMoveArrays(layer), self._motion, self._time_acceleration)
+            elapsed = self._times[len(self._times) - 1] + seconds if len(self._times) > 0 else seconds
+        self._times.append(elapsed)
+
+    ##  Starts finding the footprint of the print so far, for parkPosition().
+    #   Entries added from now on are read for it as they are added, entries
+    #   from before when they are asked for. Footprints of the other kind are
+    #   forgotten.
+    #   \param hull: Whether the footprint is the convex hull of where the
+    #   layers extrude rather than their bounding box.
+    def trackFootprints(self, hull: bool) -> None:
+        if hull == self._footprint_hull:
+            return
+        self._footprint_hull = hull
+        self._footprints = [] if self._window is None else _Window(self._window)
+
+    def _addFootprint(self, move_arrays: MoveArrays) -> None:
+        previous = self._footprints[len(self._footprints) - 1] if len(self._footprints) > 0 else None
+        self._footprints.append(_mergeFootprints(previous, _footprint(move_arrays, self._footprint_hull), self._footprint_hull))
+
+    ##  Finds where to park the head when pausing before a layer, out of the
+    #   way of every layer printed up to and including the layer that the
+    #   print resumes with, so that the purged filament doesn't land on the
+    #   part. See _parkPosition(). Needs trackFootprints().
+    #   \param index: Index of the layer after the pause.
+    #   \param end: Where the head resumes.
+    #   \return The park position, or None if the layers don't extrude or
+    #   there is no room on the bed.
+    def parkPosition(self, index: int, end: Tuple[float, float], bed: Tuple[float, float, float, float], clearance: float) -> Optional[Tuple[float, float]]:
+        while len(self._footprints) <= index: #Entries that were read before trackFootprints().
+            added = len(self._footprints)
+            layer = self.entry(added)
+            if len(self._footprints) == added: #Not read just now.
+                move_arrays = self._move_arrays.get(added)
+                self._addFootprint(move_arrays if move_arrays is not None else self._readMoveArrays(layer))
+        footprint = self._footprints[index]
+        if footprint is None:
+            return None
+        return _parkPosition(footprint, self.moveArrays(index - 1).lastXY(), end, bed, clearance)
+
+    ##  Gets the first X and Y of a layer, or (0, 0) if it has none.
+    def firstXY(self, index: int) -> Tuple[float, float]:
+        first_xy = self._firstXY(index)
+        return first_xy if first_xy is not None else (0, 0)
+
+    def _firstXY(self, index: int) -> Optional[Tuple[float, float]]:
+        layer = self.entry(index)
+        move_arrays = self._move_arrays.get(index)
+        if move_arrays is None:
+            first_xy, parsed = _firstXY(layer)
+            self._countParsed(parsed)
+            return first_xy
+        row = move_arrays.firstXYRow()
+        if row is None:
+            return None
+        params = parseGCodeLine(_lineAt(layer, row)).params
+        self._countParsed(1)
+        return params["X"], params["Y"]
+
+    ##  Gets the first X and Y of several layers joined together, or (0, 0)
+    #   if they have none.
+    #
+    #   Returns None if a layer other than the last doesn't end with a new
+    #   line, since joining would then merge two lines into one.
+    def firstXYOfLayers(self, indices: List[int]) -> Optional[Tuple[float, float]]:
+        for index in indices:
+            self.readUpTo(index)
+        for index in indices[:-1]:
+            if not self.layers[index].ends_with_newline:
+                return None
+        for index in indices:
+            first_xy = self._firstXY(index)
+            if first_xy is not None:
+                return first_xy
+        return 0, 0
+
+    ##  Gets the last non-negative E value of a layer, as found by browsing
+    #   the layer backwards. If there is none, the E value of its first line,
+    #   or -1.
+    def lastE(self, index: int) -> float:
+        layer = self.entry(index)
+        move_arrays = self._move_arrays.get(index)
+        if move_arrays is None:
+            e, parsed = _lastE(layer)
+            self._countParsed(parsed)
+            return e
+        row = move_arrays.lastNonNegativeERow()
+        e = parseGCodeLine(_lineAt(layer, row if row is not None else 0)).params.get("E")
+        self._countParsed(1)
+        return e if e is not None else -1
+
+    ##  Gets the first E value in a layer that differs from the given one.
+    def firstEDifferentFrom(self, index: int, e: float) -> float:
+        layer = self.entry(index)
+        move_arrays = self._move_arrays.get(index)
+        if move_arrays is None:
+            different_e, parsed = _firstEDifferentFrom(layer, e)
+            self._countParsed(parsed)
+            return different_e
+        row = move_arrays.firstERowDifferentFrom(e)
+        if row is None:
+            return e
+        self._countParsed(1)
+        return parseGCodeLine(_lineAt(layer, row)).params["E"]
+
+##  Decides where to pause while the layers are read one at a time, for when
+#   they are not all in a LayerIndex to search through. Gives the same pauses
+#   as the LayerIndex.statesAt... functions.
+class _PausePlanner:
+    def __init__(self, pause_at: str, pause_heights: List[float], pause_layers: List[int]) -> None:
+        self._by_height = pause_at == "height" or not pause_layers
+        self._use_layer_states = pause_at != "height"
+        self._points = pause_heights if self._by_height else pause_layers # type: List[Union[int, float]]
+        self._next = 0 #Index in _points of the next pause.
+
+    ##  Whether every pause was found, so that no more pauses can follow.
+    def isFinished(self) -> bool:
+        return self._next >= len(self._points)
+
+    ##  Gets the pauses to insert in the layer that was just read.
+    #   \param move_state: State at the first move of the layer, if any.
+    #   \param layer_states: States at the ;LAYER: comments of the layer.
+    def pausesIn(self, move_state: Optional[PauseState], layer_states: List[PauseState]) -> List[PauseState]:
+        points = self._points
+        result = [] # type: List[PauseState]
+        if self._by_height:
+            if move_state is None or self._next >= len(points) or move_state.height < points[self._next]:
+                return result
+            while self._next < len(points) and move_state.height >= points[self._next]:
+                self._next += 1
+            if not self._use_layer_states:
+                result.append(move_state)
+            elif layer_states: #Pause at the layer where the height is reached.
+                result.append(layer_states[0])
+            return result
+        for layer_state in layer_states:
+            key = layer_state.layer + layer_state.negative_layers
+            if self._next >= len(points) or key < points[self._next]:
+                continue
+            while self._next < len(points) and key >= points[self._next]:
+                self._next += 1
+            result.append(layer_state)
+        return result
+
+##  Timers and counters for one run of the script, to find out where the
+#   time goes on a big print.
+#
+#   If it is not enabled, nothing is measured, so that it costs next to
+#   nothing to leave the calls in.
+class Statistics:
+    def __init__(self, enabled: bool) -> None:
+        self.enabled = enabled
+        self.timers = collections.OrderedDict() # type: Dict[str, float] #Seconds spent in each phase.
+        self.counters = collections.OrderedDict() # type: Dict[str, int]
+        self.peak_memory = None # type: Optional[int] #Peak memory allocated by Python during the run, in bytes.
+
+    ##  Measures the time spent in a phase. If a phase is measured more than
+    #   once, the times are added up.
+    @contextlib.contextmanager
+    def measure(self, phase: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timers[phase] = self.timers.get(phase, 0.0) + time.perf_counter() - start_time
+
+    def count(self, counter: str, amount: int = 1) -> None:
+        if self.enabled:
+            self.counters[counter] = self.counters.get(counter, 0) + amount
+
+    def asDict(self) -> Dict[str, Any]:
+        return {
+            "timers": dict(self.timers),
+            "counters": dict(self.counters),
+            "peak_memory_bytes": self.peak_memory
+        }
+
+    def log(self) -> None:
+        Logger.log("d", "Pause at height timers: %s", ", ".join("{phase} {seconds:.4f} s".format(phase = phase, seconds = seconds) for phase, seconds in self.timers.items()))
+        Logger.log("d", "Pause at height counters: %s", ", ".join("{counter} {value}".format(counter = counter, value = value) for counter, value in self.counters.items()))
+        if self.peak_memory is not None:
+            Logger.log("d", "Pause at height peak memory: %.1f MB", self.peak_memory / 1e6)
+
+##  Raised by ExecutionJob.getResult() if the job was cancelled before it
+#   finished.
+class ExecutionCancelled(Exception):
+    pass
+
+_PROGRESS_CHUNK_LAYERS = 25 #Layers read by a background execution between checks for cancellation.
+
+##  Runs execute() of a script on a worker thread, so that the thread that
+#   starts it, e.g. Cura's interface, doesn't have to wait for it.
+#
+#   The layers are gone through in chunks of chunk_layers: once to find where
+#   the pauses go, once to insert them and, with the verify_pauses setting,
+#   once more to verify them. After every chunk the job checks whether it was
+#   cancelled and calls the progress function with the number of layers done
+#   and the total, in which every layer counts once for every time it is gone
+#   through. This happens on the worker thread. execute() gets a copy of the
+#   list of layers, so the list that the job was given is left as it was,
+#   also if the job is cancelled, and the result is the same as what
+#   execute() gives for the list.
+#
+#   A script runs one job at a time; starting another while one runs raises
+#   a RuntimeError.
+class ExecutionJob:
+    def __init__(self, script: "PauseAtHeightOptions", data: List[str], progress: Optional[Callable[[int, int], None]] = None, chunk_layers: int = _PROGRESS_CHUNK_LAYERS) -> None:
+        self._script = script
+        self._data = list(data)
+        self._progress = progress
+        self._chunk_layers = max(chunk_layers, 1)
+        self._total = len(self._data)
+        self._done = 0 #Layers read so far.
+        self._reported = -1 #Layers read at the last call to the progress function.
+        self._next_check = self._chunk_layers
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+        self._result = None # type: Optional[List[str]]
+        self._error = None # type: Optional[Exception]
+        self._thread = threading.Thread(target = self._run, name = "PauseAtHeightOptions", daemon = True)
+
+    def start(self) -> None:
+        script = self._script
+        if script._job is not None or script._measuring_memory: #The job is set to None while it measures the peak memory.
+            raise RuntimeError("The pause at height script is already running a job.")
+        script._job = self #Before the thread starts, so that the next call sees it.
+        self._thread.start()
+
+    ##  Asks the job to stop at the next check. Has no effect if it already
+    #   finished.
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def isCancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def isFinished(self) -> bool:
+        return self._finished.is_set()
+
+    ##  Waits until the job is finished.
+    #   \param timeout: Seconds to wait at most, or None to wait as long as it
+    #   takes.
+    #   \return Whether the job is finished.
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+    ##  Waits until the job is finished and gets the layers with the pauses
+    #   inserted. Raises ExecutionCancelled if the job was cancelled, or the
+    #   error that execute() raised.
+    def getResult(self) -> List[str]:
+        self._finished.wait()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+    ##  Gets the error that stopped the job, if any.
+    def getError(self) -> Optional[Exception]:
+        return self._error
+
+    ##  Sets how many times the layers are gone through, which the total
+    #   that is reported counts them for.
+    def setPasses(self, passes: int) -> None:
+        self._total = len(self._data) * passes
+
+    ##  Counts layers as done, checking for cancellation and reporting the
+    #   progress after every chunk.
+    def advance(self, layers: int) -> None:
+        self._done += layers
+        if self._done >= self._next_check:
+            self._next_check = self._done + self._chunk_layers
+            self.checkCancelled()
+            self._report()
+
+    ##  Counts the layers as done up to a number of layers, e.g. the layers
+    #   that didn't have to be read, see advance().
+    def advanceTo(self, done: int) -> None:
+        if done > self._done:
+            self.advance(done - self._done)
+
+    def checkCancelled(self) -> None:
+        if self._cancelled.is_set():
+            raise ExecutionCancelled("The pause at height script was cancelled.")
+
+    ##  Goes through layers, counting each as done once it is used, see
+    #   advance().
+    def counted(self, layers: Iterable[str]) -> Iterator[str]:
+        self.checkCancelled()
+        for layer in layers:
+            yield layer
+            self.advance(1)
+
+    def _report(self) -> None:
+        if self._progress is not None and self._done != self._reported:
+            self._reported = self._done
+            self._progress(self._done, self._total)
+
+    def _run(self) -> None:
+        try:
+            self.checkCancelled()
+            result = self._script.execute(self._data)
+            self._done = self._total
+            self._report()
+            self._result = result
+        except Exception as e:
+            self._error = e
+        finally:
+            self._script._job = None
+            self._finished.set()
+
+##  Reads G-code from a file, one layer at a time.
+#
+#   A new layer starts at every ;LAYER: comment, so the first item holds the
+#   header and start code and the last layer also holds the end code.
+#   \param stream: The file, or any other iterable of lines.
+def readLayers(stream: Iterable[str]) -> Iterator[str]:
+    lines = [] # type: List[str]
+    for line in stream:
+        if line.startswith(";LAYER:") and lines:
+            yield "".join(lines)
+            lines = []
+        lines.append(line)
+    if lines:
+        yield "".join(lines)
+
+##  Splits pieces of G-code text into lines, the same way as a file opened
+#   with newline = "", for readLayers().
+def _linesOf(chunks: Iterable[str]) -> Iterator[str]:
+    rest = ""
+    for chunk in chunks:
+        lines = io.StringIO(rest + chunk, newline = "").readlines()
+        rest = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        yield from lines
+    if rest:
+        yield rest
+
+##  Matches the E value of every G0 and G1 line, to add up relative E moves.
+_MOVE_E_REGEX = re.compile(r"^[ \t]*G0*[01](?![0-9.])[^;\nE]*E(-?[0-9]+\.?[0-9]*)", re.MULTILINE)
+_MOVE_Z_REGEX = re.compile(r"^[ \t]*G0*[01](?![0-9.])[^;\nZ]*Z(-?[0-9]+\.?[0-9]*)", re.MULTILINE)
+_XYZ_MOVE_REGEX = re.compile(r"^[ \t]*G0*[01](?![0-9.])[^;\n]*[XYZ][^\n]*", re.MULTILINE)
+_PAUSE_MARKER = ";script: PauseAtHeightOptions.py"
+
+##  Whether a line is a G0 or G1 move.
+def _isMove(params: Dict[str, Union[int, float, None]]) -> bool:
+    return params.get("G") in (0, 1)
+
+##  The modal state of the printer that a pause has to leave as it found it.
+class _ModalState:
+    __slots__ = ("relative_xyz", "relative_e", "e", "z", "tool", "temperatures")
+
+    def __init__(self) -> None:
+        self.relative_xyz = False
+        self.relative_e = False
+        self.e = 0.0 #Logical E position, after G92.
+        self.z = None # type: Optional[float]
+        self.tool = 0
+        self.temperatures = {} # type: Dict[int, float] #Target temperature of each extruder.
+
+    def copy(self) -> "_ModalState":
+        result = _ModalState()
+        result.relative_xyz = self.relative_xyz
+        result.relative_e = self.relative_e
+        result.e = self.e
+        result.z = self.z
+        result.tool = self.tool
+        result.temperatures = dict(self.temperatures)
+        return result
+
+    ##  Reads the lines between start and end, which must be the start of a
+    #   line and the end of a line (or of the text).
+    #
+    #   Like _scanEffects(), only the few lines that change the mode, the tool
+    #   or a temperature are parsed. In between, only the last E and Z are
+    #   parsed for absolute moves; relative moves are added up.
+    #   \return The number of lines parsed.
+    def scan(self, text: str, start: int, end: int) -> int:
+        events = _toolAndMLines(text, start, end)
+        position = text.find("G9", start, end)
+        while position >= 0:
+            line_start = text.rfind("\n", start, position) + 1 or start
+            line_end = text.find("\n", position, end)
+            if line_end < 0:
+                line_end = end
+            events.append((line_start, line_end))
+            position = text.find("G9", line_end, end)
+        events.sort()
+
+        position = start
+        parsed = 0
+        for line_start, line_end in events:
+            if line_start < position: #Found twice, e.g. an M line with G9 in it.
+                continue
+            parsed += self._move(text, position, line_end) #The line itself can be a move too, e.g. with an M in its comment.
+            self._applyLine(text[line_start:line_end])
+            parsed += 1
+            position = line_end
+        return parsed + self._move(text, position, end)
+
+    ##  Applies the moves between start and end, where the mode doesn't
+    #   change.
+    #   \return The number of lines parsed.
+    def _move(self, text: str, start: int, end: int) -> int:
+        if start >= end:
+            return 0
+        parsed = 0
+        if self.relative_e:
+            self.e += sum(float(e) for e in _MOVE_E_REGEX.findall(text, start, end) if e)
+        else:
+            _, params, parsed_e = _lastParams(text, "E", start, end, _isMove)
+            parsed += parsed_e
+            if params is not None:
+                self.e = float(params["E"])
+        if self.relative_xyz:
+            z_moves = [float(z) for z in _MOVE_Z_REGEX.findall(text, start, end) if z]
+            if z_moves and self.z is not None:
+                self.z += sum(z_moves)
+        else:
+            _, params, parsed_z = _lastParams(text, "Z", start, end, _isMove)
+            parsed += parsed_z
+            if params is not None:
+                self.z = float(params["Z"])
+        return parsed
+
+    ##  Applies a line that may change the mode, the tool or a temperature.
+    def _applyLine(self, line: str) -> None:
+        parsed = parseGCodeLine(line)
+        command = parsed.command
+        params = parsed.params
+        if command == "G90": #In Marlin, G90 and G91 switch E too. M82 and M83 after them switch only E.
+            self.relative_xyz = self.relative_e = False
+        elif command == "G91":
+            self.relative_xyz = self.relative_e = True
+        elif command == "M82":
+            self.relative_e = False
+        elif command == "M83":
+            self.relative_e = True
+        elif command == "G92":
+            if not any(params.get(axis) is not None for axis in "XYZE"): #Without axes, all are set to 0.
+                self.e = 0.0
+                self.z = 0.0
+            if params.get("E") is not None:
+                self.e = float(params["E"])
+            if params.get("Z") is not None:
+                self.z = float(params["Z"])
+        elif command == "M104" or command == "M109":
+            if params.get("S") is not None:
+                tool = params.get("T")
+                self.temperatures[tool if tool is not None else self.tool] = params["S"]
+        elif line.lstrip().startswith("T") and params.get("T") is not None:
+            self.tool = params["T"]
+
+##  Checks that every pause leaves the printer in the state it found it in,
+#   by simulating the modal state of the printer through the G-code: absolute
+#   or relative positioning and extrusion (G90/G91, M82/M83), the E position
+#   with its G92 resets, the tool and the target temperatures. The Z has to
+#   be back where it was at the first move of the head after a pause, unless
+#   that move sets Z itself.
+#
+#   With redone layers, the E position after the pause is compared to the E
+#   position where the first redone layer started the first time.
+#
+#   The G-code is fed in pieces of any size, e.g. the segments of
+#   executeStream(), and is only searched for the lines that change the
+#   state, so that it can check every job.
+class PauseVerifier:
+    def __init__(self) -> None:
+        self.problems = [] # type: List[str]
+        self._state = _ModalState()
+        self._rest = "" #Start of a line that continues in the next piece.
+        self._line_number = 1 #Line number of the start of the next piece.
+        self._pause_count = 0
+        self._before = None # type: Optional[_ModalState] #State before the pause being read, if any.
+        self._pause_line = 0 #Line number of the pause being read.
+        self._z_check = None # type: Optional[Tuple[float, int]] #Z before the last pause and its line number, until the first move after it.
+        self._layer_e = {} # type: Dict[str, Tuple[bool, float]] #Whether E was relative and the E position where each layer started the first time.
+        self.lines_parsed = 0 #For the statistics.
+
+    ##  Reads the next piece of G-code.
+    def feed(self, chunk: str) -> None:
+        text = self._rest + chunk
+        end = text.rfind("\n") + 1
+        self._rest = text[end:]
+        if end > 0:
+            self._read(text, end)
+
+    ##  Reads the end of the G-code.
+    #   \return The problems found, one message per problem.
+    def finish(self) -> List[str]:
+        if self._rest:
+            self._read(self._rest, len(self._rest))
+            self._rest = ""
+        if self._before is not None:
+            self._endPause(None)
+        return self.problems
+
+    def _read(self, text: str, end: int) -> None:
+        position = 0
+        next_layer = text.find(";LAYER:", 0, end)
+        next_pause = text.find(_PAUSE_MARKER, 0, end)
+        while True:
+            marker = min(next_layer if next_layer >= 0 else end, next_pause if next_pause >= 0 else end)
+            marker_start = (text.rfind("\n", position, marker) + 1 or position) if marker < end else end
+            if self._z_check is not None:
+                self._checkFirstMove(text, position, marker_start)
+            self.lines_parsed += self._state.scan(text, position, marker_start)
+            self._line_number += text.count("\n", position, marker_start)
+            if marker >= end:
+                return
+            marker_end = _lineEnd(text, marker)
+            if marker == next_layer:
+                number = text[marker + 7:marker_end].strip()
+                if self._before is not None:
+                    self._endPause(number)
+                if number not in self._layer_e:
+                    self._layer_e[number] = (self._state.relative_e, self._state.e)
+                next_layer = text.find(";LAYER:", marker_end, end)
+            else:
+                if self._before is not None: #Two pauses in a row.
+                    self._endPause(None)
+                self._pause_count += 1
+                self._before = self._state.copy()
+                self._pause_line = self._line_number
+                next_pause = text.find(_PAUSE_MARKER, marker_end, end)
+            self._line_number += text.count("\n", marker_start, marker_end)
+            position = marker_end
+
+    ##  Checks the Z at the first move after a pause that moves the head, if
+    #   it's in the range.
+    def _checkFirstMove(self, text: str, start: int, end: int) -> None:
+        match = _XYZ_MOVE_REGEX.search(text, start, end)
+        if match is None:
+            return
+        z, pause_line = self._z_check
+        self._z_check = None
+        self.lines_parsed += 1
+        if parseGCodeLine(match.group()).params.get("Z") is None and self._state.z is not None and abs(self._state.z - z) > 1e-4:
+            self._problem(pause_line, "the first move after it is at Z {after} instead of Z {before}".format(after = self._state.z, before = z))
+
+    ##  Compares the state after a pause with the state before it.
+    #   \param next_layer: Number of the layer after the pause, or None if no
+    #   layer follows it.
+    def _endPause(self, next_layer: Optional[str]) -> None:
+        before = self._before
+        after = self._state
+        self._before = None
+        if after.relative_xyz != before.relative_xyz:
+            self._problem(self._pause_line, "positioning is {after} after it but was {before} before it".format(after = "relative" if after.relative_xyz else "absolute", before = "relative" if before.relative_xyz else "absolute"))
+        relative_e, e = self._layer_e.get(next_layer, (before.relative_e, before.e)) if next_layer is not None else (before.relative_e, before.e)
+        if after.relative_e != relative_e:
+            self._problem(self._pause_line, "extrusion is {after} after it but was {before} before it".format(after = "relative" if after.relative_e else "absolute", before = "relative" if relative_e else "absolute"))
+        elif not relative_e and abs(after.e - e) > 1e-4:
+            self._problem(self._pause_line, "E is {after} after it, but the layer after it continues from E {before}".format(after = after.e, before = e))
+        if after.tool != before.tool:
+            self._problem(self._pause_line, "the tool is T{after} after it but was T{before} before it".format(after = after.tool, before = before.tool))
+        for tool, temperature in sorted(before.temperatures.items()):
+            if after.temperatures.get(tool) != temperature:
+                self._problem(self._pause_line, "the target temperature of T{tool} is {after} after it but was {before} before it".format(tool = tool, after = after.temperatures.get(tool), before = temperature))
+        if before.z is not None:
+            self._z_check = (before.z, self._pause_line)
+
+    def _problem(self, line_number: int, message: str) -> None:
+        self.problems.append("Pause {number} at line {line}: {message}.".format(number = self._pause_count, line = line_number, message = message))
+
+##  Checks the pauses in G-code with a PauseVerifier.
+#   \param chunks: The G-code in pieces of any size, e.g. the layers.
+#   \return The problems found, one message per problem.
+def verifyPauses(chunks: Iterable[str]) -> List[str]:
+    verifier = PauseVerifier()
+    for chunk in chunks:
+        verifier.feed(chunk)
+    return verifier.finish()
+
+##  A melody is a sequence of notes, each a frequency in Hz (0 for a rest), a
+#   duration in milliseconds and a comment (or None). Lines of G-code can be
+#   mixed in as plain strings.
+MelodyEntry = Union[str, Tuple[int, int, Optional[str]]]
+
+##  Melody played when pausing and when resuming.
+_SHORT_MELODY = (
+    (1318, 240, None),
+    (0, 120, None),
+    (1396, 120, None),
+    (1567, 120, None),
+    (0, 120, None),
+    (2093, 720, None),
+    (0, 180, None)
+)
+
+##  Longer melody played when pausing if play_extended_melody is Y, so it is
+#   easier to hear from another room.
+_EXTENDED_MELODY = (
+    "; Play a longer melody so it is easier to hear your printer",
+    "; https://www.thingiverse.com/thing:446853",
+    "; https://www.youtube.com/watch?v=qjwbaRhCCWA",
+    "; You_Could_Be_Mine.g",
+    "; ------------------------",
+    "M117 You Could Be Mine",
+    "; ------------------------",
+    (440, 200, " A4: 440"),
+    (0, 200, " "),
+    (440, 200, " A4: 440"),
+    (330, 200, " E4: 330"),
+    (392, 200, " G4: 392"),
+    (440, 200, " A4: 440"),
+    (0, 200, " "),
+    (440, 200, " A4: 440"),
+    (0, 200, " "),
+    (524, 200, " C5: 524"),
+    (588, 200, " D5: 588"),
+    (524, 200, " C5: 524"),
+    (588, 200, " D5: 588"),
+    (524, 200, " C5: 524"),
+    (440, 200, " A4: 440"),
+    (392, 200, " G4: 392"),
+    "; ------------------------",
+    (440, 200, " A4: 440"),
+    (0, 200, " "),
+    (440, 200, " A4: 440"),
+    (330, 200, " E4: 330"),
+    (392, 200, " G4: 392"),
+    (440, 200, " A4: 440"),
+    (0, 200, " "),
+    (440, 200, " A4: 440"),
+    (0, 200, " "),
+    (524, 200, " C5: 524"),
+    (588, 200, " D5: 588"),
+    (524, 200, " C5: 524"),
+    (588, 200, " D5: 588"),
+    (524, 200, " C5: 524"),
+    (440, 200, " A4: 440"),
+    (392, 200, " G4: 392"),
+    "; ------------------------",
+    (440, 800, " A4: 440"),
+    "; ------------------------",
+    "M117 Finish!!",
+    "; ------------------------",
+    "; Sweet_Child_o_Mine.g",
+    "; ------------------------",
+    "M117 Sweet Child O Mine",
+    "; ------------------------",
+    (294, 200, " D4: 294"),
+    (588, 200, " D5: 588"),
+    (440, 200, " A4: 440"),
+    (392, 200, " G4: 392"),
+    (784, 200, " G5: 784"),
+    (440, 200, " A4: 440"),
+    (740, 200, " F#5: 740"),
+    (440, 200, " A4: 440"),
+    "; ------------------------",
+    (294, 200, " D4: 294"),
+    (588, 200, " D5: 588"),
+    (440, 200, " A4: 440"),
+    (392, 200, " G4: 392"),
+    (784, 200, " G5: 784"),
+    (440, 200, " A4: 440"),
+    (740, 200, " F#5: 740"),
+    (440, 200, " A4: 440"),
+    "; ------------------------",
+    (330, 200, " E4: 330"),
+    (588, 200, " D5: 588"),
+    (440, 200, " A4: 440"),
+    (392, 200, " G4: 392"),
+    (784, 200, " G5: 784"),
+    (440, 200, " A4: 440"),
+    (740, 200, " F#5: 740"),
+    (440, 200, " A4: 440"),
+    "; ------------------------",
+    (330, 200, " E4: 330"),
+    (588, 200, " D5: 588"),
+    (440, 200, " A4: 440"),
+    (392, 200, " G4: 392"),
+    (784, 200, " G5: 784"),
+    (440, 200, " A4: 440"),
+    (740, 200, " F#5: 740"),
+    (440, 200, " A4: 440"),
+    "; ------------------------",
+    (392, 200, " G4: 392"),
+    (588, 200, " D5: 588"),
+    (440, 200, " A4: 440"),
+    (392, 200, " G4: 392"),
+    (784, 200, " G5: 784"),
+    (440, 200, " A4: 440"),
+    (740, 200, " F#5: 740"),
+    (440, 200, " A4: 440"),
+    "; ------------------------",
+    (392, 200, " G4: 392"),
+    (588, 200, " D5: 588"),
+    (440, 200, " A4: 440"),
+    (392, 200, " G4: 392"),
+    (784, 200, " G5: 784"),
+    (440, 200, " A4: 440"),
+    (740, 200, " F#5: 740"),
+    (440, 200, " A4: 440"),
+    "; ------------------------",
+    (294, 800, " D4: 294"),
+    "; ------------------------",
+    "M117 Finish!!",
+    "; ------------------------"
+)
+
+##  Semitones above C of the notes in RTTTL melodies.
+_RTTTL_SEMITONES = {"c": 0, "d": 2, "e": 4, "f": 5, "g": 7, "a": 9, "b": 11, "h": 11}
+_RTTTL_NOTE_REGEX = re.compile(r"^([0-9]*)([a-hp])(#?)(\.?)([0-9]*)(\.?)$")
+
+##  Parses a melody in the RTTTL ringtone format, e.g.
+#   "Beep:d=4,o=5,b=120:8c6,8p,8c6".
+def parseRtttl(text: str) -> Tuple[MelodyEntry, ...]:
+    parts = text.strip().split(":")
+    if len(parts) != 3:
+        raise ValueError("Not an RTTTL melody: expected name:defaults:notes.")
+    name, defaults, notes = parts
+    default_values = {"d": 4, "o": 6, "b": 63}
+    for default in defaults.split(","):
+        key, _, value = default.strip().partition("=")
+        if key.strip().lower() in default_values:
+            default_values[key.strip().lower()] = int(value)
+    whole_note = 4 * 60000 / default_values["b"] #In milliseconds.
+
+    melody = ["; " + name.strip()] if name.strip() else [] # type: List[MelodyEntry]
+    for note in notes.split(","):
+        note = note.strip().lower()
+        if not note:
+            continue
+        match = _RTTTL_NOTE_REGEX.match(note)
+        if match is None:
+            raise ValueError("Invalid RTTTL note: {note}".format(note = note))
+        duration_text, pitch, sharp, dot, octave_text, dot_after_octave = match.groups()
+        duration = whole_note / (int(duration_text) if duration_text else default_values["d"])
+        if dot or dot_after_octave:
+            duration *= 1.5
+        if pitch == "p": #Pause.
+            frequency = 0
+        else:
+            octave = int(octave_text) if octave_text else default_values["o"]
+            semitone = _RTTTL_SEMITONES[pitch] + (1 if sharp else 0)
+            frequency = int(round(440 * 2 ** (octave - 4 + (semitone - 9) / 12))) #A4 is 440Hz.
+        melody.append((frequency, int(round(duration)), None))
+    return tuple(melody)
+
+##  Parses a tune file. Every line is a note (frequency in Hz, 0 for a rest,
+#   and duration in milliseconds, optionally followed by a ; comment) or G-code
+#   that is copied as it is.
+def parseTune(text: str) -> Tuple[MelodyEntry, ...]:
+    melody = [] # type: List[MelodyEntry]
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        if not line.lstrip()[0].isdigit():
+            melody.append(line)
+            continue
+        note, separator, comment = line.partition(";")
+        values = note.split()
+        if len(values) != 2:
+            raise ValueError("Expected a frequency and a duration: {line}".format(line = line))
+        melody.append((int(float(values[0])), int(float(values[1])), comment if separator else None))
+    return tuple(melody)
+
+_loaded_melodies = {} # type: Dict[Tuple[str, int, int], Tuple[MelodyEntry, ...]]
+
+##  Reads a melody from an RTTTL or tune file. The result is cached until
+#   the file changes.
+def loadMelody(path: str) -> Tuple[MelodyEntry, ...]:
+    path = os.path.abspath(os.path.expanduser(path))
+    file_stat = os.stat(path)
+    key = (path, file_stat.st_mtime_ns, file_stat.st_size)
+    melody = _loaded_melodies.get(key)
+    if melody is None:
+        with open(path, encoding = "utf-8") as melody_file:
+            text = melody_file.read()
+        lines = [line for line in text.splitlines() if line.strip() and not line.lstrip().startswith(";")]
+        if lines and re.match(r"^[^:]*:[^:]*:", lines[0]):
+            melody = parseRtttl(" ".join(lines))
+        else:
+            melody = parseTune(text)
+        _loaded_melodies[key] = melody
+    return melody
+
+##  Gets how long a melody plays, in seconds.
+def _melodyDuration(melody: Tuple[MelodyEntry, ...]) -> float:
+    return sum(entry[1] for entry in melody if not isinstance(entry, str)) / 1000
+
+_LAYER_INDEX_CACHE_CHARACTERS = 100 * 1000 * 1000 #Characters of G-code of the layer indices kept in memory, which are kept with the G-code they were read from.
+_LAYER_INDEX_DISK_CACHE_SIZE = 64 #Number of layer indices kept in the cache directory.
+_LAYER_INDEX_FORMAT = 6 #Change when LayerIndex changes, so that indices saved by an older version are not loaded.
+_LAYER_INDEX_EXTENSION = ".layerindex.json"
+
+##  Gets the key of the G-code data in the memory cache of layer indices.
+#
+#   Only the lengths of the entries are used, so this costs next to nothing.
+#   G-code with the same lengths is not necessarily the same, so the cache
+#   keeps the data as well and compares it before using an index. Comparing
+#   the same string objects, which Cura passes again when only the pause
+#   settings change, doesn't even look at the text.
+def _layerIndexKey(data: List[str], initial_layer_height: float) -> Tuple[float, Tuple[int, ...]]:
+    return initial_layer_height, tuple(len(layer) for layer in data)
+
+##  Hashes the G-code data with the settings that its LayerIndex depends on,
+#   to recognise G-code that was read before in the cache directory.
+def _hashLayers(data: List[str], initial_layer_height: float) -> str:
+    digest = hashlib.blake2b(digest_size = 20)
+    digest.update("{format} {height!r}\n".format(format = _LAYER_INDEX_FORMAT, height = initial_layer_height).encode("utf-8"))
+    for layer in data:
+        digest.update(len(layer).to_bytes(8, "little")) #So that moving a line to the next layer changes the hash.
+        digest.update(layer.encode("utf-8", "surrogatepass"))
+    return digest.hexdigest()
+
+##  Settings that the pause code template depends on.
+_TEMPLATE_SETTINGS = ("pause_at", "wait_on_pause_click", "retraction_amount", "retraction_speed", "extrude_amount", "extrude_speed", "park_x", "park_y", "park_position", "standby_temperature", "firmware_retract", "control_temperatures", "display_text", "estimate_time")
+_TEMPLATE_CACHE_SIZE = 64
+
+##  Escapes text to put it literally in a template for str.format.
+def _escapeTemplate(text: str) -> str:
+    return text.replace("{", "{{").replace("}", "}}")
+
+##  Formats a number of seconds as hours, minutes and seconds, e.g. 1:02:03.
+def _formatDuration(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return "{hours}:{minutes:02d}:{seconds:02d}".format(hours = hours, minutes = minutes, seconds = seconds)
+
+##  Rounds a coordinate that the script works out to a micrometre, as a
+#   whole number if it is one, so that it is written like the coordinates
+#   read from the G-code: X60 or X60.5.
+def _roundCoordinate(value: float) -> Union[int, float]:
+    value = round(value, 3)
+    return int(value) if value.is_integer() else value
 
 class PauseAtHeightOptions(Script):
+    _pause_templates = collections.OrderedDict() # type: collections.OrderedDict #Compiled pause code templates, least recently used first.
+    _layer_indices = collections.OrderedDict() # type: collections.OrderedDict #The data, the index without the data and the characters in the data of recently read G-code, by _layerIndexKey(), least recently used first.
+    _compiled_melodies = {} # type: Dict[Tuple[MelodyEntry, ...], str]
+    _cache_lock = threading.Lock() #Guards the caches above, which are shared by scripts running on other threads with executeInBackground().
+
     def __init__(self) -> None:
         super().__init__()
+        self._statistics = Statistics(False)
+        self._job = None # type: Optional[ExecutionJob] #The background execution that is running, if any.
+        self._measuring_memory = False #Whether the run only measures the peak memory, see _measurePeakMemory().
+        self._pauses = [] # type: List[Dict[str, Any]] #The pauses inserted by the last run, in the order of the G-code.
+        self._unlocated_pauses = [] # type: List[Tuple[str, Dict[str, Any]]] #Pause code and pause of pauses not yet found in the output.
+        self._problems = [] # type: List[str] #The problems that verifying the pauses of the last run found.
 
     def getSettingDataString(self) -> str:
         return """{
@@ -31,22 +2421,20 @@ class PauseAtHeightOptions(Script):
                 "pause_height":
                 {
                     "label": "Pause Height",
-                    "description": "At what height should the pause occur?",
+                    "description": "At what height should the pause occur? Separate multiple heights with commas to pause more than once, e.g. 5, 10.5, 20.",
                     "unit": "mm",
-                    "type": "float",
-                    "default_value": 5.0,
-                    "minimum_value": "0",
-                    "minimum_value_warning": "0.27",
+                    "type": "str",
+                    "default_value": "5.0",
+                    "regex": "^ *(([0-9]+([.][0-9]*)?|[.][0-9]+) *(, *([0-9]+([.][0-9]*)?|[.][0-9]+) *)*)?$",
                     "enabled": "pause_at == 'height'"
                 },
                 "pause_layer":
                 {
                     "label": "Pause Layer",
-                    "description": "At what layer should the pause occur?",
-                    "type": "int",
-                    "value": "math.floor((pause_height - 0.27) / 0.1) + 1",
-                    "minimum_value": "0",
-                    "minimum_value_warning": "1",
+                    "description": "At what layer should the pause occur? Separate multiple layers with commas to pause more than once, e.g. 25, 50, 75. If left empty, the script pauses at the layers where the pause heights are reached, read from the sliced layers so that adaptive layer heights are taken into account.",
+                    "type": "str",
+                    "default_value": "",
+                    "regex": "^ *(-?[0-9]+ *(, *-?[0-9]+ *)*)?$",
                     "enabled": "pause_at == 'layer_no'"
                 },
                 "play_extended_melody":
@@ -56,6 +2444,13 @@ class PauseAtHeightOptions(Script):
                     "type": "str",
                     "default_value": "N"
                 },
+                "melody_file":
+                {
+                    "label": "Melody File",
+                    "description": "An RTTTL ringtone or tune file to play when pausing, instead of the built-in melody. A tune file has one note per line: the frequency in Hz (0 for a rest) and the duration in milliseconds, optionally followed by a ; comment. Other lines in a tune file are copied into the G-code as they are. Leave empty to use the built-in melody.",
+                    "type": "str",
+                    "default_value": ""
+                },
                 "head_park_x":
                 {
                     "label": "Park Print Head X",
@@ -72,6 +2467,24 @@ class PauseAtHeightOptions(Script):
                     "type": "float",
                     "default_value": 0
                 },
+                "park_position":
+                {
+                    "label": "Park Position",
+                    "description": "Where to park the head. Automatically parks it just outside of every layer printed so far and the layer the print resumes with, at the point with the shortest travel from where it stops and back to where it resumes, so that it doesn't travel far or ooze over the print. The footprint of the layers is their bounding box or, closer to the print for round parts, their convex hull. If there is no room on the bed, or the layers don't extrude, the head parks at Park Print Head X/Y.",
+                    "type": "enum",
+                    "options": {"fixed": "Park Print Head X/Y", "bounding_box": "Outside of the print's bounding box", "convex_hull": "Outside of the print's convex hull"},
+                    "default_value": "fixed"
+                },
+                "park_clearance":
+                {
+                    "label": "Park Clearance",
+                    "description": "How far the automatic park position stays away from the print.",
+                    "unit": "mm",
+                    "type": "float",
+                    "default_value": 10,
+                    "minimum_value": "0",
+                    "enabled": "park_position != 'fixed'"
+                },
                 "retraction_amount":
                 {
                     "label": "Retraction",
@@ -134,6 +2547,48 @@ class PauseAtHeightOptions(Script):
                     "description": "Text that should appear on the display while paused. If left empty, there will not be any message.",
                     "type": "str",
                     "default_value": ""
+                },
+                "log_statistics":
+                {
+                    "label": "Log Statistics",
+                    "description": "Log how long each step of the script takes, how much G-code it reads and how much memory it uses. The memory is measured in a second, complete run with memory tracing after the timed one, which makes the script take several times as long with this enabled. Useful to find out why it is slow on a big print.",
+                    "type": "bool",
+                    "default_value": false
+                },
+                "layer_cache_directory":
+                {
+                    "label": "Layer Cache Directory",
+                    "description": "Directory to keep what was read from the layers of recent prints in, so that changing only the pause settings doesn't read all layers again, also after restarting Cura. Recent prints are also kept in memory, up to 100 MB of G-code. Only use a directory that only you can write to. Leave empty to not keep anything on disk.",
+                    "type": "str",
+                    "default_value": ""
+                },
+                "profile_file":
+                {
+                    "label": "Profile Output File",
+                    "description": "If set, the script is profiled with cProfile and the profile is written to this file, to be read with pstats or a profile viewer. Leave empty to not profile.",
+                    "type": "str",
+                    "default_value": ""
+                },
+                "estimate_time":
+                {
+                    "label": "Estimate Time to Pause",
+                    "description": "Estimate how long the print runs before each pause, and how long the pause waits and plays its melodies. The time before a pause is Cura's own estimate from the layer before it or, for G-code without that, worked out from the moves. The estimates are written in the comments of the pause code and, with the display text, shown on the display. Reading the moves up to the last pause takes a moment on big prints that don't come from Cura.",
+                    "type": "bool",
+                    "default_value": false
+                },
+                "verify_pauses":
+                {
+                    "label": "Verify Pauses",
+                    "description": "Follow the state of the printer through the resulting G-code (absolute or relative movement and extrusion, E position, Z, tool and temperatures) and log a warning for every pause that doesn't leave it as it found it.",
+                    "type": "bool",
+                    "default_value": false
+                },
+                "pause_report_file":
+                {
+                    "label": "Pause Report File",
+                    "description": "If set, a description of every pause is written to this file as JSON, for tools that schedule prints: its layer, Z and height, where and with which E value it resumes, the tool and temperatures, where the pause code starts in the G-code in bytes and the estimated time from the start of the print. Leave empty to not write a report.",
+                    "type": "str",
+                    "default_value": ""
                 }
             }
         }"""
@@ -141,378 +2596,1483 @@ class PauseAtHeightOptions(Script):
     ##  Get the X and Y values for a layer (will be used to get X and Y of the
     #   layer after the pause).
     def getNextXY(self, layer: str) -> Tuple[float, float]:
+        return self._nextXY(layer)[0]
+
+    ##  Same as getNextXY, but also gives the number of lines parsed, for the
+    #   statistics.
+    def _nextXY(self, layer: str) -> Tuple[Tuple[float, float], int]:
         lines = layer.split("\n")
-        for line in lines:
-            if self.getValue(line, "X") is not None and self.getValue(line, "Y") is not None:
-                x = self.getValue(line, "X")
-                y = self.getValue(line, "Y")
-                return x, y
-        return 0, 0
+        for line_number, line in enumerate(lines):
+            params = parseGCodeLine(line).params
+            x = params.get("X")
+            y = params.get("Y")
+            if x is not None and y is not None:
+                return (x, y), line_number + 1
+        return (0, 0), len(lines)
 
-    def playShortMelody(self):
-        prepend_gcode  = self.putValue(M = 300, S = 1318, P = 240) + "\n"
-        prepend_gcode += self.putValue(M = 300, S = 0, P = 120) + "\n"
-        prepend_gcode += self.putValue(M = 300, S = 1396, P = 120) + "\n"
-        prepend_gcode += self.putValue(M = 300, S = 1567, P = 120) + "\n"
-        prepend_gcode += self.putValue(M = 300, S = 0, P = 120) + "\n"
-        prepend_gcode += self.putValue(M = 300, S = 2093, P = 720) + "\n"
-        prepend_gcode += self.putValue(M = 300, S = 0, P = 180) + "\n"
-        return prepend_gcode
+    ##  Turns a melody into M300 commands. The result is cached, so every
+    #   melody is only compiled once.
+    def compileMelody(self, melody: Tuple[MelodyEntry, ...]) -> str:
+        compiled = PauseAtHeightOptions._compiled_melodies.get(melody)
+        if compiled is None:
+            compiled = ""
+            for entry in melody:
+                if isinstance(entry, str):
+                    compiled += entry + "\n"
+                    continue
+                frequency, duration, comment = entry
+                compiled += self.putValue(M = 300, S = frequency, P = duration)
+                if comment is not None:
+                    compiled += " ;" + comment
+                compiled += "\n"
+            PauseAtHeightOptions._compiled_melodies[melody] = compiled
+        return compiled
 
-    def playExtendedMelody(self):
-        prepend_gcode  = "; Play a longer melody so it is easier to hear your printer\n"
-        prepend_gcode += "; https://www.thingiverse.com/thing:446853\n"
-        prepend_gcode += "; https://www.youtube.com/watch?v=qjwbaRhCCWA\n"
-        prepend_gcode += "; You_Could_Be_Mine.g\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += "M117 You Could Be Mine\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 0, P = 200) + " ; \n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 330, P = 200) + " ; E4: 330\n"
-        prepend_gcode += self.putValue(M = 300, S = 392, P = 200) + " ; G4: 392\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 0, P = 200) + " ; \n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 0, P = 200) + " ; \n"
-        prepend_gcode += self.putValue(M = 300, S = 524, P = 200) + " ; C5: 524\n"
-        prepend_gcode += self.putValue(M = 300, S = 588, P = 200) + " ; D5: 588\n"
-        prepend_gcode += self.putValue(M = 300, S = 524, P = 200) + " ; C5: 524\n"
-        prepend_gcode += self.putValue(M = 300, S = 588, P = 200) + " ; D5: 588\n"
-        prepend_gcode += self.putValue(M = 300, S = 524, P = 200) + " ; C5: 524\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 392, P = 200) + " ; G4: 392\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 0, P = 200) + " ; \n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 330, P = 200) + " ; E4: 330\n"
-        prepend_gcode += self.putValue(M = 300, S = 392, P = 200) + " ; G4: 392\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 0, P = 200) + " ; \n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 0, P = 200) + " ; \n"
-        prepend_gcode += self.putValue(M = 300, S = 524, P = 200) + " ; C5: 524\n"
-        prepend_gcode += self.putValue(M = 300, S = 588, P = 200) + " ; D5: 588\n"
-        prepend_gcode += self.putValue(M = 300, S = 524, P = 200) + " ; C5: 524\n"
-        prepend_gcode += self.putValue(M = 300, S = 588, P = 200) + " ; D5: 588\n"
-        prepend_gcode += self.putValue(M = 300, S = 524, P = 200) + " ; C5: 524\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 392, P = 200) + " ; G4: 392\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 800) + " ; A4: 440\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += "M117 Finish!!\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += "; Sweet_Child_o_Mine.g\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += "M117 Sweet Child O Mine\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += self.putValue(M = 300, S = 294, P = 200) + " ; D4: 294\n"
-        prepend_gcode += self.putValue(M = 300, S = 588, P = 200) + " ; D5: 588\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 392, P = 200) + " ; G4: 392\n"
-        prepend_gcode += self.putValue(M = 300, S = 784, P = 200) + " ; G5: 784\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 740, P = 200) + " ; F#5: 740\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += self.putValue(M = 300, S = 294, P = 200) + " ; D4: 294\n"
-        prepend_gcode += self.putValue(M = 300, S = 588, P = 200) + " ; D5: 588\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 392, P = 200) + " ; G4: 392\n"
-        prepend_gcode += self.putValue(M = 300, S = 784, P = 200) + " ; G5: 784\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 740, P = 200) + " ; F#5: 740\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += self.putValue(M = 300, S = 330, P = 200) + " ; E4: 330\n"
-        prepend_gcode += self.putValue(M = 300, S = 588, P = 200) + " ; D5: 588\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 392, P = 200) + " ; G4: 392\n"
-        prepend_gcode += self.putValue(M = 300, S = 784, P = 200) + " ; G5: 784\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 740, P = 200) + " ; F#5: 740\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += self.putValue(M = 300, S = 330, P = 200) + " ; E4: 330\n"
-        prepend_gcode += self.putValue(M = 300, S = 588, P = 200) + " ; D5: 588\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 392, P = 200) + " ; G4: 392\n"
-        prepend_gcode += self.putValue(M = 300, S = 784, P = 200) + " ; G5: 784\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 740, P = 200) + " ; F#5: 740\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += self.putValue(M = 300, S = 392, P = 200) + " ; G4: 392\n"
-        prepend_gcode += self.putValue(M = 300, S = 588, P = 200) + " ; D5: 588\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 392, P = 200) + " ; G4: 392\n"
-        prepend_gcode += self.putValue(M = 300, S = 784, P = 200) + " ; G5: 784\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 740, P = 200) + " ; F#5: 740\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += self.putValue(M = 300, S = 392, P = 200) + " ; G4: 392\n"
-        prepend_gcode += self.putValue(M = 300, S = 588, P = 200) + " ; D5: 588\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 392, P = 200) + " ; G4: 392\n"
-        prepend_gcode += self.putValue(M = 300, S = 784, P = 200) + " ; G5: 784\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += self.putValue(M = 300, S = 740, P = 200) + " ; F#5: 740\n"
-        prepend_gcode += self.putValue(M = 300, S = 440, P = 200) + " ; A4: 440\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += self.putValue(M = 300, S = 294, P = 800) + " ; D4: 294\n"
-        prepend_gcode += "; ------------------------\n"
-        prepend_gcode += "M117 Finish!!\n"
-        prepend_gcode += "; ------------------------\n"
-        return prepend_gcode
+    def playShortMelody(self) -> str:
+        return self.compileMelody(_SHORT_MELODY)
+
+    def playExtendedMelody(self) -> str:
+        return self.compileMelody(_EXTENDED_MELODY)
+
+    ##  Reads the settings of this script and the printer.
+    def _getPauseSettings(self) -> Dict[str, Any]:
+        global_stack = Application.getInstance().getGlobalContainerStack()
+        return {
+            "pause_at": self.getSettingValueByKey("pause_at"),
+            "wait_on_pause_click": self.getSettingValueByKey("wait_on_pause_click"),
+            "pause_heights": parsePausePoints(self.getSettingValueByKey("pause_height"), float),
+            "pause_layers": parsePausePoints(self.getSettingValueByKey("pause_layer"), int),
+            "retraction_amount": self.getSettingValueByKey("retraction_amount"),
+            "retraction_speed": self.getSettingValueByKey("retraction_speed"),
+            "extrude_amount": self.getSettingValueByKey("extrude_amount"),
+            "extrude_speed": self.getSettingValueByKey("extrude_speed"),
+            "park_x": self.getSettingValueByKey("head_park_x"),
+            "park_y": self.getSettingValueByKey("head_park_y"),
+            "park_position": self.getSettingValueByKey("park_position"),
+            "park_clearance": self.getSettingValueByKey("park_clearance"),
+            "bed": self._getBed(global_stack),
+            "redo_layers": self.getSettingValueByKey("redo_layers"),
+            "standby_temperature": self.getSettingValueByKey("standby_temperature"),
+            "firmware_retract": global_stack.getProperty("machine_firmware_retract", "value"),
+            "control_temperatures": global_stack.getProperty("machine_nozzle_temp_enabled", "value"),
+            "initial_layer_height": global_stack.getProperty("layer_height_0", "value"),
+            "display_text": self.getSettingValueByKey("display_text"),
+            "play_extended_melody": self.getSettingValueByKey("play_extended_melody") == "Y",
+            "melody_file": self.getSettingValueByKey("melody_file"),
+            "layer_cache_directory": self.getSettingValueByKey("layer_cache_directory"),
+            "log_statistics": bool(self.getSettingValueByKey("log_statistics")),
+            "profile_file": self.getSettingValueByKey("profile_file"),
+            "scan_processes": max(int(self.getSettingValueByKey("scan_processes") or 1), 1), #Only on the command line; Cura gives None.
+            "estimate_time": bool(self.getSettingValueByKey("estimate_time")),
+            "verify_pauses": bool(self.getSettingValueByKey("verify_pauses")),
+            "pause_report_file": self.getSettingValueByKey("pause_report_file"),
+            "acceleration": global_stack.getProperty("machine_acceleration", "value")
+        }
+
+    ##  Gets the smallest X and Y and the largest X and Y of the bed.
+    def _getBed(self, global_stack: Any) -> Tuple[float, float, float, float]:
+        width = global_stack.getProperty("machine_width", "value")
+        depth = global_stack.getProperty("machine_depth", "value")
+        if global_stack.getProperty("machine_center_is_zero", "value"):
+            return -width / 2, -depth / 2, width / 2, depth / 2
+        return 0, 0, width, depth
+
+    ##  Whether the settings ask for any pause at all.
+    def _hasPausePoints(self, settings: Dict[str, Any]) -> bool:
+        if settings["pause_at"] == "height":
+            return bool(settings["pause_heights"])
+        return bool(settings["pause_layers"] or settings["pause_heights"])
+
+    ##  Gets the index of the layers of the G-code data.
+    #
+    #   Indices of recently read G-code are kept in memory, up to
+    #   _LAYER_INDEX_CACHE_CHARACTERS of G-code, and, if the
+    #   layer_cache_directory setting is set, on disk, so that when only the
+    #   pause settings change, the layers are not read again. In memory they
+    #   are found by the lengths of the entries, see _layerIndexKey(); only
+    #   the disk cache needs the hash of the data. The index only reads the
+    #   layers as far as the pauses need them; _keepLayerIndex() puts it in
+    #   the caches with what it read.
+    #   \return The hash of the data if it was needed for the disk cache,
+    #   and an index with a copy of the data, which stays as it is when pauses
+    #   are inserted in the data.
+    def _getLayerIndex(self, settings: Dict[str, Any], data: List[str]) -> Tuple[Optional[str], LayerIndex]:
+        track_layers = settings["pause_at"] != "height"
+        if self._measuring_memory:
+            return None, LayerIndex(data, settings["initial_layer_height"], track_layers = track_layers, processes = settings["scan_processes"])
+        key = _layerIndexKey(data, settings["initial_layer_height"])
+        with PauseAtHeightOptions._cache_lock:
+            cached = PauseAtHeightOptions._layer_indices.get(key)
+        layer_index = None
+        if cached is not None and cached[0] == data:
+            layer_index = cached[1]
+        digest = None
+        if settings["layer_cache_directory"] and (layer_index is None or (track_layers and not layer_index.track_layers)):
+            with self._statistics.measure("hash"):
+                digest = _hashLayers(data, settings["initial_layer_height"])
+            layer_index = self._loadLayerIndex(settings, digest)
+        if layer_index is not None and (layer_index.track_layers or not track_layers):
+            self._statistics.count("layer_cache_hits")
+            return digest, layer_index.withData(list(data))
+        self._statistics.count("layer_cache_misses")
+        return digest, LayerIndex(data, settings["initial_layer_height"], track_layers = track_layers, processes = settings["scan_processes"], progress = self._job.advance if self._job is not None else None)
+
+    ##  Keeps the index of the layers that a run used in the caches, with
+    #   the layers that it read.
+    #   \param digest: The hash of the data, if _getLayerIndex() needed it.
+    def _keepLayerIndex(self, settings: Dict[str, Any], digest: Optional[str], layer_index: LayerIndex) -> None:
+        if self._measuring_memory:
+            return
+        self._saveLayerIndex(settings, digest, layer_index)
+        data = layer_index.data
+        key = _layerIndexKey(data, settings["initial_layer_height"])
+        size = sum(map(len, data))
+        cache = PauseAtHeightOptions._layer_indices
+        with PauseAtHeightOptions._cache_lock:
+            cache.pop(key, None)
+            if size > _LAYER_INDEX_CACHE_CHARACTERS: #Would push out everything else and keep too much G-code alive.
+                return
+            cache[key] = (data, layer_index.withData(None), size)
+            total_size = sum(cached[2] for cached in cache.values())
+            while total_size > _LAYER_INDEX_CACHE_CHARACTERS:
+                total_size -= cache.popitem(last = False)[1][2]
+
+    ##  Loads a layer index from the cache directory, if there is one.
+    def _loadLayerIndex(self, settings: Dict[str, Any], digest: str) -> Optional[LayerIndex]:
+        path = os.path.join(os.path.expanduser(settings["layer_cache_directory"]), digest + _LAYER_INDEX_EXTENSION)
+        try:
+            with open(path, encoding = "utf-8") as index_file:
+                values = json.load(index_file)
+            if values.get("format") != _LAYER_INDEX_FORMAT:
+                return None
+            layer_index = LayerIndex.fromDict(values)
+            os.utime(path) #Mark it as recently used.
+        except FileNotFoundError:
+            return None
+        except Exception as e: #Unreadable or from an incompatible version. Read the layers instead.
+            Logger.log("w", "Could not load the layer index %s: %s", path, str(e))
+            return None
+        return layer_index
+
+    ##  Saves a layer index in the cache directory, if there is one and the
+    #   index isn't saved there yet, and removes the least recently used
+    #   indices if there are too many. The index is read to the end first, so
+    #   that the saved index can be used for any pause.
+    #   \param digest: The hash of the data, or None if it wasn't needed yet.
+    def _saveLayerIndex(self, settings: Dict[str, Any], digest: Optional[str], layer_index: LayerIndex) -> None:
+        if not settings["layer_cache_directory"]:
+            return
+        directory = os.path.expanduser(settings["layer_cache_directory"])
+        if digest is None:
+            with self._statistics.measure("hash"):
+                digest = _hashLayers(layer_index.data, settings["initial_layer_height"])
+        if os.path.exists(os.path.join(directory, digest + _LAYER_INDEX_EXTENSION)):
+            return
+        layer_index.readAll()
+        values = layer_index.asDict()
+        values["format"] = _LAYER_INDEX_FORMAT
+        try:
+            os.makedirs(directory, exist_ok = True)
+            file_descriptor, temporary_path = tempfile.mkstemp(suffix = ".tmp", dir = directory)
+            try:
+                with os.fdopen(file_descriptor, "w", encoding = "utf-8") as index_file:
+                    json.dump(values, index_file)
+                os.replace(temporary_path, os.path.join(directory, digest + _LAYER_INDEX_EXTENSION))
+            except BaseException:
+                os.remove(temporary_path)
+                raise
+
+            paths = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(_LAYER_INDEX_EXTENSION)]
+            if len(paths) > _LAYER_INDEX_DISK_CACHE_SIZE:
+                paths.sort(key = os.path.getmtime)
+                for path in paths[:len(paths) - _LAYER_INDEX_DISK_CACHE_SIZE]:
+                    os.remove(path)
+        except OSError as e:
+            Logger.log("w", "Could not save the layer index in %s: %s", directory, str(e))
+
+    ##  Creates the pause code for one pause and puts it in front of a layer.
+    #
+    #   The result is a list of segments of G-code rather than one string, so
+    #   that the layer and the redone layers are not copied until the
+    #   segments are joined once, or not at all if they are written out.
+    #   \param settings: Settings from _getPauseSettings.
+    #   \param layer_index: Index of the layers, holding at least the layers
+    #   around the pause as they were before any pause was inserted.
+    #   \param pause_state: Where to pause.
+    #   \param segments: The segments of the layer to pause before.
+    #   \return The segments of the pause code, the redone layers and the layer.
+    def _insertPause(self, settings: Dict[str, Any], layer_index: LayerIndex, pause_state: PauseState, segments: List[str]) -> List[str]:
+        redo_layers = settings["redo_layers"]
+        index = pause_state.index
+
+        # Get X and Y from the next layer (better position for
+        # the nozzle)
+        x, y = layer_index.firstXY(index + 1)
+
+        # Last extruder absolute position of the previous layer
+        with self._statistics.measure("e_scan"):
+            current_e = layer_index.lastE(index - 1)
+
+        # include a number of previous layers
+        if redo_layers > 0:
+            with self._statistics.measure("redo_layers"):
+                segments = [layer_index.entry(index - i) for i in range(redo_layers, 0, -1)] + segments
+
+                # Get X and Y from the next layer (better position for
+                # the nozzle)
+                first_xy = layer_index.firstXYOfLayers([index - i for i in range(redo_layers, -1, -1)])
+                if first_xy is None:
+                    first_xy, parsed = self._nextXY("".join(segments))
+                    self._statistics.count("lines_parsed", parsed)
+                    self._statistics.count("parse_calls", parsed)
+                x, y = first_xy
+
+            # Get extruder's absolute position at the
+            # beginning of the first layer redone
+            # see https://github.com/nallath/PostProcessingPlugin/issues/55
+            with self._statistics.measure("e_scan"):
+                current_e = layer_index.firstEDifferentFrom(index - redo_layers, current_e)
+
+        time_to_pause = 0.0
+        if settings["estimate_time"] or settings["pause_report_file"]:
+            with self._statistics.measure("time_estimate"):
+                time_to_pause = layer_index.timeBefore(index)
+
+        park = None
+        if settings["park_position"] != "fixed" and not pause_state.is_griffin and index > 0:
+            with self._statistics.measure("park_position"):
+                park = layer_index.parkPosition(index, (x, y), settings["bed"], settings["park_clearance"])
+
+        with self._statistics.measure("pause_code"):
+            pause_code = self._pauseCode(settings, pause_state, x, y, current_e, time_to_pause, park)
+        self._statistics.count("pauses")
+        by_height = settings["pause_at"] == "height"
+        self._unlocated_pauses.append((pause_code, {
+            "layer": layer_index.layers[index].number if by_height else pause_state.layer,
+            "z": round(pause_state.z, 6),
+            "height": round(pause_state.height, 6) if by_height else None,
+            "resume_x": x,
+            "resume_y": y,
+            "e": current_e,
+            "tool": pause_state.tool,
+            "temperatures": {str(tool): temperature for tool, temperature in sorted(pause_state.temperatures.items())},
+            "byte_offset": None,
+            "estimated_seconds": round(time_to_pause, 1) if settings["estimate_time"] or settings["pause_report_file"] else None
+        }))
+        return [pause_code] + segments
+
+    ##  Creates the code for one pause.
+    #
+    #   The code is made from a template that is compiled once for the
+    #   settings, so only the values that differ per pause are filled in.
+    #   \param settings: Settings from _getPauseSettings.
+    #   \param pause_state: Where to pause.
+    #   \param x: X to return to after the pause.
+    #   \param y: Y to return to after the pause.
+    #   \param current_e: Absolute E position to restore after the pause.
+    #   \param time_to_pause: Estimated seconds from the start of the print
+    #   to the pause, if the estimate_time setting is enabled.
+    #   \param park: Where to park the head, if the park_position setting
+    #   found a place. Otherwise it parks at head_park_x and head_park_y.
+    def _pauseCode(self, settings: Dict[str, Any], pause_state: PauseState, x: float, y: float, current_e: float, time_to_pause: float = 0.0, park: Optional[Tuple[float, float]] = None) -> str:
+        if not pause_state.is_griffin and pause_state.extrusion_f == 0:
+            Logger.log("w", "No previous feedrate found in gcode, feedrate for next layer(s) might be incorrect")
+        template = self._getPauseTemplate(settings, pause_state.is_griffin, pause_state.z < 15, pause_state.extrusion_f != 0)
+        return template.format(
+            z = pause_state.z,
+            z_up = pause_state.z + 1,
+            height = pause_state.height,
+            layer = pause_state.layer,
+            x = x,
+            y = y,
+            temperature = int(pause_state.temperatures.get(pause_state.tool, 0)),
+            extrusion_f = pause_state.extrusion_f,
+            e = current_e,
+            time_to_pause = _formatDuration(time_to_pause),
+            park_x = _roundCoordinate(park[0]) if park is not None else settings["park_x"],
+            park_y = _roundCoordinate(park[1]) if park is not None else settings["park_y"]
+        )
+
+    ##  Gets the compiled template for the pause code, compiling it if it is
+    #   not in the cache yet.
+    def _getPauseTemplate(self, settings: Dict[str, Any], is_griffin: bool, low_z: bool, has_extrusion_f: bool) -> str:
+        melody = self._getPauseMelody(settings)
+        key = tuple(settings[setting_key] for setting_key in _TEMPLATE_SETTINGS) + (melody, is_griffin, low_z, has_extrusion_f)
+        templates = PauseAtHeightOptions._pause_templates
+        with PauseAtHeightOptions._cache_lock:
+            template = templates.get(key)
+            if template is not None:
+                templates.move_to_end(key)
+        if template is None:
+            template = self._compilePauseTemplate(settings, melody, is_griffin, low_z, has_extrusion_f)
+            with PauseAtHeightOptions._cache_lock:
+                templates[key] = template
+                if len(templates) > _TEMPLATE_CACHE_SIZE:
+                    templates.popitem(last = False)
+        return template
+
+    ##  Gets the melody to play when pausing: the melody file if there is one,
+    #   otherwise one of the built-in melodies.
+    def _getPauseMelody(self, settings: Dict[str, Any]) -> Tuple[MelodyEntry, ...]:
+        if settings["melody_file"]:
+            try:
+                return loadMelody(settings["melody_file"])
+            except (OSError, ValueError) as e:
+                Logger.log("w", "Could not read melody file %s, playing the built-in melody instead: %s", settings["melody_file"], str(e))
+        return _EXTENDED_MELODY if settings["play_extended_melody"] else _SHORT_MELODY
+
+    ##  Compiles the pause code into a template for str.format. The values
+    #   that differ per pause are left as fields: z, z_up, height, layer, x,
+    #   y, temperature, extrusion_f, e, time_to_pause, park_x and park_y.
+    def _compilePauseTemplate(self, settings: Dict[str, Any], melody: Tuple[MelodyEntry, ...], is_griffin: bool, low_z: bool, has_extrusion_f: bool) -> str:
+        pause_at = settings["pause_at"]
+        wait_on_pause_click = settings["wait_on_pause_click"]
+        retraction_amount = settings["retraction_amount"]
+        retraction_speed = settings["retraction_speed"]
+        extrude_amount = settings["extrude_amount"]
+        extrude_speed = settings["extrude_speed"]
+        park_x = settings["park_x"]
+        park_y = settings["park_y"]
+        standby_temperature = settings["standby_temperature"]
+        firmware_retract = settings["firmware_retract"]
+        control_temperatures = settings["control_temperatures"]
+        display_text = settings["display_text"]
+        estimate_time = settings["estimate_time"]
+
+        prepend_gcode = ";TYPE:CUSTOM\n"
+        prepend_gcode += ";added code by post processing\n"
+        prepend_gcode += ";script: PauseAtHeightOptions.py\n"
+        if pause_at == "height":
+            prepend_gcode += ";current z: {z}\n"
+            prepend_gcode += ";current height: {height}\n"
+        else:
+            prepend_gcode += ";current layer: {layer}\n"
+        if estimate_time:
+            prepend_gcode += ";estimated time to pause: {time_to_pause}\n"
+            pause_duration = wait_on_pause_click + _melodyDuration(melody) + _melodyDuration(_SHORT_MELODY)
+            prepend_gcode += ";estimated pause duration without clicking Pause: " + _formatDuration(pause_duration) + "\n"
+
+        if not is_griffin:
+            # Retraction
+            prepend_gcode += self.putValue(M = 83) + " ; switch to relative E values for any needed retraction\n"
+            if retraction_amount != 0:
+                if firmware_retract: #Can't set the distance directly to what the user wants. We have to choose ourselves.
+                    retraction_count = 1 if control_temperatures else 3 #Retract more if we don't control the temperature.
+                    for i in range(retraction_count):
+                        prepend_gcode += self.putValue(G = 10) + "\n"
+                else:
+                    prepend_gcode += self.putValue(G = 1, E = -retraction_amount, F = retraction_speed * 60) + "\n"
+
+            # Move the head up
+            prepend_gcode += self.putValue(G = 0, Z = "{z_up}", F = 300) + " ; move up a millimeter above current z ({z}) to get the nozzle off of the print\n"
+
+            if settings["park_position"] != "fixed": #Found per pause.
+                park_x, park_y = "{park_x}", "{park_y}"
+            prepend_gcode += self.putValue(G = 0, X = park_x, Y = park_y, F = 9000) + " ; park nozzle at a safe place so we can purge new filament\n"
+
+            if low_z:
+                prepend_gcode += self.putValue(G = 0, Z = 15, F = 300) + " ; too close to bed--move to at least 15mm\n"
+
+            if control_temperatures:
+                # Set extruder standby temperature
+                prepend_gcode += self.putValue(M = 104, S = standby_temperature) + " ; standby temperature\n"
+
+        if estimate_time:
+            prepend_gcode += "M117 " + _escapeTemplate(display_text or "Pause") + " at {time_to_pause}\n"
+        elif display_text:
+            prepend_gcode += "M117 " + _escapeTemplate(display_text) + "\n"
+
+        # Set relative position ON
+        prepend_gcode += self.putValue(G = 91) + " ; switch to relative movement \n"
+
+        # Z axis 15mm up
+        prepend_gcode += self.putValue(G = 0, Z = 15.0) + " ; lift the head 15mm above whereever it was to make it easier to clean up extruded filament.\n"
+
+        # Set relative position OFF
+        prepend_gcode += self.putValue(G = 90) + " ; switch back to absolute movement \n"
+
+        # Melody
+        prepend_gcode += _escapeTemplate(self.compileMelody(melody))
 
+        # Wating for specified seconds, during this time you must click Pause on-screen,
+        # otherwise the program will automatically resume printing.
+        prepend_gcode += self.putValue(G = 4, S = wait_on_pause_click) + "\n"
+
+        # Now you can change the filament or what-have-you.
+        # To continue printing, click your Continue/resume button on-screen.
+        prepend_gcode += _escapeTemplate(self.playShortMelody())
+
+        if not is_griffin:
+            if control_temperatures:
+                # Set extruder resume temperature
+                prepend_gcode += self.putValue(M = 109, S = "{temperature}") + " ; resume temperature\n"
+
+            # Push the filament back
+            if retraction_amount != 0:
+                prepend_gcode += self.putValue(G = 1, E = retraction_amount, F = retraction_speed * 60) + " ; I think this is a bug? It pushes out filament, not retracts. Seems like we could use the retraction BEFORE the pause though, right?\n"
+
+            # Optionally extrude material
+            if extrude_amount != 0:
+                prepend_gcode += self.putValue(G = 1, E = extrude_amount, F = extrude_speed * 60) + " ; extrude the new filament \n"
+
+            # and retract again, the properly primes the nozzle
+            # when changing filament.
+            if retraction_amount != 0:
+                prepend_gcode += self.putValue(G = 1, E = -retraction_amount, F = retraction_speed * 60) + " ; retract again, this helps prevent spooging while in transit back to the print\n"
+
+            # Move the head back
+            if low_z:
+                prepend_gcode += self.putValue(G = 0, Z = "{z_up}", F = 300) + " ; Move Z near print before moving X,Y\n"
+
+            prepend_gcode += self.putValue(G = 0, X = "{x}", Y = "{y}", F = 9000) + " ; return to the original X,Y\n"
+            prepend_gcode += self.putValue(G = 0, Z = "{z}", F = 300) + " ; vertical move back down to original position\n"
+
+            if retraction_amount != 0:
+                if firmware_retract: #Can't set the distance directly to what the user wants. We have to choose ourselves.
+                    retraction_count = 1 if control_temperatures else 3 #Retract more if we don't control the temperature.
+                    for i in range(retraction_count):
+                        prepend_gcode += self.putValue(G = 11) + "\n"
+                else:
+                    prepend_gcode += self.putValue(G = 1, E = retraction_amount, F = retraction_speed * 60) + "\n"
+
+            if has_extrusion_f:
+                prepend_gcode += self.putValue(G = 1, F = "{extrusion_f}") + " ; restore extrusion feedrate\n"
+
+            prepend_gcode += self.putValue(M = 82) + " ; switch back to absolute E values\n"
+            prepend_gcode += self.putValue(G = 92, E = "{e}") + " ; reset extrusion value to pre-pause value\n"
+
+        return prepend_gcode
 
     ##  Inserts the pause commands.
     #   \param data: List of layers.
     #   \return New list of layers.
     def execute(self, data: List[str]) -> List[str]:
-        pause_at = self.getSettingValueByKey("pause_at")
-        wait_on_pause_click = self.getSettingValueByKey("wait_on_pause_click")
-        pause_height = self.getSettingValueByKey("pause_height")
-        pause_layer = self.getSettingValueByKey("pause_layer")
-        retraction_amount = self.getSettingValueByKey("retraction_amount")
-        retraction_speed = self.getSettingValueByKey("retraction_speed")
-        extrude_amount = self.getSettingValueByKey("extrude_amount")
-        extrude_speed = self.getSettingValueByKey("extrude_speed")
-        park_x = self.getSettingValueByKey("head_park_x")
-        park_y = self.getSettingValueByKey("head_park_y")
-        layers_started = False
-        redo_layers = self.getSettingValueByKey("redo_layers")
-        standby_temperature = self.getSettingValueByKey("standby_temperature")
-        firmware_retract = Application.getInstance().getGlobalContainerStack().getProperty("machine_firmware_retract", "value")
-        control_temperatures = Application.getInstance().getGlobalContainerStack().getProperty("machine_nozzle_temp_enabled", "value")
-        initial_layer_height = Application.getInstance().getGlobalContainerStack().getProperty("layer_height_0", "value")
-        display_text = self.getSettingValueByKey("display_text")
-        play_extended_melody = self.getSettingValueByKey("play_extended_melody") == "Y"
-
-        is_griffin = False
+        settings = self._getPauseSettings()
+        self._statistics = Statistics(settings["log_statistics"])
+        self._pauses = []
+        self._unlocated_pauses = []
+        self._problems = []
+        if not self._hasPausePoints(settings):
+            self._writePauseReport(settings)
+            return data
+
+        profiler = None
+        if settings["profile_file"]:
+            profiler = cProfile.Profile()
+        original_data = None # type: Optional[List[str]]
+        if self._statistics.enabled:
+            self._statistics.count("layers", len(data))
+            self._statistics.count("lines", sum(layer.count("\n") for layer in data))
+            original_data = list(data)
+        succeeded = False
+        try:
+            if profiler is not None:
+                profiler.enable()
+            try:
+                data = self._insertPauses(settings, data)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+            succeeded = True
+            return data
+        finally:
+            if self._statistics.enabled:
+                if tracemalloc.is_tracing(): #Someone else traces the whole run, so the timers already include the tracing.
+                    self._statistics.peak_memory = tracemalloc.get_traced_memory()[1]
+                elif succeeded:
+                    self._statistics.peak_memory = self._measurePeakMemory(settings, original_data)
+                self._statistics.log()
+            if profiler is not None:
+                profiler.dump_stats(settings["profile_file"])
+                Logger.log("i", "Wrote the profile of the pause at height script to %s", settings["profile_file"])
+
+    ##  Measures the peak memory of inserting the pauses into the data, for
+    #   the statistics.
+    #
+    #   Tracing the memory slows the code down a lot, so it is measured in a
+    #   separate run after the timed one. That run doesn't use or fill the
+    #   layer index cache, so that it allocates what the timed run did on a
+    #   miss, and it doesn't write, log or report anything.
+    #   \return The peak memory allocated by Python, in bytes.
+    def _measurePeakMemory(self, settings: Dict[str, Any], data: List[str]) -> int:
+        statistics, pauses, job = self._statistics, self._pauses, self._job
+        self._statistics = Statistics(False)
+        self._job = None
+        self._measuring_memory = True
+        tracemalloc.start()
+        try:
+            self._insertPauses(dict(settings, pause_report_file = "", layer_cache_directory = ""), data)
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            self._statistics, self._pauses, self._job = statistics, pauses, job
+            self._unlocated_pauses = []
+            self._measuring_memory = False
+
+    ##  Inserts the pause commands like execute(), but on a worker thread; see
+    #   ExecutionJob.
+    #   \param progress: Function to call with the number of layers read and
+    #   the total number of layers after every chunk of layers.
+    #   \param chunk_layers: Number of layers to read between checks for
+    #   cancellation.
+    #   \return The started job. Raises RuntimeError if a job of this script
+    #   is still running.
+    def executeInBackground(self, data: List[str], progress: Optional[Callable[[int, int], None]] = None, chunk_layers: int = _PROGRESS_CHUNK_LAYERS) -> ExecutionJob:
+        job = ExecutionJob(self, data, progress, chunk_layers)
+        job.start()
+        return job
+
+    ##  Gets the statistics of the last run of execute(): the seconds spent in
+    #   each phase, counters of what was read and done and the peak memory
+    #   use. The counter "lines" is the size of the G-code, "lines_parsed"
+    #   the lines whose numbers were read and "parse_calls" the calls to
+    #   parseGCodeLine, which does what Script.getValue does for every
+    #   letter of a line at once. Empty unless the log_statistics setting is
+    #   enabled.
+    def getStatistics(self) -> Dict[str, Any]:
+        return self._statistics.asDict()
 
+    def _insertPauses(self, settings: Dict[str, Any], data: List[str]) -> List[str]:
         # T = ExtruderManager.getInstance().getActiveExtruderStack().getProperty("material_print_temperature", "value")
 
-        # use offset to calculate the current height: <current_height> = <current_z> - <layer_0_z>
-        layer_0_z = 0
-        current_z = 0
-        current_height = 0
-        current_layer = 0
-        current_extrusion_f = 0
-        got_first_g_cmd_on_layer_0 = False
-        current_t = 0 #Tracks the current extruder for tracking the target temperature.
-        target_temperature = {} #Tracks the current target temperature for each extruder.
-
-        nbr_negative_layers = 0
-
-        for index, layer in enumerate(data):
-            lines = layer.split("\n")
-
-            # Scroll each line of instruction for each layer in the G-code
-            for line in lines:
-                if ";FLAVOR:Griffin" in line:
-                    is_griffin = True
-                # Fist positive layer reached
-                if ";LAYER:0" in line:
-                    layers_started = True
-                # Count nbr of negative layers (raft)
-                elif ";LAYER:-" in line:
-                    nbr_negative_layers += 1
-
-                #Track the latest printing temperature in order to resume at the correct temperature.
-                if line.startswith("T"):
-                    current_t = self.getValue(line, "T")
-
-                m = self.getValue(line, "M")
-                if m is not None and (m == 104 or m == 109) and self.getValue(line, "S") is not None:
-                    extruder = current_t
-                    if self.getValue(line, "T") is not None:
-                        extruder = self.getValue(line, "T")
-                    target_temperature[extruder] = self.getValue(line, "S")
-
-                if not layers_started:
-                    continue
+        if self._job is not None:
+            self._job.setPasses(3 if settings["verify_pauses"] else 2)
+        with self._statistics.measure("scan"):
+            digest, layer_index = self._getLayerIndex(settings, data)
+            lines_parsed, parse_calls = layer_index.lines_parsed, layer_index.parse_calls #A cached index counts the lines that earlier runs parsed too.
+            if settings["estimate_time"] or settings["pause_report_file"]:
+                layer_index.estimateTimes(settings["acceleration"])
+            if settings["park_position"] != "fixed":
+                layer_index.trackFootprints(settings["park_position"] == "convex_hull")
+            if settings["pause_at"] == "height":
+                pause_states = layer_index.statesAtHeights(settings["pause_heights"])
+            elif settings["pause_layers"]:
+                pause_states = layer_index.statesAtLayers(settings["pause_layers"])
+            else: #No layer given, so pause at the layers where the pause heights are reached.
+                pause_states = layer_index.layerStatesAtHeights(settings["pause_heights"])
+        if self._job is not None: #The layers after the last pause weren't read.
+            self._job.advanceTo(len(data))
 
-                # Look for the feed rate of an extrusion instruction
-                if self.getValue(line, "F") is not None and self.getValue(line, "E") is not None:
-                    current_extrusion_f = self.getValue(line, "F")
+        offset = 0 #Where data[counted] starts in the output, in bytes.
+        counted = 0
+        for position, pause_state in enumerate(pause_states):
+            if position > 0 and pause_states[position - 1].index == pause_state.index:
+                continue #Already inserted together with the previous pause.
+            if self._job is not None:
+                self._job.advanceTo(len(data) + pause_state.index)
+                self._job.checkCancelled()
+            segments = [data[pause_state.index]]
+            for same_layer_state in pause_states[position:]:
+                if same_layer_state.index != pause_state.index:
+                    break
+                segments = self._insertPause(settings, layer_index, same_layer_state, segments)
+            offset += sum(_byteLength(layer) for layer in data[counted:pause_state.index])
+            counted = pause_state.index
+            self._locatePauses(segments, offset)
+            # Override the data of this layer with the
+            # modified data
+            with self._statistics.measure("join"):
+                data[pause_state.index] = "".join(segments)
+        if self._job is not None:
+            self._job.advanceTo(2 * len(data))
+        self._keepLayerIndex(settings, digest, layer_index)
+        if self._statistics.enabled:
+            self._statistics.count("layers_read", len(layer_index.layers))
+            self._statistics.count("lines_read", sum(layer_index.data[index].count("\n") for index in range(len(layer_index.layers))))
+            self._statistics.count("lines_parsed", layer_index.lines_parsed - lines_parsed)
+            self._statistics.count("parse_calls", layer_index.parse_calls - parse_calls)
 
-                # If a Z instruction is in the line, read the current Z
-                if self.getValue(line, "Z") is not None:
-                    current_z = self.getValue(line, "Z")
+        if settings["verify_pauses"]:
+            with self._statistics.measure("verify"):
+                verifier = PauseVerifier()
+                for layer in data if self._job is None else self._job.counted(data):
+                    verifier.feed(layer)
+                self._logProblems(verifier.finish())
+            self._statistics.count("lines_parsed", verifier.lines_parsed)
+            self._statistics.count("parse_calls", verifier.lines_parsed)
+        self._writePauseReport(settings)
+        return data
 
-                if pause_at == "height":
-                    # Ignore if the line is not G1 or G0
-                    if self.getValue(line, "G") != 1 and self.getValue(line, "G") != 0:
-                        continue
+    ##  Gets the pauses that the last run inserted, in the order of the
+    #   G-code, as dicts with the keys:
+    #   - layer, z: The number of the layer and the Z where it pauses.
+    #   - height: The height where it pauses, or None when pausing at layers.
+    #   - resume_x, resume_y: Where the print continues after the pause.
+    #   - e: The E position that is restored after the pause.
+    #   - tool, temperatures: The tool and the temperature of every tool (by
+    #   tool number as a string) when it pauses.
+    #   - byte_offset: Where the pause code starts in the G-code, in bytes of
+    #   UTF-8. For binary G-code, in the G-code of its G-code blocks.
+    #   - estimated_seconds: Estimated time from the start of the print to
+    #   the pause, if the estimate_time or pause_report_file setting is set,
+    #   otherwise None.
+    def getPauses(self) -> List[Dict[str, Any]]:
+        return list(self._pauses)
 
-                    # This block is executed once, the first time there is a G
-                    # command, to get the z offset (z for first positive layer)
-                    if not got_first_g_cmd_on_layer_0:
-                        layer_0_z = current_z - initial_layer_height
-                        got_first_g_cmd_on_layer_0 = True
+    ##  Gets the problems that the verify_pauses setting found in the pauses
+    #   of the last run, as the messages that were logged. Empty if the pauses
+    #   weren't verified.
+    def getProblems(self) -> List[str]:
+        return list(self._problems)
 
-                    current_height = current_z - layer_0_z
-                    if current_height < pause_height:
-                        break  # Try the next layer.
+    ##  Finds the pauses inserted since the last call in the segments of a
+    #   layer, to know where their code starts in the output.
+    #   \param offset: Where the segments start in the output, in bytes.
+    #   \return Where the segments end in the output, in bytes.
+    def _locatePauses(self, segments: List[str], offset: int) -> int:
+        unlocated = self._unlocated_pauses
+        for segment in segments:
+            for pause_code, pause in unlocated:
+                if segment is pause_code and pause["byte_offset"] is None:
+                    pause["byte_offset"] = offset
+                    break
+            offset += _byteLength(segment)
+        if unlocated:
+            self._pauses.extend(sorted((pause for _, pause in unlocated), key = lambda pause: pause["byte_offset"]))
+            del unlocated[:]
+        return offset
 
-                # Pause at layer
-                else:
-                    if not line.startswith(";LAYER:"):
-                        continue
-                    current_layer = line[len(";LAYER:"):]
-                    try:
-                        current_layer = int(current_layer)
-
-                    # Couldn't cast to int. Something is wrong with this
-                    # g-code data
-                    except ValueError:
-                        continue
-                    if current_layer < pause_layer - nbr_negative_layers:
-                        continue
+    ##  Writes the pauses of the last run to the pause report file as JSON, if
+    #   there is one.
+    def _writePauseReport(self, settings: Dict[str, Any]) -> None:
+        if not settings["pause_report_file"]:
+            return
+        path = os.path.expanduser(settings["pause_report_file"])
+        try:
+            file_descriptor, temporary_path = tempfile.mkstemp(suffix = ".tmp", dir = os.path.dirname(os.path.abspath(path)))
+            try:
+                with os.fdopen(file_descriptor, "w", encoding = "utf-8") as report_file:
+                    json.dump({"pauses": self._pauses}, report_file, indent = 2)
+                os.replace(temporary_path, path)
+            except BaseException:
+                os.remove(temporary_path)
+                raise
+        except OSError as e:
+            Logger.log("w", "Could not write the pause report to %s: %s", path, str(e))
+            return
+        Logger.log("i", "Wrote the report of %d pauses to %s", len(self._pauses), path)
 
-                # Get X and Y from the next layer (better position for
-                # the nozzle)
-                next_layer = data[index + 1]
-                x, y = self.getNextXY(next_layer)
-
-                prev_layer = data[index - 1]
-                prev_lines = prev_layer.split("\n")
-                current_e = 0.
-
-                # Access last layer, browse it backwards to find
-                # last extruder absolute position
-                for prevLine in reversed(prev_lines):
-                    current_e = self.getValue(prevLine, "E", -1)
-                    if current_e >= 0:
-                        break
-
-                # include a number of previous layers
-                for i in range(1, redo_layers + 1):
-                    prev_layer = data[index - i]
-                    layer = prev_layer + layer
-
-                    # Get extruder's absolute position at the
-                    # beginning of the first layer redone
-                    # see https://github.com/nallath/PostProcessingPlugin/issues/55
-                    if i == redo_layers:
-                        # Get X and Y from the next layer (better position for
-                        # the nozzle)
-                        x, y = self.getNextXY(layer)
-                        prev_lines = prev_layer.split("\n")
-                        for lin in prev_lines:
-                            new_e = self.getValue(lin, "E", current_e)
-                            if new_e != current_e:
-                                current_e = new_e
-                                break
-
-                prepend_gcode = ";TYPE:CUSTOM\n"
-                prepend_gcode += ";added code by post processing\n"
-                prepend_gcode += ";script: PauseAtHeightOptions.py\n"
-                if pause_at == "height":
-                    prepend_gcode += ";current z: {z}\n".format(z = current_z)
-                    prepend_gcode += ";current height: {height}\n".format(height = current_height)
-                else:
-                    prepend_gcode += ";current layer: {layer}\n".format(layer = current_layer)
+    ##  Logs the problems that the verifier found in the pauses.
+    def _logProblems(self, problems: List[str]) -> None:
+        if self._measuring_memory:
+            return
+        for problem in problems:
+            Logger.log("w", "%s", problem)
+        self._problems.extend(problems)
+        self._statistics.count("pause_problems", len(problems))
+
+    ##  Inserts the pause commands while reading the layers one at a time.
+    #
+    #   Gives the same result as execute(), but only keeps a few layers in
+    #   memory: enough to redo layers and to look at the layer after a pause.
+    #   \param layers: The layers, e.g. from readLayers().
+    #   \return Generator of segments of G-code that together make up the
+    #   layers with the pauses inserted, to be written out one after another.
+    def executeStream(self, layers: Iterable[str]) -> Iterator[str]:
+        for segments in self._streamLayerSegments(layers):
+            yield from segments
+
+    ##  Inserts the pause commands while reading the layers one at a time,
+    #   like executeStream().
+    #
+    #   Once every pause is inserted, the rest of the layers are passed on
+    #   without reading them, unless the pauses are verified.
+    #   \param stop_when_done: Return instead of passing on the rest of the
+    #   layers, for callers that copy the rest on their own. The rest starts
+    #   after the last layer that was returned.
+    #   \return Generator of the segments of every layer in turn. The last
+    #   segment of a layer is the layer itself; any segments before it are
+    #   inserted in front of it.
+    def _streamLayerSegments(self, layers: Iterable[str], stop_when_done: bool = False) -> Iterator[List[str]]:
+        settings = self._getPauseSettings()
+        self._statistics = Statistics(False)
+        self._pauses = []
+        self._unlocated_pauses = []
+        self._problems = []
+        if not self._hasPausePoints(settings):
+            for layer in layers:
+                yield [layer]
+            self._writePauseReport(settings)
+            return
+
+        window = max(settings["redo_layers"], 1) + 2 #The redone layers, the layer before the pause, the layer itself and the next one.
+        layer_index = LayerIndex((), settings["initial_layer_height"], window = window, track_layers = settings["pause_at"] != "height")
+        if settings["estimate_time"] or settings["pause_report_file"]:
+            layer_index.estimateTimes(settings["acceleration"])
+        if settings["park_position"] != "fixed":
+            layer_index.trackFootprints(settings["park_position"] == "convex_hull")
+        planner = _PausePlanner(settings["pause_at"], settings["pause_heights"], settings["pause_layers"])
+
+        pending_layer = None # type: Optional[str] #The previous layer, waiting for the next one to be read.
+        pending_pauses = [] # type: List[PauseState]
+        verifier = PauseVerifier() if settings["verify_pauses"] else None
+        if settings["scan_processes"] > 1:
+            summarized = _summarizeInParallel(layers, layer_index.track_layers, settings["scan_processes"]) # type: Iterable[Tuple[str, Optional[_LayerSummary]]]
+        else:
+            summarized = ((layer, None) for layer in layers)
+        done = False #Whether every pause is inserted.
+        offset = 0 #Bytes of G-code returned so far, until every pause is inserted.
+        for layer, summary in summarized:
+            if done:
+                yield [layer]
+                continue
+            _, move_state, layer_states = layer_index.addLayer(layer, summary)
+            if pending_layer is not None:
+                segments = self._pauseLayerSegments(settings, layer_index, pending_pauses, pending_layer, verifier)
+                offset = self._locatePauses(segments, offset)
+                yield segments
+            pending_layer = layer
+            pending_pauses = planner.pausesIn(move_state, layer_states)
+            if not pending_pauses and planner.isFinished() and verifier is None:
+                yield [layer]
+                pending_layer = None
+                done = True
+                if stop_when_done:
+                    break
+
+        if pending_layer is not None:
+            segments = self._pauseLayerSegments(settings, layer_index, pending_pauses, pending_layer, verifier)
+            self._locatePauses(segments, offset)
+            yield segments
+        if verifier is not None:
+            self._logProblems(verifier.finish())
+        self._writePauseReport(settings)
 
-                if not is_griffin:
-                    # Retraction
-                    prepend_gcode += self.putValue(M = 83) + " ; switch to relative E values for any needed retraction\n"
-                    if retraction_amount != 0:
-                        if firmware_retract: #Can't set the distance directly to what the user wants. We have to choose ourselves.
-                            retraction_count = 1 if control_temperatures else 3 #Retract more if we don't control the temperature.
-                            for i in range(retraction_count):
-                                prepend_gcode += self.putValue(G = 10) + "\n"
-                        else:
-                            prepend_gcode += self.putValue(G = 1, E = -retraction_amount, F = retraction_speed * 60) + "\n"
+    ##  Gets the segments of one layer with its pauses inserted, for
+    #   executeStream.
+    #   \param verifier: Verifier to feed the segments to, if any.
+    def _pauseLayerSegments(self, settings: Dict[str, Any], layer_index: LayerIndex, pause_states: List[PauseState], layer: str, verifier: Optional[PauseVerifier] = None) -> List[str]:
+        segments = [layer]
+        for pause_state in pause_states:
+            segments = self._insertPause(settings, layer_index, pause_state, segments)
+        if verifier is not None:
+            for segment in segments:
+                verifier.feed(segment)
+        return segments
 
-                    # Move the head up
-                    prepend_gcode += self.putValue(G = 0, Z = current_z + 1, F = 300) + " ; move up a millimeter above current z (" + str(current_z) + ") to get the nozzle off of the print\n"
+_GZIP_MAGIC = b"\x1f\x8b"
 
-                    prepend_gcode += self.putValue(G = 0, X = park_x, Y = park_y, F = 9000) + " ; park nozzle at a safe place so we can purge new filament\n"
+##  Opens a G-code file, or stdin/stdout for "-", keeping line endings and any
+#   bytes that are not valid UTF-8 as they are.
+#
+#   Gzip compressed G-code is decompressed while it is read, and compressed
+#   while it is written if compressed is True (by default if the file name
+#   ends with .gz).
+@contextlib.contextmanager
+def _openGCode(path: str, mode: str, compressed: Optional[bool] = None) -> Iterator[IO[str]]:
+    if path != "-":
+        file_stream = open(path, mode + "b") # type: IO[bytes]
+    else:
+        file_stream = sys.stdin.buffer if mode == "r" else sys.stdout.buffer
+    binary_stream = file_stream
+    try:
+        if mode == "r":
+            compressed = _peek(file_stream, len(_GZIP_MAGIC)) == _GZIP_MAGIC
+        elif compressed is None:
+            compressed = path.endswith(".gz")
+        if compressed:
+            binary_stream = gzip.GzipFile(fileobj = file_stream, mode = mode + "b", compresslevel = 6)
+        stream = io.TextIOWrapper(binary_stream, encoding = "utf-8", errors = "surrogateescape", newline = "")
+        try:
+            yield stream
+        finally:
+            stream.flush()
+            stream.detach()
+            if compressed:
+                binary_stream.close() #Writes the end of the gzip stream. Doesn't close the file or stdin/stdout.
+    finally:
+        if path != "-":
+            file_stream.close()
 
-                    if current_z < 15:
-                        prepend_gcode += self.putValue(G = 0, Z = 15, F = 300) + " ; too close to bed--move to at least 15mm\n"
+##  Gets the first bytes of a stream without consuming them.
+def _peek(stream: IO[bytes], size: int) -> bytes:
+    if hasattr(stream, "peek"):
+        return stream.peek(size)[:size]
+    position = stream.tell()
+    start = stream.read(size)
+    stream.seek(position)
+    return start
 
-                    if control_temperatures:
-                        # Set extruder standby temperature
-                        prepend_gcode += self.putValue(M = 104, S = standby_temperature) + " ; standby temperature\n"
+##  Prusa's binary G-code (.bgcode) starts with this. It is a sequence of
+#   blocks of metadata, thumbnails and G-code, each compressed on its own.
+_BINARY_GCODE_MAGIC = b"GCDE"
+_BINARY_GCODE_VERSION = 1
+_BINARY_GCODE_CRC32 = 1 #Checksum type for a CRC32 after every block.
+_BLOCK_GCODE = 1
+_BLOCK_THUMBNAIL = 5
+_COMPRESSION_NONE = 0
+_COMPRESSION_DEFLATE = 1
+_COMPRESSION_HEATSHRINK_11_4 = 2
+_COMPRESSION_HEATSHRINK_12_4 = 3
+_ENCODING_NONE = 0
+_ENCODING_MEATPACK = 1
+_ENCODING_MEATPACK_COMMENTS = 2
+_MAX_GCODE_BLOCK_SIZE = 65535 #Largest G-code block that PrusaSlicer writes; new blocks are kept below it for the printers.
 
-                if display_text:
-                    prepend_gcode += "M117 " + display_text + "\n"
+##  One block of a binary G-code file, as it was read.
+class _BinaryBlock:
+    __slots__ = ("type", "compression", "uncompressed_size", "parameters", "data", "raw")
 
-                # Set relative position ON
-                prepend_gcode += self.putValue(G = 91) + " ; switch to relative movement \n"
+    def __init__(self, block_type: int, compression: int, uncompressed_size: int, parameters: bytes, data: bytes, raw: bytes) -> None:
+        self.type = block_type
+        self.compression = compression
+        self.uncompressed_size = uncompressed_size
+        self.parameters = parameters #The encoding of G-code and metadata blocks, the format and size of thumbnails.
+        self.data = data #Compressed data.
+        self.raw = raw #The whole block with its header and checksum, to write it out unchanged.
 
-                # Z axis 15mm up
-                prepend_gcode += self.putValue(G = 0, Z = 15.0) + " ; lift the head 15mm above whereever it was to make it easier to clean up extruded filament.\n"
+##  Reads the blocks of a binary G-code file, after its file header.
+#   \param checksum_type: Checksum type from the file header.
+def _readBinaryBlocks(stream: IO[bytes], checksum_type: int) -> Iterator[_BinaryBlock]:
+    checksum_size = 4 if checksum_type == _BINARY_GCODE_CRC32 else 0
+    while True:
+        header = stream.read(8)
+        if not header:
+            return
+        if len(header) < 8:
+            raise ValueError("The binary G-code ends in the middle of a block header.")
+        block_type, compression, uncompressed_size = struct.unpack("<HHI", header)
+        compressed_size = uncompressed_size
+        if compression != _COMPRESSION_NONE:
+            size_bytes = stream.read(4)
+            if len(size_bytes) < 4:
+                raise ValueError("The binary G-code ends in the middle of a block header.")
+            header += size_bytes
+            compressed_size = struct.unpack("<I", size_bytes)[0]
+        parameters_size = 6 if block_type == _BLOCK_THUMBNAIL else 2
+        rest = stream.read(parameters_size + compressed_size + checksum_size)
+        if len(rest) < parameters_size + compressed_size + checksum_size:
+            raise ValueError("The binary G-code ends in the middle of a block.")
+        if checksum_size and zlib.crc32(header + rest[:-checksum_size]) != struct.unpack("<I", rest[-checksum_size:])[0]:
+            raise ValueError("A block of the binary G-code has the wrong checksum.")
+        yield _BinaryBlock(block_type, compression, uncompressed_size, rest[:parameters_size], rest[parameters_size:parameters_size + compressed_size], header + rest)
 
-                # Set relative position OFF
-                prepend_gcode += self.putValue(G = 90) + " ; switch back to absolute movement \n"
+##  Decompresses heatshrink (LZSS) data: a bit stream of literal bytes
+#   (flag 1, 8 bits) and references back into the output (flag 0, the
+#   distance minus one in window_bits bits, the length minus one in
+#   lookahead_bits bits). Uses the heatshrink2 package if it is installed.
+#   \param size: Size of the decompressed data.
+def _heatshrinkDecompress(data: bytes, window_bits: int, lookahead_bits: int, size: int) -> bytes:
+    if heatshrink2 is not None:
+        return heatshrink2.decompress(data, window_sz2 = window_bits, lookahead_sz2 = lookahead_bits)
+    window = 1 << window_bits
+    output = bytearray(window) #Heatshrink starts with a window of zeros.
+    end = window + size
+    padded = data + b"\0\0\0\0"
+    bit_count = len(data) * 8
+    reference_bits = 1 + window_bits + lookahead_bits
+    position = 0
+    while len(output) < end:
+        byte_index = position >> 3
+        bits = int.from_bytes(padded[byte_index:byte_index + 4], "big") << (position & 7) #At least 25 bits after the position.
+        if bits & 0x80000000:
+            if position + 9 > bit_count:
+                break
+            output.append((bits >> 23) & 0xFF)
+            position += 9
+        else:
+            if position + reference_bits > bit_count:
+                break
+            bits >>= 31 - window_bits - lookahead_bits
+            distance = ((bits >> lookahead_bits) & (window - 1)) + 1
+            length = (bits & ((1 << lookahead_bits) - 1)) + 1
+            start = len(output) - distance
+            if distance >= length:
+                output += output[start:start + length]
+            else: #Repeats the bytes it copies.
+                output += (output[start:] * (length // distance + 1))[:length]
+            position += reference_bits
+    return bytes(output[window:end])
 
-                # Melody
-                if play_extended_melody:
-                    prepend_gcode += self.playExtendedMelody()
+##  MeatPack packs two characters in a byte, four bits each, lowest bits
+#   first. 15 means that the character follows as a whole byte instead. Two
+#   signal bytes followed by a command byte switch packing on and off.
+_MEATPACK_CHARACTERS = b"0123456789. \nGX"
+_MEATPACK_SIGNAL = 0xFF
+_MEATPACK_ENABLE_PACKING = 251
+_MEATPACK_DISABLE_PACKING = 250
+_MEATPACK_RESET_ALL = 249
+_MEATPACK_ENABLE_NO_SPACES = 247
+_MEATPACK_DISABLE_NO_SPACES = 246
+_MEATPACK_SPECIAL_REGEX = re.compile(b"[" + b"".join(re.escape(bytes([byte])) for byte in range(256) if byte & 0x0F == 0x0F or byte & 0xF0 == 0xF0) + b"]")
+_MEATPACK_SIGNAL_REGEX = re.compile(re.escape(bytes([_MEATPACK_SIGNAL])))
+
+##  Gets the decoded bytes of every byte of packed MeatPack data that holds
+#   two packed characters. In "no spaces" mode, the code of the space is an E.
+def _meatpackTable(no_spaces: bool) -> List[bytes]:
+    characters = _MEATPACK_CHARACTERS.replace(b" ", b"E") if no_spaces else _MEATPACK_CHARACTERS
+    table = []
+    for byte in range(256):
+        first = characters[byte & 0x0F:(byte & 0x0F) + 1]
+        second = characters[byte >> 4:(byte >> 4) + 1]
+        table.append(first if first == b"\n" else first + second) #After a new line, the other half is padding.
+    return table
+
+_MEATPACK_TABLES = (_meatpackTable(False), _meatpackTable(True))
+
+##  Decodes MeatPack data, the way Prusa's libbgcode does.
+def _meatpackDecode(data: bytes) -> bytes:
+    output = bytearray()
+    packing = False
+    no_spaces = False
+    signals = 0 #Signal bytes in a row, up to the second.
+    command = False #Whether a command byte is expected next.
+    full_characters = 0 #Characters to come as whole bytes.
+    buffered = b"" #Packed character that comes after a whole one.
+
+    def unpack(byte: int) -> None:
+        nonlocal full_characters, buffered
+        if not packing:
+            output.append(byte)
+        elif full_characters > 0:
+            output.append(byte)
+            output.extend(buffered)
+            buffered = b""
+            full_characters -= 1
+        else:
+            characters = _MEATPACK_CHARACTERS.replace(b" ", b"E") if no_spaces else _MEATPACK_CHARACTERS
+            if byte & 0x0F == 0x0F:
+                full_characters += 1
+                if byte & 0xF0 == 0xF0:
+                    full_characters += 1
                 else:
-                    prepend_gcode += self.playShortMelody()
-
-                # Wating for specified seconds, during this time you must click Pause on-screen,
-                # otherwise the program will automatically resume printing.
-                prepend_gcode += self.putValue(G = 4, S = wait_on_pause_click) + "\n"
-
-                # Now you can change the filament or what-have-you.
-                # To continue printing, click your Continue/resume button on-screen.
-                prepend_gcode += self.playShortMelody()
-
-                if not is_griffin:
-                    if control_temperatures:
-                        # Set extruder resume temperature
-                        prepend_gcode += self.putValue(M = 109, S = int(target_temperature.get(current_t, 0))) + " ; resume temperature\n"
-
-                    # Push the filament back
-                    if retraction_amount != 0:
-                        prepend_gcode += self.putValue(G = 1, E = retraction_amount, F = retraction_speed * 60) + " ; I think this is a bug? It pushes out filament, not retracts. Seems like we could use the retraction BEFORE the pause though, right?\n"
-
-                    # Optionally extrude material
-                    if extrude_amount != 0:
-                        prepend_gcode += self.putValue(G = 1, E = extrude_amount, F = extrude_speed * 60) + " ; extrude the new filament \n"
-
-                    # and retract again, the properly primes the nozzle
-                    # when changing filament.
-                    if retraction_amount != 0:
-                        prepend_gcode += self.putValue(G = 1, E = -retraction_amount, F = retraction_speed * 60) + " ; retract again, this helps prevent spooging while in transit back to the print\n"
-
-                    # Move the head back
-                    if current_z < 15:
-                        prepend_gcode += self.putValue(G = 0, Z = current_z + 1, F = 300) + " ; Move Z near print before moving X,Y\n"
-
-                    prepend_gcode += self.putValue(G = 0, X = x, Y = y, F = 9000) + " ; return to the original X,Y\n"
-                    prepend_gcode += self.putValue(G = 0, Z = current_z, F = 300) + " ; vertical move back down to original position\n"
-
-                    if retraction_amount != 0:
-                        if firmware_retract: #Can't set the distance directly to what the user wants. We have to choose ourselves.
-                            retraction_count = 1 if control_temperatures else 3 #Retract more if we don't control the temperature.
-                            for i in range(retraction_count):
-                                prepend_gcode += self.putValue(G = 11) + "\n"
-                        else:
-                            prepend_gcode += self.putValue(G = 1, E = retraction_amount, F = retraction_speed * 60) + "\n"
-
-                    if current_extrusion_f != 0:
-                        prepend_gcode += self.putValue(G = 1, F = current_extrusion_f) + " ; restore extrusion feedrate\n"
+                    buffered = characters[byte >> 4:(byte >> 4) + 1]
+            else:
+                output.extend(characters[byte & 0x0F:(byte & 0x0F) + 1])
+                if byte & 0x0F != 0x0C: #After a new line, the other half is padding.
+                    if byte & 0xF0 == 0xF0:
+                        full_characters += 1
                     else:
-                        Logger.log("w", "No previous feedrate found in gcode, feedrate for next layer(s) might be incorrect")
+                        output.extend(characters[byte >> 4:(byte >> 4) + 1])
 
-                    prepend_gcode += self.putValue(M = 82) + " ; switch back to absolute E values\n"
-                    prepend_gcode += self.putValue(G = 92, E = current_e) + " ; reset extrusion value to pre-pause value\n"
+    position = 0
+    while position < len(data):
+        if packing and full_characters == 0 and signals == 0 and not command:
+            match = _MEATPACK_SPECIAL_REGEX.search(data, position)
+            end = match.start() if match is not None else len(data)
+            output.extend(b"".join(map(_MEATPACK_TABLES[no_spaces].__getitem__, data[position:end])))
+            position = end
+        elif not packing and full_characters == 0 and signals == 0 and not command:
+            match = _MEATPACK_SIGNAL_REGEX.search(data, position)
+            end = match.start() if match is not None else len(data)
+            output.extend(data[position:end])
+            position = end
+        if position >= len(data):
+            break
+        byte = data[position]
+        position += 1
+        if byte == _MEATPACK_SIGNAL:
+            if signals > 0:
+                command = True
+                signals = 0
+            else:
+                signals += 1
+        elif command:
+            command = False
+            if byte == _MEATPACK_ENABLE_PACKING:
+                packing = True
+            elif byte == _MEATPACK_DISABLE_PACKING or byte == _MEATPACK_RESET_ALL:
+                packing = False
+            elif byte == _MEATPACK_ENABLE_NO_SPACES:
+                no_spaces = True
+            elif byte == _MEATPACK_DISABLE_NO_SPACES:
+                no_spaces = False
+        else:
+            if signals > 0: #A single signal byte is a data byte.
+                unpack(_MEATPACK_SIGNAL)
+                signals = 0
+            unpack(byte)
+    return bytes(output)
 
-                layer = prepend_gcode + layer
+##  Gets the G-code text of a G-code block.
+def _decodeGCodeBlock(block: _BinaryBlock) -> str:
+    data = block.data
+    if block.compression == _COMPRESSION_DEFLATE:
+        data = zlib.decompress(data)
+    elif block.compression == _COMPRESSION_HEATSHRINK_11_4:
+        data = _heatshrinkDecompress(data, 11, 4, block.uncompressed_size)
+    elif block.compression == _COMPRESSION_HEATSHRINK_12_4:
+        data = _heatshrinkDecompress(data, 12, 4, block.uncompressed_size)
+    elif block.compression != _COMPRESSION_NONE:
+        raise ValueError("Unknown compression {compression} in the binary G-code.".format(compression = block.compression))
+    encoding = struct.unpack("<H", block.parameters)[0]
+    if encoding == _ENCODING_MEATPACK or encoding == _ENCODING_MEATPACK_COMMENTS:
+        data = _meatpackDecode(data)
+    elif encoding != _ENCODING_NONE:
+        raise ValueError("Unknown G-code encoding {encoding} in the binary G-code.".format(encoding = encoding))
+    return data.decode("utf-8", "surrogateescape")
 
-                # Override the data of this layer with the
-                # modified data
-                data[index] = layer
-                return data
-        return data
+##  Creates G-code blocks for G-code text, split at new lines into blocks of
+#   at most _MAX_GCODE_BLOCK_SIZE bytes.
+#
+#   The G-code is not encoded and only compressed with deflate if asked, since
+#   there is no encoder for heatshrink and MeatPack here. Every block can have
+#   its own compression and encoding, so that is still a valid file.
+def _encodeGCodeBlocks(text: str, compression: int, checksum_type: int) -> bytes:
+    data = text.encode("utf-8", "surrogateescape")
+    blocks = []
+    start = 0
+    while start < len(data):
+        end = len(data)
+        if end - start > _MAX_GCODE_BLOCK_SIZE:
+            end = data.rfind(b"\n", start, start + _MAX_GCODE_BLOCK_SIZE) + 1 or start + _MAX_GCODE_BLOCK_SIZE
+        piece = data[start:end]
+        parameters = struct.pack("<H", _ENCODING_NONE)
+        if compression == _COMPRESSION_DEFLATE:
+            compressed = zlib.compress(piece)
+            block = struct.pack("<HHII", _BLOCK_GCODE, compression, len(piece), len(compressed)) + parameters + compressed
+        else:
+            block = struct.pack("<HHI", _BLOCK_GCODE, _COMPRESSION_NONE, len(piece)) + parameters + piece
+        if checksum_type == _BINARY_GCODE_CRC32:
+            block += struct.pack("<I", zlib.crc32(block))
+        blocks.append(block)
+        start = end
+    return b"".join(blocks)
+
+##  Whether a file (or "-" for stdin) holds binary G-code.
+def _isBinaryGCode(path: str) -> bool:
+    if path == "-":
+        return _peek(sys.stdin.buffer, len(_BINARY_GCODE_MAGIC)) == _BINARY_GCODE_MAGIC
+    with open(path, "rb") as stream:
+        return stream.read(len(_BINARY_GCODE_MAGIC)) == _BINARY_GCODE_MAGIC
+
+##  A G-code block waiting to be written until it is known whether pauses go
+#   in it.
+class _PendingBlock:
+    __slots__ = ("block", "start", "end", "text", "insertions")
+
+    def __init__(self, block: _BinaryBlock, start: int, text: Optional[str]) -> None:
+        self.block = block
+        self.start = start #Position of the text of the block in the G-code text of the whole file.
+        self.end = start + len(text) if text is not None else start
+        self.text = text #None for blocks other than G-code.
+        self.insertions = [] # type: List[Tuple[int, str]] #Position in the text of the block and G-code to insert there.
+
+##  Inserts the pauses into binary G-code while reading it.
+#
+#   The G-code blocks are decoded one at a time and their text is read as
+#   layers by executeStream(). Only the blocks that pauses go in are written
+#   anew, holding the pause code; all other blocks, including the metadata and
+#   thumbnails, are copied byte for byte. Once every pause is inserted, the
+#   rest of the blocks are copied without decoding them, unless the pauses are
+#   verified.
+#   \return The number of layers read, which leaves out the layers in the
+#   blocks that were copied without decoding them.
+def _rewriteBinaryGCode(script: "PauseAtHeightOptions", input_stream: IO[bytes], output_stream: IO[bytes]) -> int:
+    file_header = input_stream.read(10)
+    if len(file_header) < 10 or file_header[:4] != _BINARY_GCODE_MAGIC:
+        raise ValueError("Not binary G-code.")
+    version, checksum_type = struct.unpack("<IH", file_header[4:])
+    if version != _BINARY_GCODE_VERSION:
+        raise ValueError("Unsupported binary G-code version {version}.".format(version = version))
+    output_stream.write(file_header)
+
+    pending = collections.deque() # type: Deque[_PendingBlock]
+
+    def readText() -> Iterator[str]:
+        position = 0
+        for block in _readBinaryBlocks(input_stream, checksum_type):
+            if block.type != _BLOCK_GCODE:
+                pending.append(_PendingBlock(block, position, None))
+                continue
+            text = _decodeGCodeBlock(block)
+            pending.append(_PendingBlock(block, position, text))
+            position += len(text)
+            yield text
+
+    def writeBlocks(position: Optional[int]) -> None: #Writes the blocks that end before the position, or all.
+        while pending and (position is None or pending[0].text is None or pending[0].end <= position):
+            pending_block = pending.popleft()
+            if not pending_block.insertions:
+                output_stream.write(pending_block.block.raw)
+                continue
+            text = pending_block.text
+            parts = []
+            start = 0
+            for insert_at, inserted in pending_block.insertions:
+                parts += [text[start:insert_at], inserted]
+                start = insert_at
+            parts.append(text[start:])
+            compression = _COMPRESSION_DEFLATE if pending_block.block.compression == _COMPRESSION_DEFLATE else _COMPRESSION_NONE
+            output_stream.write(_encodeGCodeBlocks("".join(parts), compression, checksum_type))
+
+    position = 0
+    layer_count = 0
+    for segments in script._streamLayerSegments(readLayers(_linesOf(readText())), stop_when_done = True):
+        if len(segments) > 1:
+            for pending_block in pending:
+                if pending_block.text is not None and pending_block.start <= position < pending_block.end:
+                    pending_block.insertions.append((position - pending_block.start, "".join(segments[:-1])))
+                    break
+        position += len(segments[-1])
+        layer_count += 1
+        writeBlocks(position)
+    writeBlocks(None)
+    for block in _readBinaryBlocks(input_stream, checksum_type): #The blocks after the last pause.
+        output_stream.write(block.raw)
+    return layer_count
+
+_MAPPED_RELEASE_SIZE = 16 * 1024 * 1024 #Bytes of a mapped file that are read before they are released from memory.
+
+##  A layer of a memory-mapped G-code file, with where it is in the file, so
+#   that it can be copied from the file instead of written out again.
+class _MappedLayer(str):
+    start = 0
+    end = 0
+
+##  Finds where the layers of a memory-mapped G-code file end: before every
+#   ;LAYER: comment at the start of a line, except at the start of a layer,
+#   the same as readLayers() does for a file opened as text.
+#
+#   The pages of the file before the previous layer are released every so
+#   often, so that the pages that were read don't stay in the memory of the
+#   process.
+#   \param start: Where the first layer starts.
+def _mappedLayerEnds(mapped: mmap.mmap, start: int) -> Iterator[int]:
+    size = len(mapped)
+    released = start - start % mmap.PAGESIZE
+    previous = start
+    boundary = mapped.find(b";LAYER:", start + 1)
+    while boundary != -1:
+        if mapped[boundary - 1] in b"\r\n":
+            yield boundary
+            if hasattr(mapped, "madvise") and previous - released >= _MAPPED_RELEASE_SIZE:
+                page_start = previous - previous % mmap.PAGESIZE
+                mapped.madvise(mmap.MADV_DONTNEED, released, page_start - released)
+                released = page_start
+            previous = boundary
+        boundary = mapped.find(b";LAYER:", boundary + 1)
+    if start < size:
+        yield size
+
+##  Reads the layers of a memory-mapped G-code file as _MappedLayers.
+def _readMappedLayers(mapped: mmap.mmap) -> Iterator[_MappedLayer]:
+    start = 0
+    for end in _mappedLayerEnds(mapped, 0):
+        layer = _MappedLayer(mapped[start:end].decode("utf-8", "surrogateescape"))
+        layer.start = start
+        layer.end = end
+        yield layer
+        start = end
+
+##  Writes G-code made of ranges of the input file and new text, copying the
+#   ranges from file to file in the kernel where the system can: with
+#   os.copy_file_range(), or else os.sendfile(), or else from the memory
+#   map. Adjacent ranges are copied at once.
+class _CopyThroughWriter:
+    def __init__(self, mapped: mmap.mmap, input_file: IO[bytes], output_stream: IO[bytes]) -> None:
+        self._mapped = mapped
+        self._input_descriptor = input_file.fileno()
+        self._output_stream = output_stream
+        self._methods = [method for method in ("copy_file_range", "sendfile") if hasattr(os, method)] + ["write"] #Ways to copy to try, in order.
+        self._start = 0 #The range waiting to be copied.
+        self._end = 0
+
+    def copy(self, start: int, end: int) -> None:
+        if start != self._end:
+            self.flush()
+            self._start = start
+        self._end = end
+
+    def write(self, text: str) -> None:
+        self.flush()
+        self._output_stream.write(text.encode("utf-8", "surrogateescape"))
+
+    ##  Copies the range that is waiting.
+    def flush(self) -> None:
+        if self._start == self._end:
+            return
+        self._output_stream.flush()
+        output_descriptor = self._output_stream.fileno()
+        position = self._start
+        while position < self._end:
+            method = self._methods[0]
+            try:
+                if method == "copy_file_range":
+                    copied = os.copy_file_range(self._input_descriptor, output_descriptor, self._end - position, position)
+                elif method == "sendfile":
+                    copied = os.sendfile(output_descriptor, self._input_descriptor, position, self._end - position)
+                else:
+                    copied = os.write(output_descriptor, memoryview(self._mapped)[position:self._end])
+            except OSError: #E.g. not supported between these files. Try the next way.
+                if method == "write":
+                    raise
+                copied = 0
+            if copied == 0:
+                self._methods.pop(0)
+            position += copied
+        self._start = self._end
+
+##  Whether a G-code file can be rewritten with _rewriteMappedGCode(): a
+#   plain text file, not empty.
+def _isMappable(path: str) -> bool:
+    if path == "-" or not os.path.isfile(path) or os.path.getsize(path) == 0:
+        return False
+    with open(path, "rb") as input_file:
+        start = input_file.read(len(_BINARY_GCODE_MAGIC))
+    return not start.startswith(_GZIP_MAGIC) and start != _BINARY_GCODE_MAGIC
+
+##  Inserts the pauses into a G-code file by copying it through.
+#
+#   The file is memory-mapped and split into layers at the ;LAYER: comments
+#   in the bytes. Only the layers are decoded that are read for the pauses,
+#   which stops after the layer after the last pause unless the pauses are
+#   verified. The output is the same as that of executeStream(), but every
+#   layer, including redone layers, is copied from the file, and only the
+#   pause code is written anew.
+#   \param output_stream: The binary stream to write to.
+#   \return The number of layers read, which leaves out the layers that
+#   were copied without reading them.
+def _rewriteMappedGCode(script: "PauseAtHeightOptions", input_path: str, output_stream: IO[bytes]) -> int:
+    with open(input_path, "rb") as input_file, mmap.mmap(input_file.fileno(), 0, access = mmap.ACCESS_READ) as mapped:
+        if hasattr(mapped, "madvise"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        writer = _CopyThroughWriter(mapped, input_file, output_stream)
+        layer_count = 0
+        rest = 0 #Where the layers start that weren't read.
+        for segments in script._streamLayerSegments(_readMappedLayers(mapped), stop_when_done = True):
+            for segment in segments:
+                if isinstance(segment, _MappedLayer):
+                    writer.copy(segment.start, segment.end)
+                else:
+                    writer.write(segment)
+            layer_count += 1
+            rest = segments[-1].end
+        if rest < len(mapped):
+            writer.copy(rest, len(mapped))
+        writer.flush()
+    return layer_count
+
+##  Changes the settings of the script and of the printer it runs for.
+#
+#   Only works outside of Cura, where the stand-ins are used.
+#   \param values: Setting values by setting key, e.g. from a settings file.
+#   Printer settings such as layer_height_0 are accepted too.
+def applySettings(script: "PauseAtHeightOptions", values: Dict[str, Any]) -> None:
+    global_values = Application.getInstance().getGlobalContainerStack().values
+    script_values = {}
+    for key, value in values.items():
+        if key not in global_values:
+            script_values[key] = value
+        elif isinstance(value, str) and isinstance(global_values[key], bool):
+            global_values[key] = value.lower() in ("1", "true", "yes", "y")
+        elif isinstance(value, str):
+            global_values[key] = float(value)
+        else:
+            global_values[key] = value
+    script.setSettingValues(script_values)
+
+##  Reads the setting values given on the command line.
+def _readSettingValues(parser: argparse.ArgumentParser, args: argparse.Namespace) -> Dict[str, Any]:
+    values = {} # type: Dict[str, Any]
+    if args.settings:
+        with open(args.settings, encoding = "utf-8") as settings_file:
+            values.update(json.load(settings_file))
+    for item in args.values:
+        key, separator, value = item.partition("=")
+        if not separator:
+            parser.error("Expected KEY=VALUE, got: {item}".format(item = item))
+        values[key.strip()] = value
+    return values
+
+##  Inserts the pauses into one G-code file.
+#
+#   The output is written to a temporary file next to it and then moved in
+#   place, so that it never holds half a job. Runs in the worker processes of
+#   processBatch(), so it sets up its own script.
+#   \param input_path: G-code file to read.
+#   \param output_path: File to write the G-code to.
+#   \param values: Setting values by setting key, as for applySettings().
+#   \param report: Whether to write the report of the pauses next to the
+#   output, as <output>.pauses.json.
+#   \return Size of the input in bytes, number of layers read, time taken and
+#   the number of problems that verifying the pauses found. Layers after the
+#   last pause that were copied without reading them are not counted.
+def processFile(input_path: str, output_path: str, values: Dict[str, Any], report: bool = False) -> Dict[str, float]:
+    start_time = time.perf_counter()
+    if report:
+        values = dict(values, pause_report_file = output_path + ".pauses.json")
+    script = PauseAtHeightOptions()
+    applySettings(script, values)
+    output_directory = os.path.dirname(os.path.abspath(output_path))
+    handle, temporary_path = tempfile.mkstemp(dir = output_directory, prefix = ".", suffix = ".tmp")
+    os.close(handle)
+    layer_count = 0
+
+    def countLayers(layers: Iterator[str]) -> Iterator[str]:
+        nonlocal layer_count
+        for layer in layers:
+            layer_count += 1
+            yield layer
+
+    try:
+        shutil.copymode(input_path, temporary_path)
+        if _isBinaryGCode(input_path):
+            with open(input_path, "rb") as binary_input, open(temporary_path, "wb") as binary_output:
+                layer_count = _rewriteBinaryGCode(script, binary_input, binary_output)
+        elif not output_path.endswith(".gz") and _isMappable(input_path):
+            with open(temporary_path, "wb") as binary_output:
+                layer_count = _rewriteMappedGCode(script, input_path, binary_output)
+        else:
+            with _openGCode(input_path, "r") as input_stream, _openGCode(temporary_path, "w", compressed = output_path.endswith(".gz")) as output_stream:
+                for segment in script.executeStream(countLayers(readLayers(input_stream))):
+                    output_stream.write(segment)
+        os.replace(temporary_path, output_path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+    return {
+        "bytes": os.path.getsize(input_path),
+        "layers": layer_count,
+        "seconds": time.perf_counter() - start_time,
+        "problems": len(script.getProblems())
+    }
+
+##  Finds the G-code files for a batch: every .gcode, .gcode.gz and .bgcode
+#   file in a directory, or the files matching a glob pattern.
+def findGCodeFiles(patterns: List[str]) -> List[str]:
+    paths = [] # type: List[str]
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths.extend(sorted(path for extension in ("*.gcode", "*.gcode.gz", "*.bgcode") for path in glob.glob(os.path.join(pattern, extension))))
+        else:
+            paths.extend(sorted(glob.glob(pattern)))
+    return list(dict.fromkeys(paths)) #Without duplicates, keeping the order.
+
+##  Chooses where processBatch() writes every input file: in the output
+#   directory with the same file name or, for files whose names are the same,
+#   with their path relative to the directory that holds all of them.
+#   \return The output path of every input path, and the input paths that
+#   still have the same output path as an earlier one (e.g. the same file
+#   given twice) with that earlier input path.
+def _batchOutputPaths(input_paths: List[str], output_directory: str) -> Tuple[Dict[str, str], Dict[str, str]]:
+    names = collections.Counter(os.path.basename(input_path) for input_path in input_paths)
+    colliding = {input_path: os.path.abspath(input_path) for input_path in input_paths if names[os.path.basename(input_path)] > 1}
+    if colliding:
+        try:
+            common_directory = os.path.commonpath([os.path.dirname(path) for path in colliding.values()])
+        except ValueError: #On different drives, so leave the drives out.
+            colliding = {input_path: os.sep + os.path.splitdrive(path)[1].lstrip("\\/") for input_path, path in colliding.items()}
+            common_directory = os.path.commonpath([os.path.dirname(path) for path in colliding.values()])
+    output_paths = collections.OrderedDict() # type: Dict[str, str]
+    collisions = collections.OrderedDict() # type: Dict[str, str]
+    inputs_by_output = {} # type: Dict[str, str]
+    for input_path in input_paths:
+        if input_path in colliding:
+            output_path = os.path.join(output_directory, os.path.relpath(colliding[input_path], common_directory))
+        else:
+            output_path = os.path.join(output_directory, os.path.basename(input_path))
+        key = os.path.normcase(os.path.abspath(output_path))
+        if key in inputs_by_output:
+            collisions[input_path] = inputs_by_output[key]
+            continue
+        inputs_by_output[key] = input_path
+        output_paths[input_path] = output_path
+    return output_paths, collisions
+
+##  Inserts the pauses into many G-code files at once, spread over a pool of
+#   processes.
+#
+#   Progress is reported on stderr with the throughput of every file.
+#   \param input_paths: G-code files to read.
+#   \param output_directory: Directory to write the G-code files to, with
+#   the same file names. Files with the same name are written with their
+#   relative path instead, see _batchOutputPaths(), so that none overwrites
+#   another. An input that would still overwrite another fails.
+#   \param values: Setting values by setting key, as for applySettings().
+#   \param workers: Number of processes. By default one per CPU core.
+#   \param report: Whether to write the report of the pauses next to every
+#   output, as <output>.pauses.json.
+#   \return The error message of every file that failed, by input path. Files
+#   whose pauses have problems, with the verify_pauses setting, count as
+#   failed even though their output is written.
+def processBatch(input_paths: List[str], output_directory: str, values: Dict[str, Any], workers: Optional[int] = None, report: bool = False) -> Dict[str, str]:
+    os.makedirs(output_directory, exist_ok = True)
+    failures = {} # type: Dict[str, str]
+    total_bytes = 0
+    start_time = time.perf_counter()
+    output_paths, collisions = _batchOutputPaths(input_paths, output_directory)
+    for input_path, earlier_path in collisions.items():
+        failures[input_path] = "Would overwrite the output of {earlier_path}".format(earlier_path = earlier_path)
+        Logger.log("e", "Failed %s: %s", input_path, failures[input_path])
+    with concurrent.futures.ProcessPoolExecutor(max_workers = workers or os.cpu_count()) as executor:
+        futures = {}
+        for input_path, output_path in output_paths.items():
+            os.makedirs(os.path.dirname(output_path), exist_ok = True)
+            futures[executor.submit(processFile, input_path, output_path, values, report)] = input_path
+        for future in concurrent.futures.as_completed(futures):
+            input_path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failures[input_path] = "{type}: {message}".format(type = type(e).__name__, message = e)
+                Logger.log("e", "Failed %s: %s", input_path, failures[input_path])
+                continue
+            total_bytes += result["bytes"]
+            seconds = max(result["seconds"], 1e-9)
+            Logger.log("i", "Done %s: %.1f MB in %.2f s (%.1f MB/s, %.0f layers read/s)", input_path, result["bytes"] / 1e6, result["seconds"], result["bytes"] / 1e6 / seconds, result["layers"] / seconds)
+            if result["problems"]:
+                failures[input_path] = "Verifying the pauses found {count} problem(s)".format(count = result["problems"])
+                Logger.log("e", "Failed %s: %s", input_path, failures[input_path])
+    seconds = max(time.perf_counter() - start_time, 1e-9)
+    Logger.log("i", "Processed %d of %d files, %.1f MB in %.2f s (%.1f MB/s)", len(input_paths) - len(failures), len(input_paths), total_bytes / 1e6, seconds, total_bytes / 1e6 / seconds)
+    return failures
+
+##  Creates the command line parser. Setting keys are the same as in Cura.
+def _createArgumentParser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description = "Insert pauses (e.g. for a filament swap) into sliced G-code.")
+    parser.add_argument("input", nargs = "*", default = ["-"], help = "G-code file to read (.gcode, .gcode.gz or .bgcode), or - for stdin (default). With --output-dir: G-code files, directories or glob patterns.")
+    parser.add_argument("-o", "--output", default = "-", help = "File to write the G-code to, or - for stdout (default). Gzip compressed if it ends with .gz; binary G-code is written as binary G-code.")
+    parser.add_argument("-d", "--output-dir", help = "Process a batch of files in parallel, writing them to this directory.")
+    parser.add_argument("-j", "--jobs", type = int, help = "Number of processes for a batch. By default one per CPU core.")
+    parser.add_argument("--settings", help = "JSON file with setting values by key, e.g. {\"pause_height\": \"5, 10\", \"retraction_amount\": 5}. The printer settings machine_firmware_retract, machine_nozzle_temp_enabled, layer_height_0, machine_acceleration, machine_width, machine_depth and machine_center_is_zero can be given too.")
+    parser.add_argument("--report", action = "store_true", help = "Write a JSON report of the inserted pauses (layer, height, resume position, temperatures, byte offset, estimated time) next to every output file, as <output>.pauses.json.")
+    parser.add_argument("-s", "--set", dest = "values", action = "append", default = [], metavar = "KEY=VALUE", help = "Setting value, overriding the settings file. Can be given more than once.")
+    return parser
+
+##  Command line entry point: streams G-code from a file or stdin to a file
+#   or stdout, inserting the pauses, or processes a batch of files.
+#   \return Exit status: 1 if a file failed or verifying its pauses found
+#   problems, otherwise 0.
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = _createArgumentParser()
+    args = parser.parse_args(argv)
+    script = PauseAtHeightOptions()
+    values = _readSettingValues(parser, args)
+    if args.report and not args.output_dir:
+        if args.output == "-":
+            parser.error("Give --output to write a report.")
+        values["pause_report_file"] = args.output + ".pauses.json"
+    try:
+        applySettings(script, values)
+    except (KeyError, ValueError) as e:
+        parser.error(str(e))
+
+    if args.output_dir:
+        input_paths = findGCodeFiles(args.input)
+        if not input_paths:
+            parser.error("No G-code files found.")
+        failures = processBatch(input_paths, args.output_dir, values, args.jobs, args.report)
+        return 1 if failures else 0
+
+    if len(args.input) > 1:
+        parser.error("Give --output-dir to process more than one file.")
+    if _isBinaryGCode(args.input[0]):
+        with contextlib.ExitStack() as stack:
+            binary_input = sys.stdin.buffer if args.input[0] == "-" else stack.enter_context(open(args.input[0], "rb"))
+            binary_output = sys.stdout.buffer if args.output == "-" else stack.enter_context(open(args.output, "wb"))
+            _rewriteBinaryGCode(script, binary_input, binary_output)
+            binary_output.flush()
+    elif not args.output.endswith(".gz") and _isMappable(args.input[0]):
+        with contextlib.ExitStack() as stack:
+            binary_output = sys.stdout.buffer if args.output == "-" else stack.enter_context(open(args.output, "wb"))
+            _rewriteMappedGCode(script, args.input[0], binary_output)
+            binary_output.flush()
+    else:
+        with _openGCode(args.input[0], "r") as input_stream, _openGCode(args.output, "w") as output_stream:
+            for segment in script.executeStream(readLayers(input_stream)):
+                output_stream.write(segment)
+    return 1 if script.getProblems() else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
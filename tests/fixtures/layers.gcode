@@ -0,0 +1,16 @@
+;LAYER:0
+G0 F9000 X10 Y10 Z0.3
+G1 F1500 X20 Y10 E0.5
+G1 X20 Y20 E1
+G1 X10 Y20 E1.5
+G1 X10 Y10 E2
+;LAYER:1
+G0 F9000 X10 Y10 Z0.5
+G1 F1500 X20 Y10 E2.5
+G1 X20 Y20 E3
+G1 X10 Y20 E3.5
+G1 X10 Y10 E4
+;LAYER:2
+G0 F9000 X10 Y10 Z0.7
+G1 F1500 X20 Y10 E4.5
+G1 X20 Y20 E5
@@ -0,0 +1,34 @@
+##  Tests for running the script on a worker thread, executeInBackground().
+#
+#   python -m unittest discover tests
+
+import os
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+from cura_stubs import createScript, loadScript
+from synthetic_gcode import generateGCode
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PauseAtHeightOptions.py")
+script_module = loadScript(SCRIPT_PATH, "PauseAtHeightOptionsBackground") #Its own name, so that the batch tests can still send theirs to other processes.
+
+class TestOneJobAtATime(unittest.TestCase):
+    def test_secondJobRaises(self) -> None:
+        data = generateGCode(layers = 40, lines_per_layer = 5)
+        script = createScript(script_module, {"pause_at": "layer_no", "pause_layer": "20"})
+        release = threading.Event()
+        job = script.executeInBackground(data, progress = lambda done, total: release.wait(10), chunk_layers = 5) #Holds the job at its first progress report.
+        try:
+            with self.assertRaises(RuntimeError):
+                script.executeInBackground(data)
+        finally:
+            release.set()
+        expected = job.getResult()
+
+        self.assertEqual(script.executeInBackground(data).getResult(), expected) #Once it finished, the next can start.
+        self.assertEqual(expected, createScript(script_module, {"pause_at": "layer_no", "pause_layer": "20"}).execute(list(data)))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+##  Tests for the batch mode of the command line, processBatch(), and the
+#   exit status of the command line.
+#
+#   python -m unittest discover tests
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+from cura_stubs import loadScript
+from synthetic_gcode import generateGCode
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PauseAtHeightOptions.py")
+script_module = loadScript(SCRIPT_PATH)
+
+class TestBatchOutputPaths(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.root = self._directory.name
+
+    ##  Writes a G-code file with a comment to recognise it by in the output.
+    def _writeGCode(self, relative_path: str, layers: int) -> str:
+        path = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok = True)
+        with open(path, "w", encoding = "utf-8") as gcode_file:
+            gcode_file.write(";SOURCE:" + relative_path + "\n")
+            gcode_file.write("".join(generateGCode(layers = layers, lines_per_layer = 5)))
+        return path
+
+    def test_sameNameKeepsRelativePath(self) -> None:
+        first = self._writeGCode(os.path.join("a", "part.gcode"), 20)
+        second = self._writeGCode(os.path.join("b", "part.gcode"), 30)
+        output_directory = os.path.join(self.root, "out")
+
+        failures = script_module.processBatch([first, second], output_directory, {"pause_height": "2"}, workers = 1)
+
+        self.assertEqual(failures, {})
+        for relative_path in (os.path.join("a", "part.gcode"), os.path.join("b", "part.gcode")):
+            with open(os.path.join(output_directory, relative_path), encoding = "utf-8") as output_file:
+                self.assertTrue(output_file.read().startswith(";SOURCE:" + relative_path + "\n"))
+
+    def test_uniqueNamesStayFlat(self) -> None:
+        first = self._writeGCode(os.path.join("a", "first.gcode"), 20)
+        second = self._writeGCode(os.path.join("b", "second.gcode"), 20)
+        output_directory = os.path.join(self.root, "out")
+
+        output_paths, collisions = script_module._batchOutputPaths([first, second], output_directory)
+
+        self.assertEqual(collisions, {})
+        self.assertEqual(output_paths, {first: os.path.join(output_directory, "first.gcode"), second: os.path.join(output_directory, "second.gcode")})
+
+    def test_sameFileTwiceFails(self) -> None:
+        path = self._writeGCode(os.path.join("a", "part.gcode"), 20)
+        same_path = os.path.join(self.root, "a", ".", "part.gcode")
+        output_directory = os.path.join(self.root, "out")
+
+        failures = script_module.processBatch([path, same_path], output_directory, {"pause_height": "2"}, workers = 1)
+
+        self.assertEqual(list(failures), [same_path])
+        self.assertTrue(os.path.exists(os.path.join(output_directory, "part.gcode")))
+
+class TestVerifyExitStatus(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.root = self._directory.name
+        self.input_path = os.path.join(self.root, "part.gcode")
+        with open(self.input_path, "w", encoding = "utf-8") as gcode_file:
+            gcode_file.write("".join(generateGCode(layers = 20, lines_per_layer = 5)))
+
+    ##  Runs the command line with the settings in a settings file, which keeps
+    #   their types with the stand-in Script of cura_stubs.
+    def _main(self, values: dict) -> int:
+        settings_path = os.path.join(self.root, "settings.json")
+        with open(settings_path, "w", encoding = "utf-8") as settings_file:
+            json.dump(values, settings_file)
+        return script_module.main([self.input_path, "-o", os.path.join(self.root, "output.gcode"), "--settings", settings_path])
+
+    def test_problemsFail(self) -> None: #Redoing a layer of the synthetic G-code leaves E where the layer after the pause doesn't continue from.
+        self.assertEqual(self._main({"pause_height": "2", "redo_layers": 1, "verify_pauses": True}), 1)
+        self.assertTrue(os.path.exists(os.path.join(self.root, "output.gcode")))
+
+    def test_noProblemsSucceed(self) -> None:
+        self.assertEqual(self._main({"pause_height": "2", "verify_pauses": True}), 0)
+
+    def test_unverifiedProblemsSucceed(self) -> None:
+        self.assertEqual(self._main({"pause_height": "2", "redo_layers": 1}), 0)
+
+    def test_batchProblemsFail(self) -> None:
+        output_directory = os.path.join(self.root, "out")
+
+        failures = script_module.processBatch([self.input_path], output_directory, {"pause_height": "2", "redo_layers": 1, "verify_pauses": True}, workers = 1)
+
+        self.assertEqual(list(failures), [self.input_path])
+        self.assertTrue(os.path.exists(os.path.join(output_directory, "part.gcode")))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,130 @@
+##  Tests for reading and rewriting Prusa's binary G-code (.bgcode): the
+#   heatshrink and MeatPack decoders against data that the encoder in
+#   tools/binary_gcode.py didn't write, and copying the blocks after the last
+#   pause.
+#
+#   The heatshrink fixtures were compressed with the heatshrink C library (the
+#   heatshrink2 package) from fixtures/layers.gcode. The MeatPack data is
+#   packed by hand after the format that Prusa's libbgcode decodes.
+#
+#   python -m unittest discover tests
+
+import io
+import os
+import struct
+import sys
+import unittest
+import unittest.mock
+import zlib
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+from binary_gcode import fromBinaryGCode, runText, toBinaryGCode
+from cura_stubs import createScript, loadScript
+from synthetic_gcode import generateGCode
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PauseAtHeightOptions.py")
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+script_module = loadScript(SCRIPT_PATH, "PauseAtHeightOptionsBinary") #Its own name, so that the batch tests can still send theirs to other processes.
+
+def _readFixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES_PATH, name), "rb") as fixture_file:
+        return fixture_file.read()
+
+##  Creates a binary G-code file with one G-code block holding the given
+#   data as it is, so that the data can come from another encoder.
+def _binaryGCodeFile(compression: int, encoding: int, uncompressed_size: int, data: bytes) -> bytes:
+    if compression:
+        header = struct.pack("<HHII", 1, compression, uncompressed_size, len(data))
+    else:
+        header = struct.pack("<HHI", 1, compression, uncompressed_size)
+    block = header + struct.pack("<H", encoding) + data
+    return b"GCDE" + struct.pack("<IH", 1, 1) + block + struct.pack("<I", zlib.crc32(block))
+
+##  Packed lines of G-code with spaces, as pairs of four bits with the lowest
+#   bits first: 0-9, "." (10), " " (11), new line (12), "G" (13) and "X"
+#   (14). 15 means that the character follows as a whole byte, after the
+#   byte, e.g. 0x1F "M" is "M1" and 0xFF "O" "K" is "OK". After a new line in
+#   the lowest bits, the highest bits are padding.
+_MEATPACK_WITH_SPACES = bytes([
+    0xFF, 0xFF, 0xFB, #Enable packing.
+    0x1F, ord("M"), 0x40, 0xFB, ord("S"), 0x02, 0xC0, #M104 S200
+    0x1F, ord("M"), 0x71, 0xFB, ord("H"), 0xBF, ord("i"), 0xFF, ord("O"), ord("K"), 0x0C, #M117 Hi OK
+    0x1D, 0xFB, ord("E"), 0xC1 #G1 E1
+])
+
+##  Lines without spaces, where the code of the space (11) is an E instead,
+#   and a comment that is written without packing.
+_MEATPACK_WITHOUT_SPACES = bytes([
+    0xFF, 0xFF, 0xFB, #Enable packing.
+    0xFF, 0xFF, 0xF7, #Enable no spaces.
+    0x1D, 0x1E, 0xA0, 0xB5, 0xC0, #G1X10.5E0
+    0xFF, 0xFF, 0xFA #Disable packing.
+]) + b";LAYER:1\n" + bytes([
+    0xFF, 0xFF, 0xFB,
+    0x1D, 0x1E, 0x2B, 0x0C #G1X1E2
+])
+
+class TestDecoders(unittest.TestCase):
+    def test_heatshrink(self) -> None:
+        expected = _readFixture("layers.gcode")
+        for window_bits in (11, 12):
+            compressed = _readFixture("layers.gcode.heatshrink_{window_bits}_4".format(window_bits = window_bits))
+            with self.subTest(window_bits = window_bits), unittest.mock.patch.object(script_module, "heatshrink2", None): #The decoder in Python, not the library the fixtures were made with.
+                self.assertEqual(script_module._heatshrinkDecompress(compressed, window_bits, 4, len(expected)), expected)
+
+    def test_heatshrinkBlock(self) -> None:
+        expected = _readFixture("layers.gcode").decode("utf-8")
+        data = _binaryGCodeFile(3, 0, len(expected), _readFixture("layers.gcode.heatshrink_12_4"))
+        with unittest.mock.patch.object(script_module, "heatshrink2", None):
+            text, _ = fromBinaryGCode(script_module, data)
+        self.assertEqual(text, expected)
+
+    def test_meatpack(self) -> None:
+        self.assertEqual(script_module._meatpackDecode(_MEATPACK_WITH_SPACES), b"M104 S200\nM117 Hi OK\nG1 E1\n")
+
+    def test_meatpackWithoutSpaces(self) -> None:
+        self.assertEqual(script_module._meatpackDecode(_MEATPACK_WITHOUT_SPACES), b"G1X10.5E0\n;LAYER:1\nG1X1E2\n")
+
+    def test_meatpackBlock(self) -> None:
+        text, _ = fromBinaryGCode(script_module, _binaryGCodeFile(0, 2, len(_MEATPACK_WITH_SPACES), _MEATPACK_WITH_SPACES))
+        self.assertEqual(text, "M104 S200\nM117 Hi OK\nG1 E1\n")
+
+class TestCopyThroughBlocks(unittest.TestCase):
+    ##  Rewrites binary G-code of small blocks, so that the layers after the
+    #   pause span many blocks.
+    #   \return The input as text and binary G-code, the output and the
+    #   number of layers read.
+    def _rewrite(self, settings: Dict[str, Any]) -> Tuple[str, bytes, bytes, int]:
+        text = "".join(generateGCode(layers = 60, lines_per_layer = 20))
+        binary = toBinaryGCode(text, "deflate", block_size = 2000)
+        output = io.BytesIO()
+        layer_count = script_module._rewriteBinaryGCode(createScript(script_module, settings), io.BytesIO(binary), output)
+        return text, binary, output.getvalue(), layer_count
+
+    ##  Gets the raw bytes of the blocks of binary G-code.
+    def _rawBlocks(self, data: bytes) -> List[bytes]:
+        return [block.raw for block in fromBinaryGCode(script_module, data)[1]]
+
+    def test_blocksAfterLastPauseCopied(self) -> None:
+        settings = {"pause_at": "layer_no", "pause_layer": "5"}
+        text, binary, output, layer_count = self._rewrite(settings)
+
+        self.assertEqual(fromBinaryGCode(script_module, output)[0], runText(script_module, settings, text))
+        self.assertLess(layer_count, 20) #The rest of the blocks are copied without decoding them.
+        input_blocks = self._rawBlocks(binary)
+        output_blocks = self._rawBlocks(output)
+        self.assertEqual(len(output_blocks), len(input_blocks))
+        changed = [index for index, block in enumerate(input_blocks) if block != output_blocks[index]]
+        self.assertEqual(len(changed), 1) #Only the block with the pause.
+        self.assertEqual(output_blocks[changed[0] + 1:], input_blocks[changed[0] + 1:])
+
+    def test_blocksAfterLastPauseReadWhenVerifying(self) -> None:
+        settings = {"pause_at": "layer_no", "pause_layer": "5", "verify_pauses": True}
+        text, binary, output, layer_count = self._rewrite(settings)
+
+        self.assertEqual(fromBinaryGCode(script_module, output)[0], runText(script_module, settings, text))
+        self.assertEqual(layer_count, 61) #The start code and every layer.
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+##  Tests for rewriting plain G-code files by copying them through a memory
+#   map, _rewriteMappedGCode(), against the streaming path, executeStream().
+#
+#   python -m unittest discover tests
+
+import os
+import sys
+import tempfile
+import unittest
+from typing import Any, Dict, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+from cura_stubs import createScript, loadScript
+from synthetic_gcode import generateGCode
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PauseAtHeightOptions.py")
+script_module = loadScript(SCRIPT_PATH, "PauseAtHeightOptionsCopyThrough") #Its own name, so that the batch tests can still send theirs to other processes.
+
+class TestCopyThrough(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+        self.input_path = os.path.join(self._directory.name, "input.gcode")
+
+    def _writeInput(self, gcode: str) -> None:
+        with open(self.input_path, "w", encoding = "utf-8", newline = "") as input_file:
+            input_file.write(gcode)
+
+    ##  Rewrites the input by copying it through and by streaming it.
+    #   \return The G-code of both and the number of layers that copying
+    #   through read.
+    def _rewrite(self, settings: Dict[str, Any]) -> Tuple[bytes, bytes, int]:
+        output_path = os.path.join(self._directory.name, "output.gcode")
+        with open(output_path, "wb") as output_file:
+            layer_count = script_module._rewriteMappedGCode(createScript(script_module, settings), self.input_path, output_file)
+        with open(output_path, "rb") as output_file:
+            copied = output_file.read()
+        with open(self.input_path, encoding = "utf-8", newline = "") as input_file:
+            streamed = "".join(createScript(script_module, settings).executeStream(script_module.readLayers(input_file))).encode("utf-8")
+        return copied, streamed, layer_count
+
+    def test_tailAfterLastPause(self) -> None:
+        self._writeInput("".join(generateGCode(layers = 60, lines_per_layer = 20)))
+
+        copied, streamed, layer_count = self._rewrite({"pause_at": "layer_no", "pause_layer": "5", "redo_layers": 2})
+
+        self.assertEqual(copied, streamed)
+        self.assertLess(layer_count, 20) #The tail is copied without reading it.
+        with open(self.input_path, "rb") as input_file:
+            self.assertTrue(copied.endswith(input_file.read()[-1000:]))
+
+    def test_tailIsReadWhenVerifying(self) -> None:
+        self._writeInput("".join(generateGCode(layers = 60, lines_per_layer = 20)))
+
+        copied, streamed, layer_count = self._rewrite({"pause_at": "layer_no", "pause_layer": "5", "verify_pauses": True})
+
+        self.assertEqual(copied, streamed)
+        self.assertEqual(layer_count, 61) #The start code and every layer.
+
+    def test_noLayerComments(self) -> None:
+        self._writeInput(";FLAVOR:Marlin\nM82\nG28\nG1 F1500 X10 Y10 Z0.3 E1\nG1 X20 Y10 E2\n")
+
+        copied, streamed, _ = self._rewrite({"pause_at": "height", "pause_height": "0.1"})
+
+        self.assertEqual(copied, streamed)
+        with open(self.input_path, "rb") as input_file:
+            self.assertEqual(copied, input_file.read())
+
+    def test_pauseInLastLayer(self) -> None: #Like the original script, there is no layer after it to resume at.
+        self._writeInput("".join(generateGCode(layers = 30, lines_per_layer = 20)))
+        settings = {"pause_at": "layer_no", "pause_layer": "29"}
+
+        with open(os.path.join(self._directory.name, "output.gcode"), "wb") as output_file:
+            with self.assertRaises(IndexError):
+                script_module._rewriteMappedGCode(createScript(script_module, settings), self.input_path, output_file)
+        with open(self.input_path, encoding = "utf-8", newline = "") as input_file:
+            with self.assertRaises(IndexError):
+                "".join(createScript(script_module, settings).executeStream(script_module.readLayers(input_file)))
+
+    def test_pauseInLayerBeforeLast(self) -> None:
+        self._writeInput("".join(generateGCode(layers = 30, lines_per_layer = 20)))
+
+        copied, streamed, layer_count = self._rewrite({"pause_at": "layer_no", "pause_layer": "28"})
+
+        self.assertEqual(copied, streamed)
+        self.assertIn(b";current layer: 28\n", copied)
+        self.assertEqual(layer_count, 31)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,83 @@
+##  Tests for reading the moves of a layer into arrays, MoveArrays, which has
+#   to give every line the numbers that parseGCodeLine gives it.
+#
+#   python -m unittest discover tests
+
+import math
+import os
+import sys
+import unittest
+import unittest.mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+from cura_stubs import loadScript
+from synthetic_gcode import generateRandomGCode
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PauseAtHeightOptions.py")
+script_module = loadScript(SCRIPT_PATH, "PauseAtHeightOptionsMoveArrays") #Its own name, so that the batch tests can still send theirs to other processes.
+
+##  Lines that the vectorized parsing could get wrong.
+_ODD_LINES = [
+    "G1 X10 Y20.5 E-0.75", #Negative numbers.
+    "G1X10Y20E1", #No spaces.
+    "G0 F9000 X10. Y.5", #A point after the number, and a point without digits before it, which isn't a number.
+    "G1 X10 X20 Y5 Y-5", #Only the first of a letter counts.
+    "G1 X Y10", #A letter without a number.
+    "G1 X10 ; Y20 E5 comment", #Letters in a comment.
+    ";G1 X10 Y20", #A comment only.
+    "   G1 X1 Y2", #Leading spaces.
+    "G1 x10 y20 e5", #Lower case letters aren't parameters.
+    "G1 X12345678901234567.5 Y1.1234567890123456789 E-99999999999999.9", #Too long for the vectorized parsing.
+    "G1 X0.000001 Y000012.500 E007", #Leading and trailing zeros.
+    "M117 Ünïcödé X5 Y6", #Characters that take several bytes in UTF-8.
+    "G1 X5\r", #A carriage return before the new line.
+    "T1 G1 E2 F-", #A minus without digits.
+    "G28 X0 Y0 Z0 F1500 E0 G92", #G again, and every column.
+    "",
+]
+
+class TestMoveArrays(unittest.TestCase):
+    ##  Checks every column of every line of a layer against parseGCodeLine.
+    def _assertSameAsParsed(self, layer: str) -> None:
+        move_arrays = script_module.MoveArrays(layer)
+        lines = layer.split("\n")
+        self.assertEqual(move_arrays.rows, len(lines))
+        for row, line in enumerate(lines):
+            params = script_module.parseGCodeLine(line).params
+            for key in script_module._MOVE_COLUMNS:
+                expected = params.get(key)
+                actual = float(move_arrays.columns[key][row])
+                if expected is None:
+                    self.assertTrue(math.isnan(actual), "{key} of {line!r} is {actual}, not missing".format(key = key, line = line, actual = actual))
+                else:
+                    self.assertEqual(actual, expected, "{key} of {line!r}".format(key = key, line = line))
+
+    def test_oddLines(self) -> None:
+        for line in _ODD_LINES:
+            with self.subTest(line = line):
+                self._assertSameAsParsed(line + "\n" + line)
+
+    def test_oddLinesWithoutNumPy(self) -> None:
+        with unittest.mock.patch.object(script_module, "numpy", None):
+            for line in _ODD_LINES:
+                with self.subTest(line = line):
+                    self._assertSameAsParsed(line + "\n" + line)
+
+    def test_randomLayers(self) -> None:
+        for seed in range(20):
+            for layer in generateRandomGCode(seed):
+                self._assertSameAsParsed(layer)
+
+    def test_countsLinesParsedSingly(self) -> None:
+        self.assertEqual(script_module.MoveArrays("G1 X10\nG1 X12345678901234567.5\n").lines_parsed_singly, 1)
+        with unittest.mock.patch.object(script_module, "numpy", None):
+            self.assertEqual(script_module.MoveArrays("G1 X10\nG1 X12345678901234567.5\n").lines_parsed_singly, 3)
+
+    def test_queriesFindLines(self) -> None:
+        move_arrays = script_module.MoveArrays("G0 F9000 Z0.3\nG1 X10 Y10 E1\nG1 X20 E-0.5\nG1 Y20 E2\nG1 E2\n")
+        self.assertEqual(move_arrays.firstXYRow(), 1)
+        self.assertEqual(move_arrays.lastNonNegativeERow(), 4)
+        self.assertEqual(move_arrays.firstERowDifferentFrom(1), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+##  Tests for parking the head outside of the print during a pause, the
+#   park_position setting.
+#
+#   python -m unittest discover tests
+
+import os
+import re
+import sys
+import unittest
+from typing import List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+from cura_stubs import createScript, loadScript
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PauseAtHeightOptions.py")
+script_module = loadScript(SCRIPT_PATH, "PauseAtHeightOptionsParking") #Its own name, so that the batch tests can still send theirs to other processes.
+
+##  Creates G-code of layers that each extrude a square, the first layers a
+#   small one and the layers from widen_at on a larger one, which starts where
+#   the small one doesn't reach.
+def _growingPrint(widen_at: int, layers: int) -> List[str]:
+    data = [";FLAVOR:Marlin\nM82\nM104 S200\nG28\n"]
+    e = 0.0
+    for number in range(layers):
+        x, y, size = (30, 30, 20) if number < widen_at else (60, 60, 100)
+        lines = [";LAYER:{number}".format(number = number), "G0 F9000 X{x} Y{y} Z{z:.1f}".format(x = x, y = y, z = 0.3 + 0.2 * number)]
+        for corner_x, corner_y in ((x + size, y), (x + size, y + size), (x, y + size), (x, y)):
+            e += size * 0.05
+            lines.append("G1 F1500 X{x} Y{y} E{e:.5f}".format(x = corner_x, y = corner_y, e = e))
+        data.append("\n".join(lines) + "\n")
+    return data
+
+##  Gets the X and Y that the pause code parks the head at.
+def _parkedAt(gcode: str) -> Tuple[float, float]:
+    match = re.search(r"^G0 F9000 X(\S+) Y(\S+) ; park nozzle", gcode, re.MULTILINE)
+    return float(match.group(1)), float(match.group(2))
+
+class TestParkPosition(unittest.TestCase):
+    def _run(self, park_position: str) -> str:
+        settings = {"pause_at": "layer_no", "pause_layer": "5", "park_position": park_position, "park_clearance": 5, "extrude_amount": 30}
+        return "".join(createScript(script_module, settings).execute(_growingPrint(5, 10)))
+
+    def test_clearsLayerAfterPause(self) -> None: #The larger layers start where the head would park if only the layer before the pause counted.
+        for park_position in ("bounding_box", "convex_hull"):
+            with self.subTest(park_position = park_position):
+                x, y = _parkedAt(self._run(park_position))
+                distance = max(30 - x, 30 - y, x - 160, y - 160) #Outside of the square around both squares.
+                self.assertGreaterEqual(distance, 5 - 1e-6)
+
+    def test_sameAsStreaming(self) -> None:
+        settings = {"pause_at": "layer_no", "pause_layer": "5", "park_position": "convex_hull", "park_clearance": 5}
+        expected = "".join(createScript(script_module, settings).execute(_growingPrint(5, 10)))
+        self.assertEqual("".join(createScript(script_module, settings).executeStream(iter(_growingPrint(5, 10)))), expected)
+
+    def test_parkWrittenLikeResume(self) -> None:
+        gcode = self._run("bounding_box")
+        self.assertIn("G0 F9000 X25 Y30 ; park nozzle", gcode)
+        self.assertIn("G0 F9000 X60 Y60 ; return to the original X,Y", gcode)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+##  Tests for the report of the pauses, getPauses() and the pause_report_file
+#   setting: that the byte_offset of every pause is where its code starts in
+#   the output, whichever way the output is written.
+#
+#   python -m unittest discover tests
+
+import gzip
+import json
+import os
+import sys
+import tempfile
+import unittest
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+from binary_gcode import fromBinaryGCode, toBinaryGCode
+from cura_stubs import createScript, loadScript
+from synthetic_gcode import generateGCode
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PauseAtHeightOptions.py")
+script_module = loadScript(SCRIPT_PATH, "PauseAtHeightOptionsReport") #Its own name, so that the batch tests can still send theirs to other processes.
+
+_SETTINGS = {"pause_at": "layer_no", "pause_layer": "3, 7, 12", "redo_layers": 1} # type: Dict[str, Any]
+
+##  Creates G-code with characters that take several bytes in UTF-8 in every
+#   layer, so that offsets in characters and in bytes differ.
+def _gcode(newline: str = "\n") -> List[str]:
+    return [layer.replace(";TYPE:WALL-OUTER\n", ";TYPE:WALL-OUTER\n;Außenwand – äußere\n").replace("\n", newline) for layer in generateGCode(layers = 20, lines_per_layer = 10)]
+
+class TestByteOffsets(unittest.TestCase):
+    def setUp(self) -> None:
+        self._directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self._directory.cleanup)
+
+    ##  Checks that every pause is reported where its code starts in the
+    #   output, at the start of a line.
+    def _assertOffsets(self, output: bytes, pauses: List[Dict[str, Any]]) -> None:
+        self.assertEqual([pause["layer"] for pause in pauses], [3, 7, 12])
+        for pause in pauses:
+            offset = pause["byte_offset"]
+            self.assertTrue(output[offset:].startswith(b";TYPE:CUSTOM\n;added code by post processing\n") or output[offset:].startswith(b";TYPE:CUSTOM\r\n;added code by post processing\r\n"), output[offset:offset + 50])
+            self.assertIn(";current layer: {layer}".format(layer = pause["layer"]).encode("utf-8"), output[offset:offset + 200])
+            self.assertEqual(output[offset - 1:offset], b"\n")
+
+    ##  Runs processFile() on the given file with a report.
+    #   \return The output and the pauses in the report.
+    def _processFile(self, name: str, data: bytes) -> Any:
+        input_path = os.path.join(self._directory.name, "input_" + name)
+        output_path = os.path.join(self._directory.name, name)
+        with open(input_path, "wb") as input_file:
+            input_file.write(data)
+        script_module.processFile(input_path, output_path, _SETTINGS, report = True)
+        with open(output_path, "rb") as output_file:
+            output = output_file.read()
+        with open(output_path + ".pauses.json", encoding = "utf-8") as report_file:
+            return output, json.load(report_file)["pauses"]
+
+    def test_execute(self) -> None:
+        script = createScript(script_module, _SETTINGS)
+        output = "".join(script.execute(_gcode())).encode("utf-8")
+        self._assertOffsets(output, script.getPauses())
+
+    def test_executeStream(self) -> None:
+        script = createScript(script_module, _SETTINGS)
+        output = "".join(script.executeStream(iter(_gcode()))).encode("utf-8")
+        self._assertOffsets(output, script.getPauses())
+
+    def test_reportFile(self) -> None:
+        report_path = os.path.join(self._directory.name, "report.json")
+        script = createScript(script_module, dict(_SETTINGS, pause_report_file = report_path))
+        script.execute(_gcode())
+        with open(report_path, encoding = "utf-8") as report_file:
+            self.assertEqual(json.load(report_file), {"pauses": script.getPauses()})
+
+    def test_mappedFile(self) -> None:
+        for newline in ("\n", "\r\n"):
+            with self.subTest(newline = repr(newline)):
+                output, pauses = self._processFile("print.gcode", "".join(_gcode(newline)).encode("utf-8"))
+                self._assertOffsets(output, pauses)
+
+    def test_compressedFile(self) -> None:
+        output, pauses = self._processFile("print.gcode.gz", gzip.compress("".join(_gcode()).encode("utf-8")))
+        self._assertOffsets(gzip.decompress(output), pauses)
+
+    def test_binaryFile(self) -> None: #In the G-code of the G-code blocks.
+        output, pauses = self._processFile("print.bgcode", toBinaryGCode("".join(_gcode()), "deflate", block_size = 2000))
+        self._assertOffsets(fromBinaryGCode(script_module, output)[0].encode("utf-8"), pauses)
+
+if __name__ == "__main__":
+    unittest.main()
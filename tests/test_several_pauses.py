@@ -0,0 +1,121 @@
+##  Tests for pausing more than once in one run, against the original script
+#   in tools/reference, which inserts one pause per run.
+#
+#   Every layer is read as it was before any pause was inserted, so a run
+#   with several pauses has to give every paused layer exactly as a run of the
+#   original script with only that pause gives it.
+#
+#   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+from cura_stubs import createScript, loadScript
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PauseAtHeightOptions.py")
+REFERENCE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools", "reference", "PauseAtHeightOptions.py")
+script_module = loadScript(SCRIPT_PATH, "PauseAtHeightOptionsSeveral") #Its own name, so that the batch tests can still send theirs to other processes.
+reference_module = loadScript(REFERENCE_PATH, "PauseAtHeightOptionsReference")
+
+##  Creates G-code of 10 layers in which the state changes between the
+#   pauses: layer 3 sets another temperature, layer 4 extrudes at another
+#   feed rate and layer 6 resets E.
+def _changingPrint() -> List[str]:
+    data = [";FLAVOR:Marlin\n", ";LAYER_COUNT:10\nM104 S200\nM109 S200\nM82\nG28\nG92 E0\n"]
+    e = 0.0
+    for number in range(10):
+        lines = [";LAYER:{number}".format(number = number)]
+        if number == 3:
+            lines.append("M104 S210")
+        if number == 6:
+            lines.append("G92 E0")
+            e = 0.0
+        lines.append("G0 F9000 X{x} Y10 Z{z:.1f}".format(x = 10 + number, z = 0.3 + 0.2 * number))
+        feed_rate = 2400 if number >= 4 else 1500
+        for x, y in ((50, 10), (50, 50), (10 + number, 50)):
+            e += 1.25
+            lines.append("G1 F{f} X{x} Y{y} E{e:.5f}".format(f = feed_rate, x = x, y = y, e = e))
+        lines.append(";TIME_ELAPSED:{seconds:.1f}".format(seconds = 60.0 * (number + 1)))
+        data.append("\n".join(lines) + "\n")
+    data.append("M104 S0\nM140 S0\n")
+    return data
+
+class TestSeveralPauses(unittest.TestCase):
+    ##  Gets what the original script gives for every pause point on its
+    #   own, put together: every layer that a run changes as that run
+    #   changes it.
+    #   \param key: The setting that holds the pause points.
+    def _pausedOneAtATime(self, settings: Dict[str, Any], key: str, points: List[Any]) -> List[str]:
+        data = _changingPrint()
+        expected = list(data)
+        for point in points:
+            paused = createScript(reference_module, dict(settings, **{key: point})).execute(list(data))
+            for index, layer in enumerate(paused):
+                if layer != data[index]:
+                    expected[index] = layer
+        return expected
+
+    ##  Runs the script with every pause point at once, through execute() and
+    #   executeStream(), and checks that both give the expected G-code.
+    def _assertPausedAll(self, settings: Dict[str, Any], expected: List[str]) -> str:
+        output = createScript(script_module, settings).execute(_changingPrint())
+        self.assertEqual(output, expected)
+        self.assertEqual("".join(createScript(script_module, settings).executeStream(iter(_changingPrint()))), "".join(expected))
+        return "".join(output)
+
+    ##  Gets the pause code that starts at the given layer.
+    def _pauseCode(self, gcode: str, layer: int) -> str:
+        start = gcode.index(";current layer: {layer}\n".format(layer = layer))
+        return gcode[start:gcode.index(";LAYER:", start)]
+
+    def test_stateCarriesOver(self) -> None:
+        settings = {"pause_at": "layer_no", "standby_temperature": 170}
+        expected = self._pausedOneAtATime(settings, "pause_layer", ["2", "5", "8"])
+
+        gcode = self._assertPausedAll(dict(settings, pause_layer = "8, 2, 5"), expected)
+        self.assertEqual(gcode.count(";added code by post processing"), 3)
+        first = self._pauseCode(gcode, 2)
+        self.assertIn("M109 S200 ; resume temperature", first)
+        self.assertIn("G1 F1500 ; restore extrusion feedrate", first)
+        self.assertIn("G92 E7.5 ; reset extrusion value to pre-pause value", first) #The last E of layer 1.
+        second = self._pauseCode(gcode, 5)
+        self.assertIn("M109 S210 ; resume temperature", second) #Set in layer 3, after the first pause.
+        self.assertIn("G1 F2400 ; restore extrusion feedrate", second) #Layer 4 is faster.
+        self.assertIn("G92 E18.75 ; reset extrusion value to pre-pause value", second)
+        third = self._pauseCode(gcode, 8)
+        self.assertIn("M109 S210 ; resume temperature", third)
+        self.assertIn("G92 E7.5 ; reset extrusion value to pre-pause value", third) #Counted from the reset in layer 6.
+
+    def test_pausesOnSameLayer(self) -> None:
+        settings = {"pause_at": "layer_no"}
+        expected = self._pausedOneAtATime(settings, "pause_layer", ["4"])
+
+        gcode = self._assertPausedAll(dict(settings, pause_layer = "4, 4"), expected)
+        self.assertEqual(gcode.count(";added code by post processing"), 1)
+
+    def test_heightsOnSameLayer(self) -> None:
+        settings = {"pause_at": "height", "pause_layer": "0"} #The original script reads the layer even when it pauses at a height.
+        expected = self._pausedOneAtATime(settings, "pause_height", ["1.0"])
+
+        gcode = self._assertPausedAll(dict(settings, pause_height = "1.0, 1.05"), expected) #Both between the Z of layer 3 and layer 4.
+        self.assertEqual(gcode.count(";added code by post processing"), 1)
+
+    def test_pausesInRedoneLayers(self) -> None:
+        settings = {"pause_at": "layer_no", "redo_layers": 2}
+        expected = self._pausedOneAtATime(settings, "pause_layer", ["4", "5", "6"])
+
+        gcode = self._assertPausedAll(dict(settings, pause_layer = "4, 5, 6"), expected)
+        self.assertEqual(gcode.count(";added code by post processing"), 3) #The redone layers are copied as they were before the pauses.
+        self.assertEqual(gcode.count(";LAYER:4\n"), 3) #Printed, then redone after the pauses before layers 5 and 6.
+
+    def test_heightsInRedoneLayers(self) -> None:
+        settings = {"pause_at": "height", "pause_layer": "0", "redo_layers": 1}
+        expected = self._pausedOneAtATime(settings, "pause_height", ["0.8", "1.2"])
+
+        self._assertPausedAll(dict(settings, pause_height = "0.8, 1.2"), expected)
+
+if __name__ == "__main__":
+    unittest.main()
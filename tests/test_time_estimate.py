@@ -0,0 +1,108 @@
+##  Tests for estimating the time from the start of the print to a pause:
+#   the trapezoid speed profile of the moves and the lookup of Cura's
+#   ;TIME_ELAPSED: comments.
+#
+#   python -m unittest discover tests
+
+import os
+import sys
+import unittest
+import unittest.mock
+from typing import List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"))
+from cura_stubs import createScript, loadScript
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PauseAtHeightOptions.py")
+script_module = loadScript(SCRIPT_PATH, "PauseAtHeightOptionsTime") #Its own name, so that the batch tests can still send theirs to other processes.
+
+##  Creates layers that each go around a square of 10 mm at 100 mm/s.
+#   \param elapsed: Whether the layers end with a ;TIME_ELAPSED: comment.
+def _squares(layers: int, elapsed: bool) -> List[str]:
+    data = [";FLAVOR:Marlin\nM82\nG28\nG0 F6000 X0 Y0 Z0.3\n"] #Positions the head at the start of the square.
+    for number in range(layers):
+        lines = [";LAYER:{number}".format(number = number), "G1 F6000 X10 Y0 E{e}".format(e = 4 * number + 1), "G1 X10 Y10 E{e}".format(e = 4 * number + 2), "G1 X0 Y10 E{e}".format(e = 4 * number + 3), "G1 X0 Y0 E{e}".format(e = 4 * number + 4)]
+        if elapsed:
+            lines.append(";TIME_ELAPSED:{seconds:.6f}".format(seconds = 100.0 * (number + 1)))
+        data.append("\n".join(lines) + "\n")
+    return data
+
+class TestTrapezoidTime(unittest.TestCase):
+    def _time(self, distance: float, speed: float, entry: float, exit: float, acceleration: float) -> float:
+        if script_module.numpy is not None: #With NumPy it times arrays of moves.
+            distance, speed, entry, exit = (script_module.numpy.float64(value) for value in (distance, speed, entry, exit))
+        return float(script_module._trapezoidTime(distance, speed, entry, exit, acceleration))
+
+    def test_cruises(self) -> None: #Speeds up over 1.25 mm, cruises 97.5 mm and slows down over 1.25 mm.
+        self.assertAlmostEqual(self._time(100, 50, 0, 0, 1000), 0.05 + 97.5 / 50 + 0.05)
+
+    def test_fromAndToSpeed(self) -> None: #Speeds up from 20 mm/s over 1.05 mm and slows down to 40 mm/s over 0.45 mm.
+        self.assertAlmostEqual(self._time(10, 50, 20, 40, 1000), 0.03 + 8.5 / 50 + 0.01)
+
+    def test_tooShortToCruise(self) -> None: #Reaches only sqrt(1000) mm/s halfway.
+        self.assertAlmostEqual(self._time(1, 50, 0, 0, 1000), 2 * 1000 ** 0.5 / 1000)
+
+    def test_tooShortToReachExit(self) -> None: #Changes speed evenly from 10 to 30 mm/s.
+        self.assertAlmostEqual(self._time(0.1, 50, 10, 30, 1000), 2 * 0.1 / 40)
+
+    def test_withoutNumPy(self) -> None:
+        with unittest.mock.patch.object(script_module, "numpy", None):
+            self.assertAlmostEqual(self._time(100, 50, 0, 0, 1000), 0.05 + 97.5 / 50 + 0.05)
+            self.assertAlmostEqual(self._time(1, 50, 0, 0, 1000), 2 * 1000 ** 0.5 / 1000)
+            self.assertAlmostEqual(self._time(0.1, 50, 10, 30, 1000), 2 * 0.1 / 40)
+
+class TestMoveTime(unittest.TestCase):
+    def _estimate(self, layer: str, acceleration: float) -> float:
+        return script_module._estimateMoveTime(script_module.MoveArrays(layer), script_module._Motion(), acceleration)
+
+    def test_stopsAtCorners(self) -> None: #Every side speeds up to 100 mm/s over 5 mm and slows down to 0 over the other 5 mm.
+        square = "G1 F6000 X10 Y0 E1\nG1 X10 Y10 E2\nG1 X0 Y10 E3\nG1 X0 Y0 E4\n"
+        for use_numpy in (True, False):
+            with self.subTest(use_numpy = use_numpy), unittest.mock.patch.object(script_module, "numpy", script_module.numpy if use_numpy else None):
+                self.assertAlmostEqual(self._estimate(square, 1000), 4 * 0.2)
+
+    def test_keepsSpeedOnStraightLine(self) -> None: #Speeds up over 5 mm, cruises 10 mm and slows down over 5 mm.
+        line = "G1 F6000 X10 Y0 E1\nG1 X20 Y0 E2\n"
+        for use_numpy in (True, False):
+            with self.subTest(use_numpy = use_numpy), unittest.mock.patch.object(script_module, "numpy", script_module.numpy if use_numpy else None):
+                self.assertAlmostEqual(self._estimate(line, 1000), 0.1 + 0.1 + 0.1)
+
+    def test_extrusionOnly(self) -> None: #Timed by its E distance.
+        self.assertAlmostEqual(self._estimate("G1 F300 E5\n", 0), 1.0)
+
+    def test_ignoresOtherCommands(self) -> None:
+        self.assertAlmostEqual(self._estimate("M104 S200\nG4 S10\nG1 F6000 X100\n;G1 X0\n", 0), 1.0)
+
+class TestTimeElapsed(unittest.TestCase):
+    def test_lastComment(self) -> None:
+        self.assertEqual(script_module._timeElapsed(";LAYER:1\n;TIME_ELAPSED:10.5\nG1 X1\n;TIME_ELAPSED:20.25\n"), 20.25)
+
+    def test_onlyAtStartOfLine(self) -> None:
+        self.assertEqual(script_module._timeElapsed(";TIME_ELAPSED:10\nG1 X1 ;TIME_ELAPSED:20\n"), 10)
+
+    def test_invalid(self) -> None:
+        for layer in ("G1 X1\n", ";TIME_ELAPSED:abc\n", ";TIME_ELAPSED:-5\n", ";TIME_ELAPSED:nan\n", ";TIME_ELAPSED:inf"):
+            with self.subTest(layer = layer):
+                self.assertIsNone(script_module._timeElapsed(layer))
+
+class TestTimeBefore(unittest.TestCase):
+    def test_usesCommentOfLayerBefore(self) -> None:
+        layer_index = script_module.LayerIndex(_squares(5, True), 0.3)
+        layer_index.estimateTimes(1000)
+        self.assertEqual(layer_index.timeBefore(4), 300.0) #The comment at the end of layer 2, in entry 3.
+        self.assertEqual(len(layer_index.layers), 4) #Only the entries up to the one before the pause are read.
+
+    def test_estimatesWithoutComments(self) -> None:
+        layer_index = script_module.LayerIndex(_squares(5, False), 0.3)
+        layer_index.estimateTimes(1000)
+        self.assertAlmostEqual(layer_index.timeBefore(4), 2 * 300 ** 0.5 / 1000 + 3 * 0.8) #Going up to Z0.3, too short to reach 100 mm/s, and three squares.
+
+    def test_pauseReportsEstimate(self) -> None:
+        for elapsed, expected in ((True, 200.0), (False, 1.6)):
+            with self.subTest(elapsed = elapsed):
+                script = createScript(script_module, {"pause_at": "layer_no", "pause_layer": "2", "estimate_time": True, "machine_acceleration": 1000})
+                script.execute(_squares(5, elapsed))
+                self.assertEqual(script.getPauses()[0]["estimated_seconds"], expected)
+
+if __name__ == "__main__":
+    unittest.main()
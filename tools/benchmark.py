@@ -0,0 +1,174 @@
+##  Benchmarks PauseAtHeightOptions outside of Cura.
+#
+#   The script is loaded with the stand-ins for Cura's Script, Application
+#   and Logger from cura_stubs.py, so any version of it can be benchmarked,
+#   also versions from before it could run outside of Cura. Every scenario runs on G-code from
+#   synthetic_gcode.py and is timed over a number of repeats; the peak memory
+#   is measured in a separate run with tracemalloc, since tracing slows the
+#   code down. The caches that the script keeps between runs are cleared
+#   before every run, so that every repeat reads the G-code like the first
+#   run on it. The "cached" mode instead times execute() on G-code that the
+#   script has just read, as when the same print is sliced again. The results
+#   are written as JSON so that they can be compared with the results of
+#   another version with --compare.
+#
+#   python tools/benchmark.py --output new.json --compare old.json
+
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from cura_stubs import Logger, clearCaches, createScript, loadScript
+from synthetic_gcode import generateGCode
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PauseAtHeightOptions.py")
+
+##  Scenarios to benchmark: settings for the script plus how to generate the
+#   G-code. The pause is in the middle of the print, so that execute() has
+#   to read half of the layers before it gets there.
+def getScenarios(layers: int, lines_per_layer: int) -> List[Dict[str, Any]]:
+    middle_height = 0.3 + (layers // 2) * 0.2
+    return [
+        {"name": "height", "settings": {"pause_at": "height", "pause_height": middle_height}, "gcode": {}},
+        {"name": "layer", "settings": {"pause_at": "layer_no", "pause_layer": layers // 2}, "gcode": {}},
+        {"name": "redo_layers", "settings": {"pause_at": "height", "pause_height": middle_height, "redo_layers": 5}, "gcode": {}},
+        {"name": "multiple_pauses", "settings": {"pause_at": "height", "pause_height": ", ".join(str(0.3 + (layers * i // 5) * 0.2) for i in range(1, 5))}, "gcode": {}},
+        {"name": "raft", "settings": {"pause_at": "layer_no", "pause_layer": layers // 2}, "gcode": {"raft_layers": 3}},
+        {"name": "extruders", "settings": {"pause_at": "height", "pause_height": middle_height, "retraction_amount": 5}, "gcode": {"extruders": 2}},
+        {"name": "griffin", "settings": {"pause_at": "height", "pause_height": middle_height}, "gcode": {"griffin": True}}
+    ]
+
+##  Runs one scenario and measures it.
+#   \param run: Function that processes a copy of the G-code.
+#   \param prepare: Function to call before every run, e.g. to clear the
+#   caches.
+def measure(run: Callable[[List[str]], Any], data: List[str], repeat: int, prepare: Callable[[], Any]) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        copy = list(data)
+        prepare()
+        gc.collect()
+        start_time = time.perf_counter()
+        run(copy)
+        times.append(time.perf_counter() - start_time)
+
+    copy = list(data)
+    prepare()
+    gc.collect()
+    tracemalloc.start()
+    run(copy)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    line_count = sum(layer.count("\n") for layer in data)
+    best = min(times)
+    return {
+        "seconds": best,
+        "mean_seconds": sum(times) / len(times),
+        "lines": line_count,
+        "lines_per_second": line_count / best if best > 0 else 0.0,
+        "megabytes_per_second": sum(len(layer) for layer in data) / 1e6 / best if best > 0 else 0.0,
+        "peak_memory_bytes": peak_memory
+    }
+
+def runBenchmarks(module: Any, layers: int, lines_per_layer: int, repeat: int, modes: List[str]) -> List[Dict[str, Any]]:
+    results = []
+    for scenario in getScenarios(layers, lines_per_layer):
+        data = generateGCode(layers = layers, lines_per_layer = lines_per_layer, **scenario["gcode"])
+        for mode in modes:
+            script = createScript(module, dict(scenario["settings"], layer_height_0 = 0.3))
+            if mode == "stream":
+                run = lambda copy: sum(len(segment) for segment in script.executeStream(copy))
+            else:
+                run = script.execute
+            prepare = lambda: clearCaches(module)
+            if mode == "cached":
+                prepare = lambda: None
+            result = {"scenario": scenario["name"], "mode": mode, "layers": len(data)}
+            try:
+                if mode == "cached":
+                    clearCaches(module)
+                    run(list(data)) #Fills the caches for the runs that are measured.
+                result.update(measure(run, data, repeat, prepare))
+            except Exception as e: #E.g. settings that an older version doesn't support.
+                tracemalloc.stop()
+                result["error"] = "{type}: {message}".format(type = type(e).__name__, message = e)
+                sys.stderr.write("{scenario:16} {mode:8} failed: {error}\n".format(scenario = scenario["name"], mode = mode, error = result["error"]))
+                results.append(result)
+                continue
+            results.append(result)
+            sys.stderr.write("{scenario:16} {mode:8} {seconds:8.3f} s {lines_per_second:12.0f} lines/s {peak:8.1f} MB peak\n".format(scenario = scenario["name"], mode = mode, seconds = result["seconds"], lines_per_second = result["lines_per_second"], peak = result["peak_memory_bytes"] / 1e6))
+    return results
+
+##  Prints how much faster or slower every scenario got compared to an
+#   earlier run, as the new time divided by the old time: below 1 is faster,
+#   above 1 is slower. Scenarios that got slower by more than the tolerance
+#   (a fraction of the old time) are flagged.
+#   \return The number of scenarios that got slower.
+def compareResults(results: List[Dict[str, Any]], previous: Dict[str, Any], tolerance: float = 0.0) -> int:
+    previous_results = {(result["scenario"], result["mode"]): result for result in previous["results"]}
+    slower = 0
+    for result in results:
+        old = previous_results.get((result["scenario"], result["mode"]))
+        if old is None or "error" in old or "error" in result or old["seconds"] <= 0:
+            continue
+        time_ratio = result["seconds"] / old["seconds"]
+        flag = ""
+        if time_ratio > 1 + tolerance:
+            flag = "  SLOWER ({speedup:.2f}x speedup)".format(speedup = old["seconds"] / max(result["seconds"], 1e-12))
+            slower += 1
+        sys.stderr.write("{scenario:16} {mode:8} {time:6.2f}x time, {memory:6.2f}x peak memory (new / old){flag}\n".format(scenario = result["scenario"], mode = result["mode"], time = time_ratio, memory = result["peak_memory_bytes"] / max(old["peak_memory_bytes"], 1), flag = flag))
+    if slower:
+        sys.stderr.write("{slower} scenarios got slower.\n".format(slower = slower))
+    return slower
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description = "Benchmark PauseAtHeightOptions on synthetic G-code.")
+    parser.add_argument("--script", default = SCRIPT_PATH, help = "Path of the PauseAtHeightOptions.py to benchmark.")
+    parser.add_argument("--layers", type = int, default = 400)
+    parser.add_argument("--lines-per-layer", type = int, default = 1000)
+    parser.add_argument("--repeat", type = int, default = 3)
+    parser.add_argument("--modes", default = "execute,stream,cached", help = "Comma-separated code paths to benchmark: execute, stream and/or cached (execute() on G-code that it read just before).")
+    parser.add_argument("--output", help = "File to write the results to as JSON. Default: stdout.")
+    parser.add_argument("--compare", help = "Results of an earlier run to compare with.")
+    parser.add_argument("--tolerance", type = float, default = 0.0, help = "Fraction by which a scenario may get slower than in the compared run before it is flagged. Default: 0, so every slowdown is flagged.")
+    args = parser.parse_args(argv)
+
+    module = loadScript(args.script)
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    if "stream" in modes and not hasattr(module.PauseAtHeightOptions, "executeStream"):
+        modes.remove("stream") #Older versions of the script.
+    if "cached" in modes and not hasattr(module.PauseAtHeightOptions, "_layer_indices"):
+        modes.remove("cached") #Versions without the cache of layer indices.
+    results = runBenchmarks(module, args.layers, args.lines_per_layer, args.repeat, modes)
+    del Logger.messages[:]
+    report = {
+        "script": os.path.abspath(args.script),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "layers": args.layers,
+        "lines_per_layer": args.lines_per_layer,
+        "repeat": args.repeat,
+        "results": results
+    }
+    if args.output:
+        with open(args.output, "w", encoding = "utf-8") as output_file:
+            json.dump(report, output_file, indent = 2)
+    else:
+        json.dump(report, sys.stdout, indent = 2)
+        sys.stdout.write("\n")
+    if args.compare:
+        with open(args.compare, encoding = "utf-8") as compare_file:
+            if compareResults(results, json.load(compare_file), args.tolerance) > 0:
+                return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
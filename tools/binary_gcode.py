@@ -0,0 +1,296 @@
+##  Writes G-code as gzip compressed G-code or as Prusa's binary G-code
+#   (.bgcode), to test PauseAtHeightOptions on those formats.
+#
+#   The binary G-code is written after Prusa's published specification of
+#   the format, with the metadata and thumbnail blocks that PrusaSlicer writes
+#   and the G-code in blocks of at most 64 kB, optionally compressed (deflate
+#   or heatshrink) and encoded with MeatPack. Heatshrink uses the heatshrink2
+#   package if it is installed, and a simple encoder in Python otherwise.
+#
+#   python tools/binary_gcode.py input.gcode -o output.bgcode --compression heatshrink_12_4 --encoding meatpack
+#   python tools/binary_gcode.py input.gcode -o output.gcode.gz
+#
+#   With --verify it instead converts synthetic G-code to every format, runs
+#   the script on each and checks that the result is the same G-code as for
+#   the plain text, that the binary G-code has valid checksums and that the
+#   blocks without pauses were copied unchanged.
+#
+#   python tools/binary_gcode.py --verify -s pause_height="5, 10"
+
+import argparse
+import gzip
+import io
+import json
+import os
+import struct
+import sys
+import tempfile
+import zlib
+from typing import Any, Dict, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from cura_stubs import Logger, createScript, loadScript
+from synthetic_gcode import generateGCode
+
+try:
+    import heatshrink2
+except ImportError:
+    heatshrink2 = None
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PauseAtHeightOptions.py")
+
+MAGIC = b"GCDE"
+VERSION = 1
+CHECKSUM_CRC32 = 1
+
+BLOCK_FILE_METADATA = 0
+BLOCK_GCODE = 1
+BLOCK_SLICER_METADATA = 2
+BLOCK_PRINTER_METADATA = 3
+BLOCK_PRINT_METADATA = 4
+BLOCK_THUMBNAIL = 5
+
+COMPRESSIONS = {"none": 0, "deflate": 1, "heatshrink_11_4": 2, "heatshrink_12_4": 3}
+ENCODINGS = {"none": 0, "meatpack": 2} #MeatPack that keeps the comments, since the script needs the ;LAYER: comments.
+
+MEATPACK_CHARACTERS = "0123456789. \nGX"
+MEATPACK_SIGNAL = 0xFF
+MEATPACK_ENABLE_PACKING = 251
+MEATPACK_DISABLE_PACKING = 250
+MEATPACK_ENABLE_NO_SPACES = 247
+
+##  Compresses data with heatshrink: literal bytes and references back into
+#   the data, as a stream of bits.
+def heatshrinkCompress(data: bytes, window_bits: int, lookahead_bits: int) -> bytes:
+    if heatshrink2 is not None:
+        return heatshrink2.compress(data, window_sz2 = window_bits, lookahead_sz2 = lookahead_bits)
+    window = 1 << window_bits
+    max_length = 1 << lookahead_bits
+    reference_bits = 1 + window_bits + lookahead_bits
+    minimum_length = reference_bits // 9 + 1 #Shorter references take more bits than literals.
+    recent = {} # type: Dict[bytes, List[int]] #Last positions of every three bytes.
+    bits = 0
+    bit_count = 0
+    output = bytearray()
+    position = 0
+    while position < len(data):
+        best_length = 0
+        best_distance = 0
+        for start in reversed(recent.get(data[position:position + 3], [])):
+            if position - start > window:
+                break
+            length = 0
+            while length < max_length and position + length < len(data) and data[start + length] == data[position + length]:
+                length += 1
+            if length > best_length:
+                best_length = length
+                best_distance = position - start
+                if length == max_length:
+                    break
+        if best_length >= minimum_length:
+            bits = (bits << reference_bits) | ((best_distance - 1) << lookahead_bits) | (best_length - 1)
+            bit_count += reference_bits
+            step = best_length
+        else:
+            bits = (bits << 9) | 0x100 | data[position]
+            bit_count += 9
+            step = 1
+        for index in range(position, min(position + step, len(data) - 2)):
+            positions = recent.setdefault(data[index:index + 3], [])
+            positions.append(index)
+            if len(positions) > 16:
+                del positions[0]
+        position += step
+        while bit_count >= 8:
+            bit_count -= 8
+            output.append((bits >> bit_count) & 0xFF)
+        bits &= (1 << bit_count) - 1
+    if bit_count:
+        output.append((bits << (8 - bit_count)) & 0xFF)
+    return bytes(output)
+
+##  Encodes G-code with MeatPack, two characters in a byte where it can.
+#   Comments are written without packing. With no_spaces, the spaces are left
+#   out of the other lines, as PrusaSlicer does, so that E can be packed.
+def meatpackEncode(text: str, no_spaces: bool) -> bytes:
+    characters = MEATPACK_CHARACTERS.replace(" ", "E") if no_spaces else MEATPACK_CHARACTERS
+    codes = {ord(character): code for code, character in enumerate(characters)}
+    output = bytearray([MEATPACK_SIGNAL, MEATPACK_SIGNAL, MEATPACK_ENABLE_PACKING])
+    if no_spaces:
+        output += bytes([MEATPACK_SIGNAL, MEATPACK_SIGNAL, MEATPACK_ENABLE_NO_SPACES])
+    for line in io.StringIO(text, newline = ""):
+        if line.lstrip().startswith(";") or not line.endswith("\n") or "\r" in line:
+            output += bytes([MEATPACK_SIGNAL, MEATPACK_SIGNAL, MEATPACK_DISABLE_PACKING])
+            output += line.encode("utf-8", "surrogateescape")
+            output += bytes([MEATPACK_SIGNAL, MEATPACK_SIGNAL, MEATPACK_ENABLE_PACKING])
+            continue
+        if no_spaces:
+            line = line.replace(" ", "")
+        line_bytes = line.encode("utf-8", "surrogateescape") #Bytes that can't be packed follow as whole bytes.
+        for index in range(0, len(line_bytes), 2):
+            first = line_bytes[index]
+            if first == ord("\n"): #The decoder ignores the other half of a byte with a new line.
+                output.append(codes[first])
+                break
+            second = line_bytes[index + 1]
+            first_code = codes.get(first, 0xF)
+            second_code = codes.get(second, 0xF)
+            output.append(first_code | (second_code << 4))
+            if first_code == 0xF:
+                output.append(first)
+            if second_code == 0xF:
+                output.append(second)
+    return bytes(output)
+
+##  Creates one block of binary G-code.
+def createBlock(block_type: int, compression: int, parameters: bytes, data: bytes) -> bytes:
+    if compression == COMPRESSIONS["deflate"]:
+        compressed = zlib.compress(data)
+    elif compression == COMPRESSIONS["heatshrink_11_4"]:
+        compressed = heatshrinkCompress(data, 11, 4)
+    elif compression == COMPRESSIONS["heatshrink_12_4"]:
+        compressed = heatshrinkCompress(data, 12, 4)
+    else:
+        compressed = data
+    if compression:
+        header = struct.pack("<HHII", block_type, compression, len(data), len(compressed))
+    else:
+        header = struct.pack("<HHI", block_type, compression, len(data))
+    block = header + parameters + compressed
+    return block + struct.pack("<I", zlib.crc32(block))
+
+##  Converts G-code text to binary G-code.
+#   \param block_size: Largest number of bytes of G-code in one block.
+def toBinaryGCode(text: str, compression: str = "deflate", encoding: str = "none", no_spaces: bool = False, block_size: int = 65535) -> bytes:
+    compression_type = COMPRESSIONS[compression]
+    metadata_compression = COMPRESSIONS["deflate"] if compression_type else 0 #PrusaSlicer never uses heatshrink for the metadata.
+    ini_encoding = struct.pack("<H", 0)
+    blocks = [
+        MAGIC + struct.pack("<IH", VERSION, CHECKSUM_CRC32),
+        createBlock(BLOCK_FILE_METADATA, metadata_compression, ini_encoding, b"Producer=synthetic_gcode\n"),
+        createBlock(BLOCK_PRINTER_METADATA, metadata_compression, ini_encoding, b"printer_model=MK4\nfilament_type=PLA\nnozzle_diameter=0.4\n"),
+        createBlock(BLOCK_THUMBNAIL, 0, struct.pack("<HHH", 0, 16, 16), b"\x89PNG\r\n\x1a\n" + bytes(range(64))),
+        createBlock(BLOCK_PRINT_METADATA, metadata_compression, ini_encoding, b"estimated printing time (normal mode)=1h 2m 3s\n"),
+        createBlock(BLOCK_SLICER_METADATA, metadata_compression, ini_encoding, b"layer_height=0.2\n")
+    ]
+    data = text.encode("utf-8", "surrogateescape")
+    parameters = struct.pack("<H", ENCODINGS[encoding])
+    start = 0
+    while start < len(data):
+        end = min(start + block_size, len(data))
+        if end < len(data):
+            end = data.rfind(b"\n", start, end) + 1 or end
+        piece = data[start:end]
+        if encoding == "meatpack":
+            piece = meatpackEncode(piece.decode("utf-8", "surrogateescape"), no_spaces)
+        blocks.append(createBlock(BLOCK_GCODE, compression_type, parameters, piece))
+        start = end
+    return b"".join(blocks)
+
+##  Gets the G-code text of binary G-code, checking the checksums.
+#   \return The text and the blocks.
+def fromBinaryGCode(module: Any, data: bytes) -> Tuple[str, List[Any]]:
+    stream = io.BytesIO(data)
+    header = stream.read(10)
+    assert header[:4] == MAGIC, "Not binary G-code."
+    checksum_type = struct.unpack("<H", header[8:])[0]
+    blocks = list(module._readBinaryBlocks(stream, checksum_type))
+    text = "".join(module._decodeGCodeBlock(block) for block in blocks if block.type == BLOCK_GCODE)
+    return text, blocks
+
+##  Runs the script on plain text G-code, returning the result.
+def runText(module: Any, settings: Dict[str, Any], text: str) -> str:
+    script = createScript(module, settings)
+    return "".join(script.executeStream(module.readLayers(io.StringIO(text, newline = ""))))
+
+##  Runs the script on a file the way the command line does.
+def runFile(module: Any, settings: Dict[str, Any], directory: str, name: str, data: bytes) -> bytes:
+    input_path = os.path.join(directory, "input_" + name)
+    output_path = os.path.join(directory, "output_" + name)
+    with open(input_path, "wb") as input_file:
+        input_file.write(data)
+    module.processFile(input_path, output_path, settings)
+    with open(output_path, "rb") as output_file:
+        return output_file.read()
+
+##  Converts synthetic G-code to every format, runs the script on them and
+#   checks the results.
+#   \return The number of failed checks.
+def verify(module: Any, settings: Dict[str, Any], layers: int, lines_per_layer: int) -> int:
+    failures = 0
+    text = "".join(generateGCode(layers = layers, lines_per_layer = lines_per_layer))
+    expected = runText(module, settings, text)
+    with tempfile.TemporaryDirectory() as directory:
+        output = runFile(module, settings, directory, "print.gcode.gz", gzip.compress(text.encode("utf-8")))
+        if output[:2] != b"\x1f\x8b" or gzip.decompress(output).decode("utf-8") != expected:
+            failures += 1
+            sys.stderr.write("gzip: output differs\n")
+
+        variants = [(compression, encoding, no_spaces) for compression in sorted(COMPRESSIONS) for encoding in sorted(ENCODINGS) for no_spaces in ((False, True) if encoding == "meatpack" else (False,))]
+        for compression, encoding, no_spaces in variants:
+            name = "{compression}/{encoding}{spaces}".format(compression = compression, encoding = encoding, spaces = " without spaces" if no_spaces else "")
+            binary = toBinaryGCode(text, compression, encoding, no_spaces)
+            input_text, input_blocks = fromBinaryGCode(module, binary)
+            if not no_spaces and input_text != text:
+                failures += 1
+                sys.stderr.write("{name}: decoding the input differs from the text\n".format(name = name))
+                continue
+            try:
+                output_text, output_blocks = fromBinaryGCode(module, runFile(module, settings, directory, "print.bgcode", binary))
+            except (AssertionError, ValueError) as e:
+                failures += 1
+                sys.stderr.write("{name}: invalid output: {error}\n".format(name = name, error = e))
+                continue
+            if output_text != runText(module, settings, input_text):
+                failures += 1
+                sys.stderr.write("{name}: output differs\n".format(name = name))
+            output_raw = set(block.raw for block in output_blocks)
+            copied = sum(1 for block in input_blocks if block.raw in output_raw)
+            if any(block.raw not in output_raw for block in input_blocks if block.type != BLOCK_GCODE):
+                failures += 1
+                sys.stderr.write("{name}: metadata or thumbnail blocks changed\n".format(name = name))
+            sys.stderr.write("{name:40} {size:10} bytes, {copied} blocks copied, {changed} rewritten\n".format(name = name, size = len(binary), copied = copied, changed = len(input_blocks) - copied))
+    return failures
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description = "Convert G-code to gzip or binary G-code, or verify the script on those formats.")
+    parser.add_argument("input", nargs = "?", help = "G-code file to convert.")
+    parser.add_argument("-o", "--output", help = "File to write: .gcode.gz for gzip, .bgcode for binary G-code.")
+    parser.add_argument("--compression", choices = sorted(COMPRESSIONS), default = "deflate", help = "Compression of the G-code blocks of binary G-code.")
+    parser.add_argument("--encoding", choices = sorted(ENCODINGS), default = "none", help = "Encoding of the G-code blocks of binary G-code.")
+    parser.add_argument("--no-spaces", action = "store_true", help = "Leave the spaces out of MeatPack encoded G-code.")
+    parser.add_argument("--block-size", type = int, default = 65535, help = "Largest number of bytes of G-code in a block.")
+    parser.add_argument("--verify", action = "store_true", help = "Verify the script on every format with synthetic G-code.")
+    parser.add_argument("--script", default = SCRIPT_PATH, help = "Path of the PauseAtHeightOptions.py to verify.")
+    parser.add_argument("--layers", type = int, default = 100)
+    parser.add_argument("--lines-per-layer", type = int, default = 500)
+    parser.add_argument("-s", "--set", dest = "values", action = "append", default = [], metavar = "KEY=VALUE", help = "Setting of the script for --verify.")
+    args = parser.parse_args(argv)
+
+    if args.verify:
+        settings = {"pause_at": "height", "pause_height": 0.3 + (args.layers // 2) * 0.2, "layer_height_0": 0.3} # type: Dict[str, Any]
+        for value in args.values:
+            key, _, setting_value = value.partition("=")
+            try:
+                settings[key.strip()] = json.loads(setting_value) #Numbers and booleans as in a settings file.
+            except ValueError:
+                settings[key.strip()] = setting_value.strip()
+        failures = verify(loadScript(args.script), settings, args.layers, args.lines_per_layer)
+        del Logger.messages[:]
+        sys.stderr.write("{result}\n".format(result = "{count} checks failed".format(count = failures) if failures else "All checks passed"))
+        return 1 if failures else 0
+
+    if not args.input or not args.output:
+        parser.error("Give an input and an output file, or --verify.")
+    with open(args.input, encoding = "utf-8", errors = "surrogateescape", newline = "") as input_file:
+        text = input_file.read()
+    if args.output.endswith(".gz"):
+        data = gzip.compress(text.encode("utf-8", "surrogateescape"))
+    else:
+        data = toBinaryGCode(text, args.compression, args.encoding, args.no_spaces, args.block_size)
+    with open(args.output, "wb") as output_file:
+        output_file.write(data)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+##  Lightweight stand-ins for the parts of Cura that post processing scripts
+#   use, so that any version of PauseAtHeightOptions.py can be loaded and run
+#   outside of Cura, also versions that don't have their own stand-ins.
+#
+#   loadScript() loads the script as a module of a stand-in post processing
+#   plugin package, so that its "from ..Script import Script" finds the Script
+#   class below, and registers stand-in UM.Application and UM.Logger modules.
+#
+#   PauseAtHeightOptions.py has stand-ins of its own for the command line, but
+#   the tools can't use those: the reference copy in tools/reference and older
+#   versions given with --script don't have them, and several versions are
+#   loaded side by side, which have to share one global stack for
+#   createScript() to set the printer settings of. These stand-ins also differ
+#   where the tools need it: Logger keeps the messages instead of writing
+#   them to stderr, and setSettingValues() takes any key and leaves the values
+#   as they are given, since older versions have fewer settings of other
+#   types.
+
+import importlib.util
+import json
+import re
+import sys
+import types
+from typing import Any, Dict, List, Tuple
+
+_PACKAGE = "_cura_stubs_plugin"
+
+##  Stand-in for the post processing plugin's Script base class.
+class Script:
+    def __init__(self) -> None:
+        self._settings = {} # type: Dict[str, Any]
+        for key, setting in json.loads(self.getSettingDataString())["settings"].items():
+            self._settings[key] = setting.get("default_value")
+
+    def getSettingDataString(self) -> str:
+        raise NotImplementedError()
+
+    def getSettingValueByKey(self, key: str) -> Any:
+        return self._settings.get(key)
+
+    def setSettingValues(self, values: Dict[str, Any]) -> None:
+        self._settings.update(values)
+
+    ##  Same as Script.getValue in Cura.
+    def getValue(self, line: str, key: str, default = None) -> Any:
+        if not key in line or (";" in line and line.find(key) > line.find(";")):
+            return default
+        sub_part = line[line.find(key) + 1:]
+        m = re.search("^-?[0-9]+\\.?[0-9]*", sub_part)
+        if m is None:
+            return default
+        try:
+            return int(m.group(0))
+        except ValueError: #Not an integer.
+            try:
+                return float(m.group(0))
+            except ValueError: #Not a number at all.
+                return default
+
+    ##  Same as Script.putValue in Cura.
+    def putValue(self, line: str = "", **kwargs) -> str:
+        comment = ""
+        if ";" in line:
+            comment = line[line.find(";"):]
+            line = line[:line.find(";")]
+        for part in line.split(" "):
+            if part == "":
+                continue
+            parameter = part[0]
+            if parameter in kwargs:
+                continue
+            kwargs[parameter] = part[1:]
+        result = ""
+        for priority_key in ["G", "M", "T", "S", "F", "X", "Y", "Z", "E"]:
+            if priority_key in kwargs:
+                if result != "":
+                    result += " "
+                result += priority_key + str(kwargs[priority_key])
+                del kwargs[priority_key]
+        for key, value in kwargs.items():
+            if result != "":
+                result += " "
+            result += key + str(value)
+        if comment != "":
+            if result != "":
+                result += " "
+            result += ";" + comment
+        return result
+
+class GlobalStack:
+    def __init__(self) -> None:
+        self.values = {
+            "machine_firmware_retract": False,
+            "machine_nozzle_temp_enabled": True,
+            "layer_height_0": 0.3,
+            "machine_acceleration": 4000,
+            "machine_width": 235,
+            "machine_depth": 235,
+            "machine_center_is_zero": False
+        } # type: Dict[str, Any]
+
+    def getProperty(self, key: str, property_name: str) -> Any:
+        return self.values.get(key)
+
+class Application:
+    _instance = None
+
+    def __init__(self) -> None:
+        self._global_stack = GlobalStack()
+
+    @classmethod
+    def getInstance(cls) -> "Application":
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def getGlobalContainerStack(self) -> GlobalStack:
+        return self._global_stack
+
+##  Stand-in for Uranium's logger that keeps the messages instead of printing
+#   them.
+class Logger:
+    messages = [] # type: List[Tuple[str, str]]
+
+    @classmethod
+    def log(cls, log_type: str, message: str, *args: Any) -> None:
+        cls.messages.append((log_type, message % args if args else message))
+
+def _registerModules() -> None:
+    if _PACKAGE in sys.modules:
+        return
+    package = types.ModuleType(_PACKAGE)
+    package.__path__ = []
+    script_module = types.ModuleType(_PACKAGE + ".Script")
+    script_module.Script = Script
+    scripts_package = types.ModuleType(_PACKAGE + ".scripts")
+    scripts_package.__path__ = []
+    um = types.ModuleType("UM")
+    um.__path__ = []
+    um_application = types.ModuleType("UM.Application")
+    um_application.Application = Application
+    um_logger = types.ModuleType("UM.Logger")
+    um_logger.Logger = Logger
+    sys.modules.update({
+        _PACKAGE: package,
+        _PACKAGE + ".Script": script_module,
+        _PACKAGE + ".scripts": scripts_package,
+        "UM": um,
+        "UM.Application": um_application,
+        "UM.Logger": um_logger
+    })
+
+##  Loads a version of PauseAtHeightOptions.py as if Cura loaded it.
+#   \param path: Path of the script.
+#   \param name: Module name to load it as, to load several versions side by
+#   side.
+def loadScript(path: str, name: str = "PauseAtHeightOptions") -> Any:
+    _registerModules()
+    spec = importlib.util.spec_from_file_location(_PACKAGE + ".scripts." + name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+##  Clears the caches that the script's class shares between runs, so that
+#   every run starts the same. Versions that don't have some of the caches
+#   are fine.
+def clearCaches(module: Any) -> None:
+    for name in ("_pause_templates", "_layer_indices", "_compiled_melodies"):
+        cache = getattr(module.PauseAtHeightOptions, name, None)
+        if cache is not None:
+            cache.clear()
+
+##  Creates a script from a loaded module with the given settings.
+#   \param settings: Values of the script's settings by key. The printer
+#   settings machine_firmware_retract, machine_nozzle_temp_enabled and
+#   layer_height_0 are accepted too and change the global stack.
+def createScript(module: Any, settings: Dict[str, Any]) -> Any:
+    global_values = Application.getInstance().getGlobalContainerStack().values
+    script = module.PauseAtHeightOptions()
+    script_values = {}
+    for key, value in settings.items():
+        if key in global_values:
+            global_values[key] = value
+        else:
+            script_values[key] = value
+    script.setSettingValues(script_values)
+    return script
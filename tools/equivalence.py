@@ -0,0 +1,273 @@
+##  Checks that every code path of PauseAtHeightOptions gives exactly the same
+#   G-code as the original execute().
+#
+#   tools/reference/PauseAtHeightOptions.py is a copy of the script from the
+#   first commit, before any optimization, and is never changed. It inserts
+#   one pause per call and only has the settings of that time, so every case
+#   has a single pause point, and the settings that came later keep their
+#   defaults in the script under test. For thousands of random G-code files
+#   from synthetic_gcode.generateRandomGCode() with random settings, the
+#   harness runs the reference's execute() and every path of the script
+#   under test:
+#   execute() with empty and with filled caches, executeStream(),
+#   executeInBackground(), execute() without NumPy and execute() with the
+#   layers read in several processes. Any difference in the output, or in
+#   the type of error raised, is a failure, unless it is one of the
+#   KNOWN_DIFFERENCES, which are counted and reported separately.
+#
+#   A failing case is shrunk to a minimal one by leaving out layers, then
+#   lines, then settings, for as long as the path still differs from the
+#   reference. It is written to a JSON file that --replay runs again.
+#
+#   python tools/equivalence.py --cases 5000
+#   python tools/equivalence.py --replay equivalence_failure.json
+
+import argparse
+import json
+import os
+import random
+import sys
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from cura_stubs import Logger, clearCaches, createScript, loadScript
+from synthetic_gcode import generateRandomGCode
+
+TOOLS_PATH = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_PATH = os.path.join(os.path.dirname(TOOLS_PATH), "PauseAtHeightOptions.py")
+REFERENCE_PATH = os.path.join(TOOLS_PATH, "reference", "PauseAtHeightOptions.py")
+
+PATHS = ("execute", "cached", "stream", "background", "no_numpy", "parallel")
+PARALLEL_EVERY = 20 #Starting processes is slow, so the parallel path only runs for every so many cases.
+
+Outcome = Tuple[str, str] #("output", the G-code) or ("error", the type and message of the error).
+
+##  Differences from the reference that are accepted, with the reason, and a
+#   function of the path and both outcomes that tells whether a difference is
+#   this one.
+KNOWN_DIFFERENCES = [
+    ("Redone layers before the first layer: execute() takes them from the end of the list like the reference, the streaming path can't read ahead and raises an error",
+        lambda path, expected, actual: path == "stream" and expected[0] == "output" and actual[0] == "error" and actual[1].startswith("IndexError: Layer -") and actual[1].endswith("is not in the window of kept layers."))
+] # type: List[Tuple[str, Callable[[str, Outcome, Outcome], bool]]]
+
+##  Picks random settings for G-code from generateRandomGCode(), with the
+#   pause point in or around the print.
+#   \param keys: The settings that the reference has. Others are left out.
+def randomSettings(seed: int, data: List[str], keys: List[str]) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    layer_count = sum(layer.count(";LAYER:") for layer in data)
+    settings = {
+        "pause_at": rng.choice(["height", "layer_no"]),
+        "pause_height": "{height:.2f}".format(height = rng.uniform(0, 0.3 * layer_count + 1)),
+        "pause_layer": str(rng.randint(-3, layer_count + 1)),
+        "play_extended_melody": rng.choice(["Y", "N"]),
+        "head_park_x": rng.choice([0, 10.5]),
+        "head_park_y": rng.choice([0, 200]),
+        "park_position": rng.choice(["fixed", "fixed", "bounding_box", "convex_hull"]),
+        "park_clearance": rng.choice([0, 10, 50]),
+        "retraction_amount": rng.choice([0, 0, 5]),
+        "retraction_speed": 25,
+        "extrude_amount": rng.choice([0, 30]),
+        "extrude_speed": 3.3333,
+        "redo_layers": rng.choice([0, 0, 1, 3]),
+        "standby_temperature": rng.choice([0, 170]),
+        "wait_on_pause_click": rng.choice([0, 10]),
+        "display_text": rng.choice(["", "Swap!"]),
+        "estimate_time": rng.random() < 0.2,
+        "verify_pauses": rng.random() < 0.2,
+        "machine_firmware_retract": rng.random() < 0.3,
+        "machine_nozzle_temp_enabled": rng.random() < 0.8,
+        "layer_height_0": rng.choice([0.2, 0.3]),
+        "machine_acceleration": rng.choice([500, 4000]),
+        "machine_width": 235,
+        "machine_depth": 235,
+        "machine_center_is_zero": False
+    }
+    return {key: value for key, value in settings.items() if key in keys}
+
+##  Runs a function and gets what it returned or the type of error it raised.
+def outcome(run: Callable[[], List[str]]) -> Outcome:
+    try:
+        return ("output", "".join(run()))
+    except Exception as e:
+        return ("error", "{type}: {message}".format(type = type(e).__name__, message = e))
+
+##  Whether two outcomes are the same: the same G-code, or errors of the same
+#   type. The messages of errors may differ.
+def sameOutcome(expected: Outcome, actual: Outcome) -> bool:
+    if expected[0] == "error" and actual[0] == "error":
+        return expected[1].partition(":")[0] == actual[1].partition(":")[0]
+    return expected == actual
+
+##  Gets the reason for a known difference, or None if it's not known.
+def knownDifference(path: str, expected: Outcome, actual: Outcome) -> Optional[str]:
+    for reason, matches in KNOWN_DIFFERENCES:
+        if matches(path, expected, actual):
+            return reason
+    return None
+
+##  The script under test, loaded once with NumPy and once without.
+class Subject:
+    def __init__(self, script_path: str, reference_path: str) -> None:
+        self.reference = loadScript(reference_path, "PauseAtHeightOptionsReference")
+        self.module = loadScript(script_path)
+        self.module_without_numpy = loadScript(script_path, "PauseAtHeightOptionsWithoutNumPy")
+        self.module_without_numpy.numpy = None
+        self.keys = list(json.loads(self.reference.PauseAtHeightOptions().getSettingDataString())["settings"])
+        self.keys += ["machine_firmware_retract", "machine_nozzle_temp_enabled", "layer_height_0", "machine_acceleration", "machine_width", "machine_depth", "machine_center_is_zero"]
+
+    def runReference(self, settings: Dict[str, Any], data: List[str]) -> Outcome:
+        clearCaches(self.reference)
+        return outcome(lambda: createScript(self.reference, settings).execute(list(data)))
+
+    def runPath(self, path: str, settings: Dict[str, Any], data: List[str]) -> Outcome:
+        module = self.module_without_numpy if path == "no_numpy" else self.module
+        clearCaches(module)
+        if path == "parallel":
+            settings = dict(settings, scan_processes = 2)
+        script = createScript(module, settings)
+        if path == "cached":
+            outcome(lambda: script.execute(list(data)))
+            return outcome(lambda: createScript(module, settings).execute(list(data)))
+        if path == "stream":
+            return outcome(lambda: list(script.executeStream(iter(data))))
+        if path == "background":
+            return outcome(lambda: script.executeInBackground(data, chunk_layers = 3).getResult())
+        return outcome(lambda: script.execute(list(data)))
+
+    ##  Whether a path gives something else than the reference, other than
+    #   a known difference.
+    def differs(self, path: str, settings: Dict[str, Any], data: List[str]) -> bool:
+        expected = self.runReference(settings, data)
+        actual = self.runPath(path, settings, data)
+        return not sameOutcome(expected, actual) and knownDifference(path, expected, actual) is None
+
+##  Leaves out as many items as possible while the failure remains, trying
+#   large pieces first and then ever smaller ones.
+def shrinkList(items: List[Any], fails: Callable[[List[Any]], bool]) -> List[Any]:
+    size = max(len(items) // 2, 1)
+    while items:
+        start = 0
+        removed = False
+        while start < len(items):
+            candidate = items[:start] + items[start + size:]
+            if fails(candidate):
+                items = candidate
+                removed = True
+            else:
+                start += size
+        if size == 1 and not removed:
+            break
+        if not removed:
+            size = max(size // 2, 1)
+    return items
+
+##  Shrinks a failing case to a minimal one: first the layers, then the
+#   lines of every layer, then the settings, which are set back to the
+#   defaults of the script one at a time.
+def shrink(subject: Subject, path: str, settings: Dict[str, Any], data: List[str]) -> Tuple[Dict[str, Any], List[str]]:
+    data = shrinkList(list(data), lambda candidate: subject.differs(path, settings, candidate))
+    for position in range(len(data)):
+        lines = data[position].splitlines(True)
+        def fails(candidate: List[str]) -> bool:
+            return subject.differs(path, settings, data[:position] + ["".join(candidate)] + data[position + 1:])
+        data[position] = "".join(shrinkList(lines, fails))
+    compact = [layer for layer in data if layer]
+    if compact != data and subject.differs(path, settings, compact):
+        data = compact
+
+    defaults = {key: setting.get("default_value") for key, setting in json.loads(subject.module.PauseAtHeightOptions().getSettingDataString())["settings"].items()}
+    for key in list(settings):
+        if key in defaults and settings[key] != defaults[key]:
+            candidate = dict(settings, **{key: defaults[key]})
+            if subject.differs(path, candidate, data):
+                settings = candidate
+    return settings, data
+
+##  Describes where the outcome of a path first differs from the reference.
+def describeDifference(expected: Outcome, actual: Outcome) -> str:
+    if expected[0] != "output" or actual[0] != "output":
+        return "reference gave {expected}, path gave {actual}".format(expected = expected[1] if expected[0] == "error" else expected[0], actual = actual[1] if actual[0] == "error" else actual[0])
+    expected_lines = expected[1].splitlines()
+    actual_lines = actual[1].splitlines()
+    for number, (expected_line, actual_line) in enumerate(zip(expected_lines, actual_lines)):
+        if expected_line != actual_line:
+            return "line {number}: expected {expected!r}, got {actual!r}".format(number = number + 1, expected = expected_line, actual = actual_line)
+    return "{expected} lines expected, got {actual}".format(expected = len(expected_lines), actual = len(actual_lines))
+
+##  Reports a failing case and writes it to a file.
+def reportFailure(subject: Subject, path: str, settings: Dict[str, Any], data: List[str], output_path: str) -> None:
+    difference = describeDifference(subject.runReference(settings, data), subject.runPath(path, settings, data))
+    with open(output_path, "w", encoding = "utf-8") as output_file:
+        json.dump({"path": path, "settings": settings, "data": data}, output_file, indent = 2)
+    sys.stderr.write("{path}: {difference}\nMinimal case ({layers} layers, {lines} lines) written to {output}\n".format(path = path, difference = difference, layers = len(data), lines = sum(layer.count("\n") for layer in data), output = output_path))
+
+##  Runs random cases until one fails.
+#   \param known: Counts the known differences that were found by reason.
+#   \return The number of cases run and the first failure as (case, path,
+#   settings, data), or None.
+def runCases(subject: Subject, cases: int, first_seed: int, paths: List[str], known: Dict[str, int]) -> Tuple[int, Optional[Tuple[int, str, Dict[str, Any], List[str]]]]:
+    for case in range(first_seed, first_seed + cases):
+        data = generateRandomGCode(case)
+        settings = randomSettings(case, data, subject.keys)
+        expected = subject.runReference(settings, data)
+        for path in paths:
+            if path == "parallel" and case % PARALLEL_EVERY != 0:
+                continue
+            actual = subject.runPath(path, settings, data)
+            if sameOutcome(expected, actual):
+                continue
+            reason = knownDifference(path, expected, actual)
+            if reason is None:
+                return case - first_seed + 1, (case, path, settings, data)
+            known[reason] = known.get(reason, 0) + 1
+        del Logger.messages[:]
+        if (case - first_seed + 1) % 500 == 0:
+            sys.stderr.write("{count} cases passed\n".format(count = case - first_seed + 1))
+    return cases, None
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description = "Compare every code path of PauseAtHeightOptions with a frozen reference on random G-code.")
+    parser.add_argument("--script", default = SCRIPT_PATH, help = "Path of the PauseAtHeightOptions.py to test.")
+    parser.add_argument("--reference", default = REFERENCE_PATH, help = "Path of the reference PauseAtHeightOptions.py.")
+    parser.add_argument("--cases", type = int, default = 2000)
+    parser.add_argument("--seed", type = int, default = 0, help = "Seed of the first case. Every case has its own seed, so a failing case can be run again on its own.")
+    parser.add_argument("--paths", default = ",".join(PATHS), help = "Comma-separated code paths to test: " + ", ".join(PATHS) + ".")
+    parser.add_argument("--output", default = "equivalence_failure.json", help = "File to write the minimal failing case to.")
+    parser.add_argument("--replay", help = "Run a case written by an earlier run again.")
+    args = parser.parse_args(argv)
+
+    subject = Subject(args.script, args.reference)
+    if args.replay:
+        with open(args.replay, encoding = "utf-8") as case_file:
+            case = json.load(case_file)
+        expected = subject.runReference(case["settings"], case["data"])
+        actual = subject.runPath(case["path"], case["settings"], case["data"])
+        del Logger.messages[:]
+        if sameOutcome(expected, actual):
+            sys.stderr.write("{path}: same as the reference\n".format(path = case["path"]))
+            return 0
+        sys.stderr.write("{path}: {difference}\n".format(path = case["path"], difference = describeDifference(expected, actual)))
+        return 1
+
+    paths = [path.strip() for path in args.paths.split(",") if path.strip()]
+    for path in paths:
+        if path not in PATHS:
+            parser.error("Unknown path: {path}".format(path = path))
+    known = {} # type: Dict[str, int]
+    count, failure = runCases(subject, args.cases, args.seed, paths, known)
+    for reason, times in known.items():
+        sys.stderr.write("Known difference in {times} cases: {reason}\n".format(times = times, reason = reason))
+    if failure is None:
+        del Logger.messages[:]
+        sys.stderr.write("All {count} cases gave the same G-code as the reference\n".format(count = count))
+        return 0
+    case, path, settings, data = failure
+    sys.stderr.write("Case {case} ({count} run) differs on the {path} path; shrinking it\n".format(case = case, count = count, path = path))
+    settings, data = shrink(subject, path, settings, data)
+    reportFailure(subject, path, settings, data, args.output)
+    del Logger.messages[:]
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import random
+from typing import List
+
+##  Generates sliced G-code that looks like Cura's output, as the list of
+#   layers that post processing scripts get.
+#
+#   The first item holds the header, the second the start code, then one item
+#   per layer (raft layers first, with negative numbers) and finally the end
+#   code.
+#   \param layers: Number of layers of the model, without the raft.
+#   \param lines_per_layer: Number of moves per layer.
+#   \param raft_layers: Number of raft layers below the model.
+#   \param extruders: Number of extruders to switch between.
+#   \param griffin: Whether to write Griffin flavoured G-code, as for
+#   Ultimaker printers, instead of Marlin.
+#   \param layer_height: Height of every layer after the first.
+#   \param initial_layer_height: Height of the first layer.
+#   \param seed: Seed for the random moves, so that the G-code can be
+#   generated again.
+def generateGCode(layers: int = 200, lines_per_layer: int = 500, raft_layers: int = 0, extruders: int = 1, griffin: bool = False, layer_height: float = 0.2, initial_layer_height: float = 0.3, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    flavor = "Griffin" if griffin else "Marlin"
+    data = [";FLAVOR:{flavor}\n;TIME:{time}\n;Filament used: 12.3456m\n;Layer height: {layer_height}\n;Generated with Cura_SteamEngine 4.8.0\n".format(flavor = flavor, time = layers * 60, layer_height = layer_height)]
+
+    start_code = ["M140 S60", "M105", "M190 S60", "M104 S200", "M105", "M109 S200", "M82 ;absolute extrusion mode", "G28 ;Home", "G92 E0", "G1 Z2.0 F3000 ;Move Z Axis up"]
+    for extruder in range(1, extruders):
+        start_code.append("M104 T{extruder} S{temperature}".format(extruder = extruder, temperature = 190 + 5 * extruder))
+    if extruders > 1:
+        start_code.append("T0")
+    start_code.append(";LAYER_COUNT:{count}".format(count = layers + raft_layers))
+    data.append("\n".join(start_code) + "\n")
+
+    z = 0.0
+    e = 0.0
+    tool = 0
+    x, y = 100.0, 100.0
+    for layer_number in range(-raft_layers, layers):
+        z = round(z + (initial_layer_height if layer_number == -raft_layers else layer_height), 3)
+        lines = [";LAYER:{number}".format(number = layer_number)]
+        if extruders > 1 and layer_number > 0 and rng.random() < 0.2:
+            tool = (tool + 1) % extruders
+            lines.append("T{tool}".format(tool = tool))
+            lines.append("M109 S{temperature}".format(temperature = 200 + 5 * tool))
+        lines.append("M106 S255" if layer_number > 0 else "M107")
+        lines.append("G0 F9000 X{x:.3f} Y{y:.3f} Z{z}".format(x = x, y = y, z = z))
+        lines.append(";TYPE:WALL-OUTER")
+        for move in range(lines_per_layer):
+            x = min(max(x + rng.uniform(-20, 20), 10), 210)
+            y = min(max(y + rng.uniform(-20, 20), 10), 210)
+            if rng.random() < 0.15:
+                lines.append("G0 X{x:.3f} Y{y:.3f}".format(x = x, y = y))
+                continue
+            e += rng.uniform(0.01, 0.8)
+            if move % 50 == 0:
+                lines.append(";TYPE:{type}".format(type = rng.choice(["WALL-INNER", "SKIN", "FILL"])))
+                lines.append("G1 F{f} X{x:.3f} Y{y:.3f} E{e:.5f}".format(f = rng.choice([1200, 1500, 2400]), x = x, y = y, e = e))
+            else:
+                lines.append("G1 X{x:.3f} Y{y:.3f} E{e:.5f}".format(x = x, y = y, e = e))
+        lines.append(";TIME_ELAPSED:{time:.6f}".format(time = (layer_number + raft_layers + 1) * 60.0))
+        data.append("\n".join(lines) + "\n")
+
+    data.append(";TIME_ELAPSED:{time:.6f}\nG1 F2700 E{e:.5f}\nM140 S0\nM107\nG91\nG1 E-2 F2700\nG1 E-2 Z0.2 F2400\nG1 X5 Y5 F3000\nG1 Z10\nG90\nG1 X0 Y235\nM106 S0\nM104 S0\nM84 X Y E\n;End of Gcode\n".format(time = (layers + raft_layers) * 60.0, e = e - 6.5))
+    return data
+
+##  Generates G-code like Cura's, but with the quirks that a post processing
+#   script has to deal with picked at random, to compare versions of the
+#   script on: raft layers, several extruders, Griffin flavour, moves without
+#   a feed rate, relative extrusion and movement, resets of the E position,
+#   retractions, Z hops, comments on moves, blank lines and layers without a
+#   final newline.
+#   \param seed: Seed for the choices, so that the G-code can be generated
+#   again.
+#   \return The list of layers, like generateGCode().
+def generateRandomGCode(seed: int) -> List[str]:
+    rng = random.Random(seed)
+    layers = rng.randint(2, 30)
+    raft_layers = rng.choice([0, 0, 0, 1, 3])
+    extruders = rng.choice([1, 1, 2, 3])
+    griffin = rng.random() < 0.15
+    layer_height = rng.choice([0.1, 0.15, 0.2, 0.3])
+    initial_layer_height = rng.choice([0.2, 0.3])
+    z_offset = rng.choice([0.0, 0.0, 0.0, 1.5])
+    relative_extrusion = rng.random() < 0.2
+
+    data = [";FLAVOR:{flavor}\n;TIME:{time}\n;Generated with Cura_SteamEngine 4.8.0\n".format(flavor = "Griffin" if griffin else "Marlin", time = layers * 60)]
+    start_code = ["M140 S60", "M190 S60", "M104 S200", "M109 S{temperature}".format(temperature = rng.choice([200, 210])), "M83 ;relative extrusion mode" if relative_extrusion else "M82 ;absolute extrusion mode", "G28 ;Home", "G92 E0"]
+    if rng.random() < 0.5:
+        start_code.append("G1 Z2.0 F3000 ;Move Z Axis up")
+    for extruder in range(1, extruders):
+        start_code.append("M104 T{extruder} S{temperature}".format(extruder = extruder, temperature = 190 + 5 * extruder))
+    if extruders > 1:
+        start_code.append("T0")
+    start_code.append(";LAYER_COUNT:{count}".format(count = layers + raft_layers))
+    data.append("\n".join(start_code) + "\n")
+
+    def number(value: float) -> str: #Like Cura: no trailing zeros, sometimes an integer.
+        return "{value:.3f}".format(value = value).rstrip("0").rstrip(".")
+
+    z = z_offset
+    e = 0.0
+    tool = 0
+    for layer_number in range(-raft_layers, layers):
+        z = round(z + (initial_layer_height if layer_number == -raft_layers else layer_height), 3)
+        if layer_number == 0 and raft_layers:
+            z = round(z + rng.choice([0.0, 0.25]), 3) #Air gap above the raft.
+        lines = [";LAYER:{number}".format(number = layer_number)]
+        if rng.random() < 0.15:
+            lines.append("G1 F2700 {retract}".format(retract = "E-5" if relative_extrusion else "E{e:.5f}".format(e = e - 5)))
+            if not relative_extrusion:
+                e -= 5
+        if extruders > 1 and rng.random() < 0.3:
+            tool = rng.randrange(extruders)
+            lines.append("T{tool}".format(tool = tool))
+            lines.append("M109 S{temperature}".format(temperature = rng.choice([200, 205, 210])))
+        if rng.random() < 0.15:
+            lines.append("M104 S{temperature}".format(temperature = rng.choice([195, 215])))
+        if rng.random() < 0.1:
+            lines.append("G1 Z{z} F3000".format(z = number(z + 0.5))) #Z hop before the first move.
+        feed_rate = "F{f} ".format(f = rng.choice([1500, 3000, 9000])) if rng.random() < 0.8 else ""
+        lines.append("G0 {f}X{x} Y{y} Z{z}".format(f = feed_rate, x = number(rng.uniform(10, 200)), y = number(rng.uniform(10, 200)), z = number(z)))
+        lines.append(";TYPE:{type}".format(type = rng.choice(["SKIRT", "WALL-OUTER", "FILL", "SUPPORT"])))
+        for _ in range(rng.randint(0, 40)):
+            choice = rng.random()
+            x, y = number(rng.uniform(10, 200)), number(rng.uniform(10, 200))
+            if choice < 0.5:
+                amount = rng.uniform(0.01, 1.0)
+                e = amount if relative_extrusion else e + amount
+                feed_rate = "F{f} ".format(f = rng.choice([1200, 1500, 2700])) if rng.random() < 0.2 else ""
+                lines.append("G1 {f}X{x} Y{y} E{e:.5f}".format(f = feed_rate, x = x, y = y, e = e))
+            elif choice < 0.65:
+                lines.append("G0 X{x} Y{y}".format(x = x, y = y))
+            elif choice < 0.7:
+                if relative_extrusion:
+                    lines.extend(["G1 F2700 E-6.5", "G1 F2700 E6.5"])
+                else:
+                    lines.extend(["G1 F2700 E{e:.5f}".format(e = e - 6.5), "G1 F2700 E{e:.5f}".format(e = e)])
+            elif choice < 0.73:
+                lines.append("G92 E0")
+                e = 0.0
+            elif choice < 0.75:
+                lines.extend(["G91", "G1 Z0.4 F600", "G0 X5 Y-5", "G1 Z-0.4", "G90"])
+            elif choice < 0.77:
+                if relative_extrusion:
+                    lines.extend(["M82", "G92 E0", "G1 F1500 X{x} Y{y} E0.5".format(x = x, y = y), "G92 E0", "M83"])
+                    e = 0.0
+                else:
+                    lines.extend(["M83", "G1 F1500 X{x} Y{y} E0.5".format(x = x, y = y), "M82"])
+            elif choice < 0.8:
+                lines.append("G1 Z{z} E-0.5".format(z = number(z)))
+            elif choice < 0.82:
+                lines.append("M117 Layer {number} E".format(number = layer_number))
+            elif choice < 0.84:
+                lines.append("M106 S{speed}".format(speed = rng.choice([0, 127, 255])))
+            elif choice < 0.86:
+                lines.append(";MESH:part.stl")
+            elif choice < 0.88:
+                lines.append("")
+            elif choice < 0.9:
+                lines.append("G1 X{x} Y{y} ;travel without extruding".format(x = x, y = y))
+            elif choice < 0.92:
+                lines.append("G0 F9000 X{x} Y{y} Z{z}".format(x = x, y = y, z = number(z + 0.3)))
+                lines.append("G0 Z{z}".format(z = number(z)))
+            else:
+                lines.append(";TIME_ELAPSED:{time:.6f}".format(time = rng.uniform(0, 1000)))
+        data.append("\n".join(lines) + ("" if rng.random() < 0.05 else "\n"))
+
+    if rng.random() < 0.7:
+        data.append(";TIME_ELAPSED:{time:.6f}\nG1 F2700 E{retract}\nM140 S0\nG91\nG1 E-2 F2700\nG1 E-2 Z0.2 F2400\nG90\nG1 X0 Y235\nM104 S0\nM84 X Y E\n;End of Gcode\n".format(time = layers * 60.0, retract = "-6.5" if relative_extrusion else "{e:.5f}".format(e = e - 6.5)))
+    return data